@@ -0,0 +1,400 @@
+"""
+Compact, array based representation of a torus network topology.
+
+Nodes are identified by integer ids and the adjacency is held in CSR
+(compressed sparse row) arrays. Each edge has an id that indexes arrays
+of edge attributes such as the inter_ring and up flags.
+
+The compact topology can be built directly from a ring and node count,
+built from an existing networkx graph, and exported as the networkx graph
+used by the mininet path.
+"""
+
+import numpy
+import networkx
+
+import torus_topo
+
+# Values for the node_type array
+NODE_SAT = 0
+NODE_GROUND = 1
+
+
+class CompactTopo:
+    """
+    Torus topology held in numpy arrays.
+
+    names[id] gives the name of a node, name_to_id the reverse mapping.
+    For node id n, the neighbors are adj_nodes[adj_offsets[n]:adj_offsets[n+1]]
+    and the edges connecting them are adj_edges over the same range.
+    edge_nodes[e] holds the two node ids of edge e.
+    """
+
+    def __init__(
+        self,
+        names: list[str],
+        node_type: numpy.ndarray,
+        edge_nodes: numpy.ndarray,
+        edge_inter_ring: numpy.ndarray,
+        rings: int = 0,
+        ring_nodes: int = 0,
+        inclination: float = 0.0,
+    ) -> None:
+        self.names = names
+        self.name_to_id: dict[str, int] = {name: i for i, name in enumerate(names)}
+        self.node_type = numpy.asarray(node_type, dtype=numpy.uint8)
+        self.edge_nodes = numpy.asarray(edge_nodes, dtype=numpy.int32).reshape(-1, 2)
+        self.edge_inter_ring = numpy.asarray(edge_inter_ring, dtype=bool)
+        self.edge_up = numpy.ones(len(self.edge_nodes), dtype=bool)
+        self.rings = rings
+        self.ring_nodes = ring_nodes
+        self.inclination = inclination
+        # (first ring, rings, nodes per ring) of each torus. A constellation
+        # with several shells has one torus per shell.
+        self.shells: list[tuple[int, int, int]] = [(0, rings, ring_nodes)] if rings > 0 else []
+
+        # Ring coordinates of satellites, -1 for ground stations
+        self.ring = numpy.full(len(names), -1, dtype=numpy.int32)
+        self.ring_index = numpy.full(len(names), -1, dtype=numpy.int32)
+
+        # Orbital elements of satellites, position of ground stations
+        self.right_ascension = numpy.full(len(names), numpy.nan)
+        self.orbit_inclination = numpy.full(len(names), numpy.nan)
+        self.mean_anomaly = numpy.full(len(names), numpy.nan)
+        self.mean_motion = numpy.full(len(names), numpy.nan)
+        self.cat_num = numpy.zeros(len(names), dtype=numpy.int32)
+        self.latitude = numpy.full(len(names), numpy.nan)
+        self.longitude = numpy.full(len(names), numpy.nan)
+
+        self._build_adjacency()
+
+    def _build_adjacency(self) -> None:
+        """
+        Build the CSR adjacency arrays. Neighbors of a node are listed in
+        edge id order, which matches the adjacency order of a networkx graph
+        built by adding the edges in id order.
+        """
+        num_edges = len(self.edge_nodes)
+        src = self.edge_nodes[:, 0]
+        dst = self.edge_nodes[:, 1]
+        edge_ids = numpy.arange(num_edges, dtype=numpy.int32)
+        # Self loops appear once in the adjacency
+        loop = src == dst
+        dir_src = numpy.concatenate([src, dst[~loop]])
+        dir_dst = numpy.concatenate([dst, src[~loop]])
+        dir_edge = numpy.concatenate([edge_ids, edge_ids[~loop]])
+        order = numpy.lexsort((dir_edge, dir_src))
+
+        self.adj_nodes = dir_dst[order].astype(numpy.int32)
+        self.adj_edges = dir_edge[order].astype(numpy.int32)
+        counts = numpy.bincount(dir_src, minlength=len(self.names))
+        self.adj_offsets = numpy.zeros(len(self.names) + 1, dtype=numpy.int32)
+        numpy.cumsum(counts, out=self.adj_offsets[1:])
+
+    def num_nodes(self) -> int:
+        return len(self.names)
+
+    def num_edges(self) -> int:
+        return len(self.edge_nodes)
+
+    def neighbors(self, node_id: int) -> numpy.ndarray:
+        return self.adj_nodes[self.adj_offsets[node_id] : self.adj_offsets[node_id + 1]]
+
+    def edge_id(self, node1: str, node2: str) -> int | None:
+        """
+        Return the id of the edge between two named nodes, or None.
+        """
+        id1 = self.name_to_id.get(node1)
+        id2 = self.name_to_id.get(node2)
+        if id1 is None or id2 is None:
+            return None
+        start = self.adj_offsets[id1]
+        end = self.adj_offsets[id1 + 1]
+        for pos in range(start, end):
+            if self.adj_nodes[pos] == id2:
+                return int(self.adj_edges[pos])
+        return None
+
+    def set_link_state(self, node1: str, node2: str, up: bool) -> bool:
+        """
+        Set the up flag of the edge between two nodes. Return False if there is no such edge.
+        """
+        edge = self.edge_id(node1, node2)
+        if edge is None:
+            return False
+        self.edge_up[edge] = up
+        return True
+
+    def satellite_ids(self) -> numpy.ndarray:
+        return numpy.flatnonzero(self.node_type == NODE_SAT)
+
+    def ground_station_ids(self) -> numpy.ndarray:
+        return numpy.flatnonzero(self.node_type == NODE_GROUND)
+
+    def satellites(self) -> list[str]:
+        return [self.names[i] for i in self.satellite_ids()]
+
+    def ground_stations(self) -> list[str]:
+        return [self.names[i] for i in self.ground_station_ids()]
+
+    def ring_list(self) -> list[list[str]]:
+        result: list[list[str]] = [[] for _ in range(self.rings)]
+        for node_id in self.satellite_ids():
+            ring = self.ring[node_id]
+            if 0 <= ring < self.rings:
+                result[ring].append(self.names[node_id])
+        return result
+
+    def to_graph(self) -> networkx.Graph:
+        """
+        Export as a networkx graph with the same layout as torus_topo.create_network.
+        """
+        graph: networkx.Graph = networkx.Graph()
+        graph.graph["rings"] = self.rings
+        graph.graph["ring_nodes"] = self.ring_nodes
+        graph.graph["ring_list"] = self.ring_list()
+        graph.graph["inclination"] = self.inclination
+
+        nodes = []
+        for node_id, name in enumerate(self.names):
+            if self.node_type[node_id] == NODE_SAT:
+                orbit = torus_topo.OrbitData(
+                    float(self.right_ascension[node_id]),
+                    float(self.orbit_inclination[node_id]),
+                    float(self.mean_anomaly[node_id]),
+                    int(self.cat_num[node_id]),
+                    float(self.mean_motion[node_id]),
+                )
+                nodes.append((name, {torus_topo.TYPE: torus_topo.TYPE_SAT, "orbit": orbit}))
+            else:
+                nodes.append(
+                    (
+                        name,
+                        {
+                            torus_topo.TYPE: torus_topo.TYPE_GROUND,
+                            torus_topo.LAT: float(self.latitude[node_id]),
+                            torus_topo.LON: float(self.longitude[node_id]),
+                        },
+                    )
+                )
+        graph.add_nodes_from(nodes)
+
+        edges = []
+        ground = self.node_type == NODE_GROUND
+        for edge_id, (n1, n2) in enumerate(self.edge_nodes.tolist()):
+            if ground[n1] or ground[n2]:
+                attrs = {"up": bool(self.edge_up[edge_id])}
+            else:
+                attrs = {
+                    "inter_ring": bool(self.edge_inter_ring[edge_id]),
+                    "up": bool(self.edge_up[edge_id]),
+                }
+            edges.append((self.names[n1], self.names[n2], attrs))
+        graph.add_edges_from(edges)
+        return graph
+
+
+def _dedup_edges(edge_nodes: numpy.ndarray) -> numpy.ndarray:
+    """
+    Return the index of the first occurrence of each undirected edge, in order.
+    A graph ignores repeated edges, e.g. the ring links of a 2 node ring.
+    """
+    low = numpy.minimum(edge_nodes[:, 0], edge_nodes[:, 1]).astype(numpy.int64)
+    high = numpy.maximum(edge_nodes[:, 0], edge_nodes[:, 1]).astype(numpy.int64)
+    key = low * (int(edge_nodes.max(initial=0)) + 1) + high
+    _, first = numpy.unique(key, return_index=True)
+    return numpy.sort(first)
+
+
+def torus_edges(first_node: int, num_rings: int, num_ring_nodes: int) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Return the edges of a torus and their inter_ring flags, for satellites
+    numbered ring by ring starting at first_node.
+
+    Edges are listed in the order create_network adds them:
+    ring 0 links, then for each following ring its links and the
+    links to the previous ring, and finally the links closing the torus.
+    """
+    nodes = numpy.arange(num_ring_nodes)
+    edge_blocks = []
+    inter_blocks = []
+    for ring_num in range(num_rings):
+        start = first_node + ring_num * num_ring_nodes
+        edge_blocks.append(numpy.stack([start + nodes, start + (nodes + 1) % num_ring_nodes], axis=1))
+        inter_blocks.append(numpy.zeros(num_ring_nodes, dtype=bool))
+        if ring_num > 0:
+            edge_blocks.append(numpy.stack([start - num_ring_nodes + nodes, start + nodes], axis=1))
+            inter_blocks.append(numpy.ones(num_ring_nodes, dtype=bool))
+    if num_rings > 0:
+        last = first_node + (num_rings - 1) * num_ring_nodes
+        edge_blocks.append(numpy.stack([last + nodes, first_node + nodes], axis=1))
+        inter_blocks.append(numpy.ones(num_ring_nodes, dtype=bool))
+    if len(edge_blocks) == 0:
+        return numpy.zeros((0, 2), dtype=numpy.int32), numpy.zeros(0, dtype=bool)
+    return numpy.concatenate(edge_blocks), numpy.concatenate(inter_blocks)
+
+
+def build_topo(names: list[str], node_type: list[int], edge_blocks: list[numpy.ndarray],
+               inter_blocks: list[numpy.ndarray], rings: int, ring_nodes: int,
+               inclination: float, ground_stations: bool) -> CompactTopo:
+    """
+    Assemble a compact topology from satellite nodes and edges, adding the
+    ground stations and their links if requested. Repeated edges are dropped.
+    """
+    names = list(names)
+    node_type = list(node_type)
+    edge_blocks = list(edge_blocks)
+    inter_blocks = list(inter_blocks)
+    num_sats = len(names)
+    if ground_stations:
+        count = len(torus_topo.GROUND_STATIONS)
+        names.extend(name for name, lat, lon in torus_topo.GROUND_STATIONS)
+        node_type.extend([NODE_GROUND] * count)
+        stations = numpy.arange(num_sats, num_sats + count)
+        if count > 2:
+            edge_blocks.append(numpy.stack([stations, numpy.roll(stations, -1)], axis=1))
+        else:
+            edge_blocks.append(numpy.stack([stations[:-1], stations[1:]], axis=1))
+        inter_blocks.append(numpy.zeros(len(edge_blocks[-1]), dtype=bool))
+
+    if len(edge_blocks) > 0:
+        edge_nodes = numpy.concatenate(edge_blocks)
+        edge_inter_ring = numpy.concatenate(inter_blocks)
+    else:
+        edge_nodes = numpy.zeros((0, 2), dtype=numpy.int32)
+        edge_inter_ring = numpy.zeros(0, dtype=bool)
+    keep = _dedup_edges(edge_nodes)
+    topo = CompactTopo(names, numpy.array(node_type), edge_nodes[keep], edge_inter_ring[keep],
+                       rings, ring_nodes, inclination)
+
+    if ground_stations:
+        for offset, (name, lat, lon) in enumerate(torus_topo.GROUND_STATIONS):
+            topo.latitude[num_sats + offset] = lat
+            topo.longitude[num_sats + offset] = lon
+    return topo
+
+
+def create_compact_network(
+    num_rings: int = torus_topo.NUM_RINGS,
+    num_ring_nodes: int = torus_topo.NUM_RING_NODES,
+    ground_stations: bool = True,
+    inclination: float = torus_topo.INCLINATION,
+) -> CompactTopo:
+    """
+    Create a compact torus network with the same nodes, edges and orbital
+    information as torus_topo.create_network, without building a graph.
+    """
+    num_sats = num_rings * num_ring_nodes
+    ring = numpy.repeat(numpy.arange(num_rings, dtype=numpy.int32), num_ring_nodes)
+    index = numpy.tile(numpy.arange(num_ring_nodes, dtype=numpy.int32), num_rings)
+    names = [torus_topo.get_node_name(r, n) for r, n in zip(ring.tolist(), index.tolist())]
+    edge_nodes, edge_inter_ring = torus_edges(0, num_rings, num_ring_nodes)
+
+    topo = build_topo(names, [NODE_SAT] * num_sats, [edge_nodes], [edge_inter_ring],
+                      num_rings, num_ring_nodes, inclination, ground_stations)
+    topo.ring[:num_sats] = ring
+    topo.ring_index[:num_sats] = index
+
+    # Orbits: evenly spaced planes, odd rings offset by 1/2 spacing
+    if num_sats > 0:
+        topo.right_ascension[:num_sats] = 360 / num_rings * ring
+        topo.orbit_inclination[:num_sats] = inclination
+        mean_anomaly = 360 / num_ring_nodes * index
+        mean_anomaly = mean_anomaly + numpy.where(ring % 2 == 1, 360 / num_ring_nodes / 2, 0)
+        topo.mean_anomaly[:num_sats] = mean_anomaly
+        topo.mean_motion[:num_sats] = torus_topo.MEAN_MOTION
+        first_cat_num = torus_topo.OrbitData.reserve_cat_nums(num_sats)
+        topo.cat_num[:num_sats] = numpy.arange(first_cat_num, first_cat_num + num_sats)
+    return topo
+
+
+def from_graph(graph: networkx.Graph) -> CompactTopo:
+    """
+    Create a compact topology from a networkx graph built by torus_topo.
+    Edge ids follow the graph.edges iteration order.
+    """
+    names = list(graph.nodes)
+    name_to_id = {name: i for i, name in enumerate(names)}
+    node_type = [
+        NODE_GROUND if graph.nodes[name].get(torus_topo.TYPE) == torus_topo.TYPE_GROUND else NODE_SAT
+        for name in names
+    ]
+    edge_nodes = numpy.array(
+        [(name_to_id[n1], name_to_id[n2]) for n1, n2 in graph.edges], dtype=numpy.int32
+    ).reshape(-1, 2)
+    edge_inter_ring = numpy.array(
+        [edge.get("inter_ring", False) for edge in graph.edges.values()], dtype=bool
+    )
+    topo = CompactTopo(
+        names,
+        numpy.array(node_type),
+        edge_nodes,
+        edge_inter_ring,
+        graph.graph.get("rings", 0),
+        graph.graph.get("ring_nodes", 0),
+        graph.graph.get("inclination", 0.0),
+    )
+    topo.edge_up[:] = [edge.get("up", True) for edge in graph.edges.values()]
+    if "shells" in graph.graph:
+        topo.shells = [(shell["first_ring"], shell["planes"], shell["total"] // shell["planes"])
+                       for shell in graph.graph["shells"]]
+
+    for ring_num, ring_nodes in enumerate(graph.graph.get("ring_list", [])):
+        for index, name in enumerate(ring_nodes):
+            topo.ring[name_to_id[name]] = ring_num
+            topo.ring_index[name_to_id[name]] = index
+
+    for node_id, name in enumerate(names):
+        node = graph.nodes[name]
+        orbit = node.get("orbit")
+        if orbit is not None:
+            topo.right_ascension[node_id] = orbit.right_ascension
+            topo.orbit_inclination[node_id] = orbit.inclination
+            topo.mean_anomaly[node_id] = orbit.mean_anomaly
+            topo.mean_motion[node_id] = orbit.mean_motion
+            topo.cat_num[node_id] = orbit.cat_num
+        if torus_topo.LAT in node:
+            topo.latitude[node_id] = node[torus_topo.LAT]
+            topo.longitude[node_id] = node[torus_topo.LON]
+    return topo
+
+
+def run_compact_test() -> bool:
+    """
+    Check a compact topology matches the networkx graph from create_network
+    """
+    graph = torus_topo.create_network(6, 5)
+    topo = create_compact_network(6, 5)
+    exported = topo.to_graph()
+
+    if list(graph.nodes) != list(exported.nodes):
+        return False
+    if list(graph.edges) != list(exported.edges):
+        return False
+    for name in graph.nodes:
+        if list(graph.adj[name]) != list(exported.adj[name]):
+            return False
+        orbit1 = graph.nodes[name].get("orbit")
+        orbit2 = exported.nodes[name].get("orbit")
+        if orbit1 is not None and (
+            orbit1.right_ascension != orbit2.right_ascension
+            or orbit1.mean_anomaly != orbit2.mean_anomaly
+        ):
+            return False
+    for edge in graph.edges:
+        if graph.edges[edge] != exported.edges[edge]:
+            return False
+    if graph.graph["ring_list"] != exported.graph["ring_list"]:
+        return False
+
+    # Round trip through the graph form
+    copy = from_graph(graph)
+    for node_id in range(copy.num_nodes()):
+        expected = set(graph.adj[copy.names[node_id]])
+        if {copy.names[n] for n in copy.neighbors(node_id)} != expected:
+            return False
+    return copy.satellites() == torus_topo.satellites(graph)
+
+
+if __name__ == "__main__":
+    print(run_compact_test())
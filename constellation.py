@@ -0,0 +1,190 @@
+"""
+Generate Walker delta constellations with one or more shells.
+
+A Walker delta shell i:T/P/F has T satellites in P evenly spaced orbital
+planes at inclination i. Satellites are evenly spaced within a plane and
+satellites in adjacent planes are offset by F * 360 / T degrees.
+
+Each shell is connected as a torus: every plane is a ring and satellites
+with the same index on adjacent planes are linked. Planes are numbered
+across all shells, so satellite R{ring}_{index} is unique in the network.
+
+Nodes, edges and orbit records are built as arrays and inserted into the
+networkx graph in bulk.
+"""
+
+from dataclasses import dataclass
+import math
+import time
+
+import numpy
+import networkx
+
+import compact_topo
+import torus_topo
+
+# Earth gravitational parameter km^3/s^2 and equatorial radius km
+EARTH_MU = 398600.4418
+EARTH_RADIUS = 6378.137
+
+
+def mean_motion_for_altitude(altitude: float) -> float:
+    """
+    Return the mean motion in revolutions per day of a circular orbit at altitude km.
+    """
+    semi_major_axis = EARTH_RADIUS + altitude
+    radians_per_second = math.sqrt(EARTH_MU / semi_major_axis**3)
+    return radians_per_second * 86400 / (2 * math.pi)
+
+
+@dataclass
+class Shell:
+    """Walker delta parameters for one shell, i:T/P/F"""
+
+    inclination: float  # degrees
+    total: int  # satellites in the shell
+    planes: int
+    phasing: int = 0
+    altitude: float = 550.0  # km
+    mean_motion: float | None = None  # revolutions per day, derived from altitude if None
+
+    def sats_per_plane(self) -> int:
+        if self.planes <= 0 or self.total % self.planes != 0:
+            raise ValueError(f"{self.total} satellites can not be divided into {self.planes} planes")
+        return self.total // self.planes
+
+    def orbit_mean_motion(self) -> float:
+        if self.mean_motion is not None:
+            return self.mean_motion
+        return mean_motion_for_altitude(self.altitude)
+
+
+def create_compact_constellation(shells: list[Shell], ground_stations: bool = True) -> compact_topo.CompactTopo:
+    """
+    Create a compact topology for a set of Walker delta shells.
+    """
+    names: list[str] = []
+    edge_blocks = []
+    inter_blocks = []
+    rings = []
+    ring_index = []
+    right_ascension = []
+    inclination = []
+    mean_anomaly = []
+    mean_motion = []
+    torus_shells = []
+
+    first_ring = 0
+    for shell in shells:
+        per_plane = shell.sats_per_plane()
+        plane = numpy.repeat(numpy.arange(shell.planes), per_plane)
+        index = numpy.tile(numpy.arange(per_plane), shell.planes)
+        ring = first_ring + plane
+        first_node = len(names)
+        names.extend(torus_topo.get_node_name(r, n) for r, n in zip(ring.tolist(), index.tolist()))
+
+        edges, inter = compact_topo.torus_edges(first_node, shell.planes, per_plane)
+        edge_blocks.append(edges)
+        inter_blocks.append(inter)
+
+        rings.append(ring)
+        ring_index.append(index)
+        right_ascension.append(360 / shell.planes * plane)
+        inclination.append(numpy.full(shell.total, float(shell.inclination)))
+        anomaly = 360 / per_plane * index + 360 * shell.phasing / shell.total * plane
+        mean_anomaly.append(anomaly % 360)
+        mean_motion.append(numpy.full(shell.total, shell.orbit_mean_motion()))
+        torus_shells.append((first_ring, shell.planes, per_plane))
+        first_ring += shell.planes
+
+    num_sats = len(names)
+    # For a single shell, rings x ring_nodes is the torus. With more, use topo.shells.
+    ring_nodes = max((shell.sats_per_plane() for shell in shells), default=0)
+    first_inclination = shells[0].inclination if len(shells) > 0 else 0.0
+    topo = compact_topo.build_topo(names, [compact_topo.NODE_SAT] * num_sats, edge_blocks, inter_blocks,
+                                   first_ring, ring_nodes, first_inclination, ground_stations)
+    topo.shells = torus_shells
+    if num_sats > 0:
+        topo.ring[:num_sats] = numpy.concatenate(rings)
+        topo.ring_index[:num_sats] = numpy.concatenate(ring_index)
+        topo.right_ascension[:num_sats] = numpy.concatenate(right_ascension)
+        topo.orbit_inclination[:num_sats] = numpy.concatenate(inclination)
+        topo.mean_anomaly[:num_sats] = numpy.concatenate(mean_anomaly)
+        topo.mean_motion[:num_sats] = numpy.concatenate(mean_motion)
+        first_cat_num = torus_topo.OrbitData.reserve_cat_nums(num_sats)
+        topo.cat_num[:num_sats] = numpy.arange(first_cat_num, first_cat_num + num_sats)
+    return topo
+
+
+def create_constellation(shells: list[Shell], ground_stations: bool = True) -> networkx.Graph:
+    """
+    Create a networkx graph for a set of Walker delta shells, in the same
+    form as torus_topo.create_network. graph.graph["shells"] describes the
+    rings belonging to each shell.
+    """
+    graph = create_compact_constellation(shells, ground_stations).to_graph()
+    first_ring = 0
+    shell_info = []
+    for shell in shells:
+        shell_info.append({
+            "inclination": shell.inclination,
+            "total": shell.total,
+            "planes": shell.planes,
+            "phasing": shell.phasing,
+            "mean_motion": shell.orbit_mean_motion(),
+            "first_ring": first_ring,
+        })
+        first_ring += shell.planes
+    graph.graph["shells"] = shell_info
+    return graph
+
+
+# Layout similar to the first Starlink shells
+STARLINK_SHELLS = [
+    Shell(53.0, 1584, 72, 17, 550),
+    Shell(53.2, 1584, 72, 17, 540),
+    Shell(70.0, 720, 36, 11, 570),
+    Shell(97.6, 348, 6, 0, 560),
+]
+
+
+def run_constellation_test() -> bool:
+    """
+    Build a two shell constellation and check its structure.
+    """
+    shells = [Shell(53.0, 24, 4, 1, 550), Shell(70.0, 18, 3, 0, mean_motion=14.8)]
+    graph = create_constellation(shells)
+    if len(torus_topo.satellites(graph)) != 42 or len(torus_topo.ground_stations(graph)) != 4:
+        return False
+    if graph.graph["rings"] != 7 or len(graph.graph["ring_list"]) != 7:
+        return False
+    # Each shell is its own torus
+    if compact_topo.from_graph(graph).shells != [(0, 4, 6), (4, 3, 6)]:
+        return False
+
+    # Every satellite links to two ring neighbors and two neighbors on adjacent
+    # planes of its own shell (three planes in the second shell).
+    for name in torus_topo.satellites(graph):
+        inter = [n for n in graph.adj[name] if graph.edges[name, n]["inter_ring"]]
+        intra = [n for n in graph.adj[name] if not graph.edges[name, n]["inter_ring"]]
+        if len(inter) != 2 or len(intra) != 2:
+            return False
+    if graph.has_edge(torus_topo.get_node_name(3, 0), torus_topo.get_node_name(4, 0)):
+        return False
+
+    orbit = graph.nodes[torus_topo.get_node_name(1, 2)]["orbit"]
+    if orbit.right_ascension != 90 or not math.isclose(orbit.mean_anomaly, 2 * 60 + 15):
+        return False
+    if not math.isclose(orbit.mean_motion, mean_motion_for_altitude(550)):
+        return False
+    orbit = graph.nodes[torus_topo.get_node_name(5, 0)]["orbit"]
+    if orbit.inclination != 70 or orbit.mean_motion != 14.8:
+        return False
+    l1, l2 = orbit.tle_format()
+    return "14.80000000" in l2
+
+
+if __name__ == "__main__":
+    start = time.time()
+    graph = create_constellation(STARLINK_SHELLS)
+    print(f"{graph.number_of_nodes()} nodes, {graph.number_of_edges()} edges in {time.time() - start:.2f}s")
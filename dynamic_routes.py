@@ -0,0 +1,204 @@
+"""
+Maintain all pairs routes over a compact torus topology as links change state.
+
+Instead of regenerating every route table, a batch of link changes only
+recomputes the (source, destination) entries they affect:
+
+- A link going down affects exactly the entries whose current path uses it.
+  Those are found by following the next hop matrix toward each destination.
+- A link coming up can only shorten paths. Sources that may benefit are found
+  from the current hop counts, and only entries that get shorter are replaced.
+
+Entries that are not affected keep their next hop, so consumers only see
+the route tables that really changed.
+"""
+
+from dataclasses import dataclass, field
+
+import numpy
+
+import compact_topo
+import route_matrix
+import torus_topo
+
+
+@dataclass
+class RouteChanges:
+    """Result of applying a batch of link changes"""
+
+    changed_nodes: list[str] = field(default_factory=list)  # Sources with changed tables
+    changed_entries: int = 0
+    recomputed_sources: int = 0
+
+
+class DynamicRoutes:
+    """
+    All pairs routes kept current with the link state of a topology.
+    """
+
+    def __init__(self, topo: compact_topo.CompactTopo, routes: route_matrix.RouteMatrix | None = None) -> None:
+        self.topo = topo
+        if routes is None:
+            routes = route_matrix.generate_route_matrix(topo)
+        self.routes = routes
+
+    def set_link_states(self, changes: list[tuple[str, str, bool]]) -> RouteChanges:
+        """
+        Apply a batch of (node1, node2, up) link changes and update the routes.
+        """
+        edge_ids = []
+        states = []
+        for node1, node2, up in changes:
+            edge = self.topo.edge_id(node1, node2)
+            if edge is None:
+                raise ValueError(f"link {node1} - {node2} does not exist")
+            edge_ids.append(edge)
+            states.append(up)
+        return self.set_edge_states(numpy.array(edge_ids, dtype=numpy.int64), numpy.array(states, dtype=bool))
+
+    def set_edge_states(self, edge_ids: numpy.ndarray, states: numpy.ndarray) -> RouteChanges:
+        """
+        Apply a batch of edge state changes given by edge id.
+        The last state given for an edge wins.
+        """
+        final: dict[int, bool] = {}
+        for edge, up in zip(edge_ids.tolist(), states.tolist()):
+            final[edge] = up
+        down = [e for e, up in final.items() if not up and self.topo.edge_up[e]]
+        up = [e for e, up in final.items() if up and not self.topo.edge_up[e]]
+
+        changed_rows = numpy.zeros(self.topo.num_nodes(), dtype=bool)
+        result = RouteChanges()
+        if len(down) > 0:
+            self.topo.edge_up[down] = False
+            self._links_down(numpy.array(down), changed_rows, result)
+        if len(up) > 0:
+            self.topo.edge_up[up] = True
+            self._links_up(numpy.array(up), changed_rows, result)
+        result.changed_nodes = [self.topo.names[i] for i in numpy.flatnonzero(changed_rows)]
+        return result
+
+    def _hop_matrix(self) -> numpy.ndarray:
+        """
+        Hop counts as int64 with unreachable entries larger than any path.
+        """
+        hops = self.routes.hops.astype(numpy.int64)
+        hops[self.routes.hops == route_matrix.no_route(self.routes.hops)] = self.topo.num_nodes() + 1
+        return hops
+
+    def _links_down(self, edges: numpy.ndarray, changed_rows: numpy.ndarray, result: RouteChanges) -> None:
+        next_hop = self.routes.next_hop
+        num_nodes = self.topo.num_nodes()
+
+        # Entries at the near end of a down link that route over it
+        broken = numpy.zeros(next_hop.shape, dtype=bool)
+        for node1, node2 in self.topo.edge_nodes[edges].tolist():
+            broken[node1] |= next_hop[node1] == node2
+            broken[node2] |= next_hop[node2] == node1
+        columns = numpy.flatnonzero(broken.any(axis=0))
+        if len(columns) == 0:
+            return
+
+        # Entries whose path passes through a broken entry: for each destination
+        # the next hops form a tree, so follow it with pointer jumping.
+        flags = broken[:, columns]
+        parent = next_hop[:, columns].astype(numpy.int64)
+        unreachable = next_hop[:, columns] == route_matrix.no_route(next_hop)
+        parent[unreachable] = numpy.broadcast_to(columns, parent.shape)[unreachable]
+        for _ in range(int(num_nodes).bit_length()):
+            flags |= numpy.take_along_axis(flags, parent, axis=0)
+            next_parent = numpy.take_along_axis(parent, parent, axis=0)
+            if (next_parent == parent).all():
+                break
+            parent = next_parent
+
+        sources = numpy.flatnonzero(flags.any(axis=1))
+        rows, cols = numpy.nonzero(flags[sources])
+        self._update(sources, rows, columns[cols], changed_rows, result)
+
+    def _links_up(self, edges: numpy.ndarray, changed_rows: numpy.ndarray, result: RouteChanges) -> None:
+        hops = self._hop_matrix()
+        node1 = self.topo.edge_nodes[edges, 0]
+        node2 = self.topo.edge_nodes[edges, 1]
+        # A source can only gain shorter paths if a new link shortens
+        # the path to one of its ends.
+        shorter = (hops[:, node1] + 1 < hops[:, node2]) | (hops[:, node2] + 1 < hops[:, node1])
+        sources = numpy.flatnonzero(shorter.any(axis=1))
+        if len(sources) == 0:
+            return
+
+        new_next, new_hops = route_matrix.bfs_routes(self.topo, sources)
+        reachable = new_hops >= 0
+        rows, dests = numpy.nonzero(reachable & (new_hops < hops[sources]))
+        self._write(sources, rows, dests, new_next, new_hops, changed_rows, result)
+        result.recomputed_sources += len(sources)
+
+    def _update(self, sources: numpy.ndarray, rows: numpy.ndarray, dests: numpy.ndarray,
+                changed_rows: numpy.ndarray, result: RouteChanges) -> None:
+        """
+        Recompute the given entries. rows index into sources.
+        """
+        new_next, new_hops = route_matrix.bfs_routes(self.topo, sources)
+        self._write(sources, rows, dests, new_next, new_hops, changed_rows, result)
+        result.recomputed_sources += len(sources)
+
+    def _write(self, sources: numpy.ndarray, rows: numpy.ndarray, dests: numpy.ndarray,
+               new_next: numpy.ndarray, new_hops: numpy.ndarray,
+               changed_rows: numpy.ndarray, result: RouteChanges) -> None:
+        next_hop = self.routes.next_hop
+        hops = self.routes.hops
+        entry_next = new_next[rows, dests]
+        entry_hops = new_hops[rows, dests]
+        unreachable = entry_hops < 0
+        if entry_hops.max(initial=0) >= route_matrix.no_route(hops):
+            wide = hops.astype(numpy.uint16)
+            wide[hops == route_matrix.no_route(hops)] = route_matrix.no_route(wide)
+            self.routes.hops = hops = wide
+        entry_next = numpy.where(unreachable, route_matrix.no_route(next_hop), entry_next)
+        entry_hops = numpy.where(unreachable, route_matrix.no_route(hops), entry_hops)
+
+        src = sources[rows]
+        differs = (next_hop[src, dests] != entry_next) | (hops[src, dests] != entry_hops)
+        next_hop[src, dests] = entry_next
+        hops[src, dests] = entry_hops
+        changed_rows[src[differs]] = True
+        result.changed_entries += int(differs.sum())
+
+
+def run_dynamic_routes_test() -> bool:
+    """
+    Flip batches of links and compare with routes generated from scratch.
+    """
+    rng = numpy.random.default_rng(1)
+    topo = compact_topo.create_compact_network(8, 8, ground_stations=False)
+    dynamic = DynamicRoutes(topo)
+    inter_ring = numpy.flatnonzero(topo.edge_inter_ring)
+
+    for _ in range(10):
+        before_next = dynamic.routes.next_hop.copy()
+        before_hops = dynamic.routes.hops.copy()
+        edges = rng.choice(inter_ring, size=12, replace=False)
+        states = rng.random(12) < 0.5
+        changes = dynamic.set_edge_states(edges, states)
+
+        full = route_matrix.generate_route_matrix(topo)
+        if not (full.hops == dynamic.routes.hops).all():
+            return False
+        if not route_matrix.check_routes(topo, dynamic.routes):
+            return False
+        changed = (before_next != dynamic.routes.next_hop) | (before_hops != dynamic.routes.hops)
+        expected = [topo.names[i] for i in numpy.flatnonzero(changed.any(axis=1))]
+        if expected != changes.changed_nodes:
+            return False
+
+    # Take down and restore an inter ring link by name
+    name1 = torus_topo.get_node_name(0, 0)
+    name2 = torus_topo.get_node_name(1, 0)
+    changes = dynamic.set_link_states([(name1, name2, False)])
+    changes = dynamic.set_link_states([(name1, name2, True)])
+    full = route_matrix.generate_route_matrix(topo)
+    return bool((full.hops == dynamic.routes.hops).all())
+
+
+if __name__ == "__main__":
+    print(run_dynamic_routes_test())
@@ -0,0 +1,145 @@
+"""
+Discrete event engine for the satellite simulation.
+
+Events are kept in a heap ordered by simulated time. The engine pops the
+next event, waits until it is due and calls the handler for its kind.
+Handlers may schedule further events.
+
+The wait depends on the pacing:
+- realtime: simulated time runs with the wall clock
+- accelerated: simulated time runs rate times faster than the wall clock
+- fast: no waiting, events are processed as fast as possible
+"""
+
+from dataclasses import dataclass, field
+import datetime
+import heapq
+import time
+import typing
+
+REALTIME = "realtime"
+ACCELERATED = "accelerated"
+FAST = "fast"
+PACINGS = (REALTIME, ACCELERATED, FAST)
+
+
+@dataclass(order=True)
+class Event:
+    """An event at a simulated time. Events at the same time run in order scheduled."""
+
+    time: datetime.datetime
+    seq: int
+    kind: str = field(compare=False)
+    data: typing.Any = field(compare=False, default=None)
+
+
+class EventQueue:
+    """
+    Heap of pending events.
+    """
+
+    def __init__(self) -> None:
+        self.heap: list[Event] = []
+        self.count = 0
+
+    def schedule(self, time: datetime.datetime, kind: str, data: typing.Any = None) -> Event:
+        event = Event(time, self.count, kind, data)
+        self.count += 1
+        heapq.heappush(self.heap, event)
+        return event
+
+    def next_time(self) -> datetime.datetime | None:
+        return self.heap[0].time if len(self.heap) > 0 else None
+
+    def pop(self) -> Event:
+        return heapq.heappop(self.heap)
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+
+class Clock:
+    """
+    Maps simulated time to wall clock time for a pacing mode.
+    """
+
+    def __init__(self, start: datetime.datetime, pacing: str = REALTIME, rate: float = 1.0) -> None:
+        if pacing not in PACINGS:
+            raise ValueError(f"unknown pacing {pacing}")
+        self.start = start
+        self.pacing = pacing
+        self.rate = 1.0 if pacing == REALTIME else rate
+        self.wall_start = time.monotonic()
+
+    def wall_offset(self, sim_time: datetime.datetime) -> float:
+        """
+        Seconds after the wall clock start when sim_time is due.
+        """
+        return (sim_time - self.start).total_seconds() / self.rate
+
+    def wait_until(self, sim_time: datetime.datetime) -> None:
+        if self.pacing == FAST:
+            return
+        delay = self.wall_offset(sim_time) - (time.monotonic() - self.wall_start)
+        if delay > 0:
+            time.sleep(delay)
+
+    def wall_elapsed(self) -> float:
+        return time.monotonic() - self.wall_start
+
+
+def run_events(queue: EventQueue, clock: Clock,
+               handlers: dict[str, typing.Callable[[Event], None]],
+               until: datetime.datetime | None = None) -> int:
+    """
+    Process events in time order until the queue is empty or the next
+    event is after until. Returns the number of events processed.
+    """
+    count = 0
+    while len(queue) > 0:
+        if until is not None and queue.next_time() > until:
+            break
+        event = queue.pop()
+        clock.wait_until(event.time)
+        handlers[event.kind](event)
+        count += 1
+    return count
+
+
+def run_event_sim_test() -> bool:
+    """
+    Run events scheduled out of order and from handlers, with fast and accelerated pacing.
+    """
+    start = datetime.datetime(2024, 6, 1, tzinfo=datetime.timezone.utc)
+    for pacing, rate in ((FAST, 1.0), (ACCELERATED, 200.0)):
+        queue = EventQueue()
+        seen: list[tuple[float, str]] = []
+
+        def record(event: Event) -> None:
+            seen.append(((event.time - start).total_seconds(), event.data))
+
+        def repeat(event: Event) -> None:
+            record(event)
+            if event.data < 3:
+                queue.schedule(event.time + datetime.timedelta(seconds=2), "repeat", event.data + 1)
+
+        for offset, name in ((5, "c"), (1, "a"), (3, "b"), (3, "b2"), (100, "late")):
+            queue.schedule(start + datetime.timedelta(seconds=offset), "record", name)
+        queue.schedule(start, "repeat", 0)
+        clock = Clock(start, pacing, rate)
+        count = run_events(queue, clock, {"record": record, "repeat": repeat},
+                           until=start + datetime.timedelta(seconds=10))
+        expected = [(0, 0), (1, "a"), (2, 1), (3, "b"), (3, "b2"), (4, 2), (5, "c"), (6, 3)]
+        if seen != expected or count != 8 or len(queue) != 1:
+            return False
+        if pacing == ACCELERATED and clock.wall_elapsed() < 6 / rate:
+            return False
+    try:
+        Clock(start, "slow")
+    except ValueError:
+        return True
+    return False
+
+
+if __name__ == "__main__":
+    print(run_event_sim_test())
@@ -12,6 +12,10 @@ import networkx
 
 import torus_topo
 
+# Identifies the addressing and config layout produced by annotate_graph.
+# Change this when annotate_graph output changes so cached topologies are rebuilt.
+ADDRESS_SCHEME = "ospf-area0-10.1-10.15-v1"
+
 
 def annotate_graph(graph: networkx.Graph):
     """
@@ -10,35 +10,49 @@ Generate events for:
     - new / break connections to end hosts
 """
 
+from collections import deque
 from dataclasses import dataclass, field
 import configparser
 import sys
 import datetime
+import http.server
+import tempfile
+import threading
 import time
 
 import torus_topo
+import compact_topo
+import link_snapshots
+import topo_cache
+import sat_records
+import sat_positions
+import sat_pool
+import visibility
+import sat_index
+import passes
+import event_sim
+import sim_trace
 import simclient
+import update_filter
 
 import networkx
+import numpy
 from skyfield.api import load, wgs84 # type: ignore
 from skyfield.api import EarthSatellite # type: ignore
-from skyfield.positionlib import Geocentric # type: ignore
 from skyfield.toposlib import GeographicPosition # type: ignore
-from skyfield.units import Angle, Distance # type: ignore
 
 
 @dataclass
 class Satellite:
-    """Represents an instance of a satellite"""
+    """
+    Represents an instance of a satellite. Positions and link status are
+    kept in SatSimulation arrays indexed by the satellite id.
+    """
 
     name: str
     earth_sat: EarthSatellite
-    geo: Geocentric = None
-    lat: Angle = 0
-    lon: Angle = 0
-    height: Distance = 0
-    inter_plane_status: bool = True
-    prev_inter_plane_status: bool = True
+    id: int
+    inclination: float = 0  # degrees
 
 @dataclass
 class Uplink:
@@ -55,6 +69,21 @@ class GroundStation:
     uplinks: list[Uplink] = field(default_factory=list)
 
 
+@dataclass
+class LinkFailure:
+    """A link taken down, and optionally restored, at times in seconds after the start"""
+    node1: str
+    node2: str
+    down: float
+    up: float | None = None
+
+
+# Address of the driver JSON api
+DRIVER_URL = "http://127.0.0.0:8000"
+# Default simulated seconds for a batch run
+BATCH_DURATION = 3600
+
+
 class SatSimulation:
     """
     Runs real time to update satellite positions
@@ -63,13 +92,23 @@ class SatSimulation:
     # Time slice for simulation
     TIME_SLICE = 10
     MIN_ALTITUDE = 35
+    # Seconds of rise / set events predicted at once
+    PASS_HORIZON = 3600
+
+    # Event kinds for run_events
+    BAND_EVENT = "band"
+    UPLINK_EVENT = "uplink"
+    FAILURE_EVENT = "failure"
+    HORIZON_EVENT = "horizon"
+    TICK_EVENT = "tick"
 
     def __init__(self, graph: networkx.Graph):
         self.graph = graph
         self.ts = load.timescale()
         self.satellites: list[Satellite] = []
         self.ground_stations: list[GroundStation] = []
-        self.client: simclient.Client = simclient.Client("http://127.0.0.0:8000")
+        # Only changes are sent to the driver
+        self.client = update_filter.UpdateFilter(simclient.Client(DRIVER_URL))
         self.calc_only = False
         self.min_altitude = SatSimulation.MIN_ALTITUDE
         self.zero_uplink_count = 0
@@ -80,32 +119,64 @@ class SatSimulation:
             position = wgs84.latlon(node[torus_topo.LAT], node[torus_topo.LON])
             ground_station = GroundStation(name, position)
             self.ground_stations.append(ground_station)
+        self.station_frames = visibility.station_frames(
+            numpy.array([g.position.latitude.degrees for g in self.ground_stations]),
+            numpy.array([g.position.longitude.degrees for g in self.ground_stations]))
 
-        for name in torus_topo.satellites(graph):
+        # Build propagator records from the orbits with a shared epoch
+        names, satrecs = sat_records.build_satrecs(graph)
+        for sat_id, (name, satrec) in enumerate(zip(names, satrecs)):
             orbit = graph.nodes[name]["orbit"]
-            ts = load.timescale()
-            l1, l2 = orbit.tle_format()
-            earth_satellite = EarthSatellite(l1, l2, name, ts)
-            satellite = Satellite(name, earth_satellite)
+            earth_satellite = EarthSatellite.from_satrec(satrec, self.ts)
+            earth_satellite.name = name
+            satellite = Satellite(name, earth_satellite, sat_id, orbit.inclination)
             self.satellites.append(satellite)
+        self.sat_ids = {satellite.name: satellite.id for satellite in self.satellites}
+        # Satellite ids at the ends of each inter plane link
+        self.inter_ring_edges = numpy.array(
+            [(self.sat_ids[node1], self.sat_ids[node2])
+             for node1, node2, inter_ring in graph.edges(data="inter_ring") if inter_ring],
+            dtype=int).reshape(-1, 2)
+
+        # Propagate all satellites in one call, results indexed by satellite id
+        self.propagator = sat_positions.Propagator(satrecs, self.ts)
+        self.positions: sat_positions.Positions | None = None
+        # Number of time slices propagated ahead
+        self.look_ahead = sat_positions.WINDOW_SIZE
+        self.window: sat_positions.PositionWindow | None = None
+        self.inclination = numpy.array([satellite.inclination for satellite in self.satellites])
+        self.inter_plane_status = numpy.ones(len(self.satellites), dtype=bool)
+        self.prev_inter_plane_status = numpy.ones(len(self.satellites), dtype=bool)
+
+        # Drive uplinks from predicted rise / set events instead of each time slice
+        self.use_passes = False
+        self.pass_horizon = SatSimulation.PASS_HORIZON
+        self.schedule: passes.PassSchedule | None = None
+        self.pass_events: deque[tuple[datetime.datetime, list[passes.PassEvent]]] = deque()
+        self.visible: list[set[int]] = [set() for _ in self.ground_stations]
+
+        # Discrete event mode
+        self.queue = event_sim.EventQueue()
+        self.failures: list[LinkFailure] = []
+        # Links currently down by a failure event
+        self.failed_links: set[tuple[str, str]] = set()
+        # Record events and per tick statistics when set
+        self.trace: sim_trace.SimTrace | None = None
+        self.tick = SatSimulation.TIME_SLICE
+
+    def usePool(self, workers: int | None = None):
+        """
+        Propagate with a persistent pool of worker processes, by default one per CPU.
+        """
+        self.propagator = sat_pool.PoolPropagator(self.propagator.satrecs, self.ts, workers)
+        self.window = None
 
     def updatePositions(self, future_time: datetime.datetime):
-        sfield_time = self.ts.from_datetime(future_time)
-        for satellite in self.satellites:
-            satellite.geo = satellite.earth_sat.at(sfield_time)
-            lat, lon = wgs84.latlon_of(satellite.geo)
-            satellite.lat = lat
-            satellite.lon = lon
-            satellite.height = wgs84.height_of(satellite.geo)
-            #print(f"{satellite.name} Lat: {satellite.lat}, Lon: {satellite.lon}, Hieght: {satellite.height.km}km")
-
-    @staticmethod
-    def nearby(ground_station: GroundStation, satellite: Satellite) -> bool:
-        return (satellite.lon.degrees > ground_station.position.longitude.degrees - 20 and
-                satellite.lon.degrees < ground_station.position.longitude.degrees + 20 and
-                satellite.lat.degrees > ground_station.position.latitude.degrees - 20 and 
-                satellite.lat.degrees < ground_station.position.latitude.degrees + 20)
- 
+        if self.window is None:
+            step = datetime.timedelta(seconds=SatSimulation.TIME_SLICE)
+            self.window = sat_positions.PositionWindow(self.propagator, step, self.look_ahead)
+        self.positions = self.window.positions_at(future_time)
+
     def updateUplinkStatus(self, future_time: datetime.datetime):
         """
         Update the links between ground stations and satellites
@@ -113,52 +184,174 @@ class SatSimulation:
         self.uplink_updates += 1
         zero_uplinks: bool = False
 
-        sfield_time = self.ts.from_datetime(future_time)
-        for ground_station in self.ground_stations:
-            ground_station.uplinks = [] 
-            for satellite in self.satellites:
-                # Calculate az for close satellites
-                if SatSimulation.nearby(ground_station, satellite):
-                    difference = satellite.earth_sat - ground_station.position
-                    topocentric = difference.at(sfield_time)
-                    alt, az, d = topocentric.altaz()
-                    if alt.degrees > self.min_altitude:
-                        uplink = Uplink(satellite.name, ground_station.name, d.km)
-                        ground_station.uplinks.append(uplink)
-                        print(f"{satellite.name} Lat: {satellite.lat}, Lon: {satellite.lon}")
-                        print(f"{ground_station.name} Lat: {ground_station.position.latitude}, Lon: {ground_station.position.longitude}")
-                        print(f"ground {ground_station.name}, sat {satellite.name}: {alt}, {az}, {d.km}")
+        # Look angles from each ground station to candidate satellites from the index
+        candidates = sat_index.candidates(self.station_frames, self.positions.ecef, self.min_altitude)
+        for station_id, ground_station in enumerate(self.ground_stations):
+            ground_station.uplinks = []
+            sat_ids = candidates[station_id]
+            elevation, azimuth, distance = visibility.look_angles(
+                self.station_frames.select([station_id]), self.positions.ecef, sat_ids)
+            for i in numpy.flatnonzero(elevation[0] > self.min_altitude):
+                sat_id = sat_ids[i]
+                satellite = self.satellites[sat_id]
+                d = distance[0, i]
+                uplink = Uplink(satellite.name, ground_station.name, d)
+                ground_station.uplinks.append(uplink)
+                print(f"{satellite.name} Lat: {self.positions.lat[sat_id]}, Lon: {self.positions.lon[sat_id]}")
+                print(f"{ground_station.name} Lat: {ground_station.position.latitude}, Lon: {ground_station.position.longitude}")
+                print(f"ground {ground_station.name}, sat {satellite.name}: {elevation[0, i]:.4f}deg, {azimuth[0, i]:.4f}deg, {d}")
             if len(ground_station.uplinks) == 0:
                 zero_uplinks = True
         if zero_uplinks:
             self.zero_uplink_count += 1
             
 
-    def updateInterPlaneStatus(self):
-        inclination = self.graph.graph["inclination"]
-        for satellite in self.satellites:
-            # Track if state changed
-            satellite.prev_inter_plane_status = satellite.inter_plane_status
-            if satellite.lat.degrees > (inclination - 2) or satellite.lat.degrees < (
-                -inclination + 2
-            ):
-                # Above the threashold for inter plane links to connect
-                satellite.inter_plane_status = False
+    def predictPasses(self, start: datetime.datetime):
+        """
+        Predict uplink rise and set events from start over the pass horizon.
+        """
+        self.schedule = passes.predict_passes(self.propagator, self.station_frames, start,
+                                              self.pass_horizon, self.min_altitude)
+        self.pass_events = deque(self.schedule.event_groups())
+        print(f"predicted {len(self.schedule.events)} uplink events until {self.schedule.end}")
+
+    def setStationUplinks(self, station_id: int, event_time: datetime.datetime):
+        """
+        Set the uplinks of a ground station to its visible satellites at event_time.
+        """
+        ground_station = self.ground_stations[station_id]
+        sat_ids = numpy.array(sorted(self.visible[station_id]), dtype=int)
+        ecef = self.propagator.ecef_at(sat_ids, [event_time] * len(sat_ids))
+        distance = numpy.linalg.norm(ecef - self.station_frames.ecef[station_id], axis=1)
+        ground_station.uplinks = [Uplink(self.satellites[sat_id].name, ground_station.name, d)
+                                  for sat_id, d in zip(sat_ids, distance)]
+
+    def startPasses(self, start: datetime.datetime):
+        """
+        Predict passes from start and set the uplinks of all stations.
+        """
+        self.predictPasses(start)
+        self.visible = [set(ids) for ids in self.schedule.initial]
+        for station_id in range(len(self.ground_stations)):
+            self.setStationUplinks(station_id, start)
+
+    def sendPassEvents(self, until: datetime.datetime):
+        """
+        Apply the uplink events up to until. Unless calc_only, wait for the
+        time of each event and send the uplinks of the stations that changed.
+        """
+        while True:
+            if len(self.pass_events) == 0:
+                if self.schedule.end > until:
+                    break
+                # Extend the schedule
+                self.predictPasses(self.schedule.end)
+                continue
+            event_time, events = self.pass_events[0]
+            if event_time > until:
+                break
+            self.pass_events.popleft()
+            changed = self.applyPassEvents(event_time, events)
+            if not self.calc_only:
+                sleep_delta = event_time - datetime.datetime.now(tz=datetime.timezone.utc)
+                time.sleep(max(sleep_delta.total_seconds(), 0))
+                for station_id in changed:
+                    self.send_station_uplinks(self.ground_stations[station_id])
+                self.flush_updates()
+        self.countUplinks()
+
+    def applyPassEvents(self, event_time: datetime.datetime, events: list[passes.PassEvent]) -> list[int]:
+        """
+        Update the visible satellites and uplinks for a group of events.
+        Returns the ids of the stations that changed.
+        """
+        changed = set()
+        for event in events:
+            if event.rise:
+                self.visible[event.station].add(event.satellite)
             else:
-                satellite.inter_plane_status = True
+                self.visible[event.station].discard(event.satellite)
+            changed.add(event.station)
+        for station_id in sorted(changed):
+            self.setStationUplinks(station_id, event_time)
+        return sorted(changed)
+
+    def countUplinks(self):
+        self.uplink_updates += 1
+        if any(len(ground_station.uplinks) == 0 for ground_station in self.ground_stations):
+            self.zero_uplink_count += 1
+
+    def updateInterPlaneStatus(self):
+        # Track if state changed
+        self.prev_inter_plane_status = self.inter_plane_status
+        # Above the threashold for inter plane links to connect
+        limit = self.inclination - 2
+        lat = self.positions.lat
+        self.inter_plane_status = (lat <= limit) & (lat >= -limit)
 
     def send_updates(self):
-        for satellite in self.satellites:
-            if satellite.prev_inter_plane_status != satellite.inter_plane_status:
-                for neighbor in self.graph.adj[satellite.name]: 
-                    if self.graph.edges[satellite.name, neighbor]["inter_ring"]:
-                        self.client.set_link_state(satellite.name, neighbor, satellite.inter_plane_status)
-        
+        self.send_link_updates()
         for ground_station in self.ground_stations:
-            links = []
-            for uplink in ground_station.uplinks:
-                links.append((uplink.satellite_name, int(uplink.distance)))
-            self.client.set_uplinks(ground_station.name, links)
+            self.send_station_uplinks(ground_station)
+
+    def send_all(self):
+        """
+        Send the state of every link and ground station, not only the changes.
+        """
+        for sat_id in range(len(self.satellites)):
+            self.send_satellite_links(sat_id)
+        for ground_station in self.ground_stations:
+            self.send_station_uplinks(ground_station)
+        for node1, node2 in self.failed_links:
+            self.client.set_link_state(node1, node2, False)
+
+    def flush_updates(self):
+        """
+        Send the pending updates. After the client reconnects, the driver may
+        have restarted with all links up, so send the full state again.
+        """
+        if self.client.flush():
+            print("reconnected to the driver, sending all link and uplink state")
+            self.send_all()
+            self.client.flush()
+
+    def send_link_updates(self):
+        changed = numpy.flatnonzero(self.prev_inter_plane_status != self.inter_plane_status)
+        for sat_id in changed:
+            self.send_satellite_links(sat_id)
+
+    def inter_ring_neighbors(self, sat_id: int) -> list[str]:
+        name = self.satellites[sat_id].name
+        return [neighbor for neighbor in self.graph.adj[name] if self.graph.edges[name, neighbor]["inter_ring"]]
+
+    def inter_ring_link_up(self, sat_id: int, neighbor: str) -> bool:
+        """
+        An inter plane link is up while both satellites are inside the latitude band.
+        """
+        return bool(self.inter_plane_status[sat_id] and self.inter_plane_status[self.sat_ids[neighbor]])
+
+    def send_satellite_links(self, sat_id: int):
+        satellite = self.satellites[sat_id]
+        for neighbor in self.inter_ring_neighbors(sat_id):
+            self.client.set_link_state(satellite.name, neighbor, self.inter_ring_link_up(sat_id, neighbor))
+
+    def trace_satellite_links(self, sat_id: int, event_time: datetime.datetime):
+        satellite = self.satellites[sat_id]
+        for neighbor in self.inter_ring_neighbors(sat_id):
+            self.trace.link(event_time, satellite.name, neighbor, self.inter_ring_link_up(sat_id, neighbor))
+
+    def inter_ring_links_up(self) -> int:
+        """
+        Number of inter plane links with both satellites inside the latitude band.
+        """
+        status = self.inter_plane_status
+        return int(numpy.count_nonzero(status[self.inter_ring_edges[:, 0]] & status[self.inter_ring_edges[:, 1]]))
+
+    def send_station_uplinks(self, ground_station: GroundStation):
+        links = []
+        for uplink in ground_station.uplinks:
+            links.append((uplink.satellite_name, int(uplink.distance)))
+        self.client.set_uplinks(ground_station.name, links)
 
     def run(self):
         current_time = datetime.datetime.now(tz=datetime.timezone.utc)
@@ -167,28 +360,178 @@ class SatSimulation:
         # Generate positions for current time
         print(f"update positions for {current_time}")
         self.updatePositions(current_time)
-        self.updateUplinkStatus(current_time)
+        if self.use_passes:
+            self.startPasses(current_time)
+        else:
+            self.updateUplinkStatus(current_time)
         self.updateInterPlaneStatus()
         self.send_updates()
+        self.flush_updates()
 
         while True:
             # Generate positions for next time step
             future_time = current_time + slice_delta
             print(f"update positions for {future_time}")
             self.updatePositions(future_time)
-            self.updateUplinkStatus(future_time)
+            if not self.use_passes:
+                self.updateUplinkStatus(future_time)
             self.updateInterPlaneStatus()
+            if self.use_passes:
+                # Uplink changes are sent at their predicted times
+                self.sendPassEvents(future_time)
             sleep_delta = future_time - datetime.datetime.now(tz=datetime.timezone.utc)
             print(f"zero uplink % = {self.zero_uplink_count / self.uplink_updates}")
+            print(f"updates sent {self.client.sent}, suppressed {self.client.suppressed}")
             print("sleep")
             if not self.calc_only:
                 # Wait until next time step thenupdate
-                time.sleep(sleep_delta.seconds)
-                self.send_updates()
+                time.sleep(max(sleep_delta.total_seconds(), 0))
+                if self.use_passes:
+                    self.send_link_updates()
+                else:
+                    self.send_updates()
+                self.flush_updates()
             current_time = future_time
 
+    def scheduleHorizon(self, start: datetime.datetime):
+        """
+        Predict latitude band crossings and uplink events from start over
+        the pass horizon and add them to the event queue.
+        """
+        initial, band_events = passes.predict_band_crossings(
+            self.propagator, self.inclination - 2, start, self.pass_horizon)
+        for band_event in band_events:
+            self.queue.schedule(band_event.time, SatSimulation.BAND_EVENT, band_event)
+        self.predictPasses(start)
+        for event_time, events in self.schedule.event_groups():
+            self.queue.schedule(event_time, SatSimulation.UPLINK_EVENT, events)
+        self.queue.schedule(self.schedule.end, SatSimulation.HORIZON_EVENT)
+
+    def handleBandEvent(self, event: event_sim.Event):
+        band_event: passes.BandEvent = event.data
+        self.inter_plane_status[band_event.satellite] = band_event.inside
+        if self.trace is not None:
+            self.trace_satellite_links(band_event.satellite, event.time)
+        if not self.calc_only:
+            self.send_satellite_links(band_event.satellite)
+            self.flush_updates()
+
+    def handleUplinkEvent(self, event: event_sim.Event):
+        changed = self.applyPassEvents(event.time, event.data)
+        self.countUplinks()
+        if self.trace is not None:
+            for pass_event in event.data:
+                self.trace.uplink(event.time, pass_event.station, pass_event.satellite, pass_event.rise)
+        if not self.calc_only:
+            for station_id in changed:
+                self.send_station_uplinks(self.ground_stations[station_id])
+            self.flush_updates()
+
+    def handleFailureEvent(self, event: event_sim.Event):
+        node1, node2, up = event.data
+        print(f"{event.time}: link {node1} - {node2} {'up' if up else 'down'}")
+        if up:
+            self.failed_links.discard(update_filter.link_key(node1, node2))
+        else:
+            self.failed_links.add(update_filter.link_key(node1, node2))
+        if self.trace is not None:
+            self.trace.link(event.time, node1, node2, up)
+        if not self.calc_only:
+            self.client.set_link_state(node1, node2, up)
+            self.flush_updates()
+
+    def handleHorizonEvent(self, event: event_sim.Event):
+        self.scheduleHorizon(event.time)
+
+    def handleTickEvent(self, event: event_sim.Event):
+        uplinks = [len(ground_station.uplinks) for ground_station in self.ground_stations]
+        self.trace.tick(event.time, uplinks, self.inter_ring_links_up())
+        self.queue.schedule(event.time + datetime.timedelta(seconds=self.tick), SatSimulation.TICK_EVENT)
+
+    def run_events(self, pacing: str = event_sim.REALTIME, rate: float = 1.0,
+                   duration: float | None = None, start: datetime.datetime | None = None) -> int:
+        """
+        Run as a discrete event simulation, moving from one predicted event
+        to the next instead of in fixed time slices. Runs for duration
+        seconds of simulated time, or forever if None.
+        Returns the number of events processed.
+        """
+        if start is None:
+            start = datetime.datetime.now(tz=datetime.timezone.utc)
+        until = None if duration is None else start + datetime.timedelta(seconds=duration)
 
-def run(num_rings: int, num_routers: int, ground_stations: bool, min_alt: int, calc_only: bool) -> None:
+        self.positions = self.propagator.positions_at(start)
+        self.updateInterPlaneStatus()
+        self.queue = event_sim.EventQueue()
+        self.scheduleHorizon(start)
+        self.visible = [set(ids) for ids in self.schedule.initial]
+        for station_id in range(len(self.ground_stations)):
+            self.setStationUplinks(station_id, start)
+        self.countUplinks()
+        if self.trace is not None:
+            for sat_id in numpy.flatnonzero(self.prev_inter_plane_status != self.inter_plane_status):
+                self.trace_satellite_links(sat_id, start)
+            for station_id, sat_ids in enumerate(self.visible):
+                for sat_id in sorted(sat_ids):
+                    self.trace.uplink(start, station_id, sat_id, True)
+            self.queue.schedule(start, SatSimulation.TICK_EVENT)
+        if not self.calc_only:
+            self.send_updates()
+            self.flush_updates()
+
+        for failure in self.failures:
+            self.queue.schedule(start + datetime.timedelta(seconds=failure.down), SatSimulation.FAILURE_EVENT,
+                                (failure.node1, failure.node2, False))
+            if failure.up is not None:
+                self.queue.schedule(start + datetime.timedelta(seconds=failure.up), SatSimulation.FAILURE_EVENT,
+                                    (failure.node1, failure.node2, True))
+
+        clock = event_sim.Clock(start, pacing, rate)
+        handlers = {
+            SatSimulation.BAND_EVENT: self.handleBandEvent,
+            SatSimulation.UPLINK_EVENT: self.handleUplinkEvent,
+            SatSimulation.FAILURE_EVENT: self.handleFailureEvent,
+            SatSimulation.HORIZON_EVENT: self.handleHorizonEvent,
+            SatSimulation.TICK_EVENT: self.handleTickEvent,
+        }
+        count = event_sim.run_events(self.queue, clock, handlers, until)
+        if until is not None and clock.wall_elapsed() > 0:
+            print(f"{count} events, {duration / clock.wall_elapsed():.1f} simulated seconds per second")
+        print(f"zero uplink % = {self.zero_uplink_count / self.uplink_updates}")
+        print(f"updates sent {self.client.sent}, suppressed {self.client.suppressed}")
+        return count
+
+    def run_batch(self, duration: float, path: str | None = None,
+                  start: datetime.datetime | None = None) -> sim_trace.SimTrace:
+        """
+        Simulate duration seconds as fast as possible without sending updates,
+        recording all events and per tick statistics. The trace is saved to
+        path if given.
+        """
+        if start is None:
+            start = datetime.datetime.now(tz=datetime.timezone.utc)
+        self.calc_only = True
+        self.trace = sim_trace.SimTrace(start, [g.name for g in self.ground_stations],
+                                        [satellite.name for satellite in self.satellites])
+        wall_start = time.monotonic()
+        self.run_events(event_sim.FAST, duration=duration, start=start)
+        self.trace.duration = duration
+        self.trace.wall_seconds = time.monotonic() - wall_start
+        print(f"simulated {duration}s in {self.trace.wall_seconds:.2f}s, "
+              f"{duration / max(self.trace.wall_seconds, 1e-9):.1f} simulated seconds per second")
+        print(f"{len(self.trace.link_time)} link events, {len(self.trace.uplink_time)} uplink events, "
+              f"{len(self.trace.tick_time)} ticks, zero uplink ratio {self.trace.zero_uplink_ratio():.3f}")
+        if path is not None:
+            self.trace.save(path)
+            print(f"wrote {path}")
+        return self.trace
+
+
+def run(num_rings: int, num_routers: int, ground_stations: bool, min_alt: int, calc_only: bool,
+        look_ahead: int = sat_positions.WINDOW_SIZE, use_passes: bool = False,
+        pacing: str | None = None, rate: float = 1.0, duration: float | None = None,
+        failures: list[LinkFailure] | None = None, batch: str | None = None,
+        tick: float = SatSimulation.TIME_SLICE, workers: int = 0, async_updates: bool = False) -> None:
     """
     Simulate physical positions of satellites.
 
@@ -197,16 +540,148 @@ def run(num_rings: int, num_routers: int, ground_stations: bool, min_alt: int, c
     ground_stations: True if groundstations are included
     min_alt: Minimum angle (degrees) above horizon needed to connect to the satellite
     calc_only: If True, only loop quicky dumping results to the screen
+    look_ahead: Number of time slices to propagate ahead
+    use_passes: If True, send uplink changes at predicted rise / set times
+    pacing: If set, run as a discrete event simulation with realtime, accelerated or fast pacing
+    rate: Simulated seconds per second for accelerated pacing
+    duration: Simulated seconds to run in event mode, None to run forever
+    failures: Links to take down and restore in event mode
+    batch: If set, simulate duration seconds without pacing and write a trace to this file
+    tick: Seconds between statistics samples in the batch trace
+    workers: If above 0, propagate with a pool of this many processes
+    async_updates: If True, send updates to the driver in the background
     """
-    graph = torus_topo.create_network(num_rings, num_routers, ground_stations)
+    graph = topo_cache.create_network(num_rings, num_routers, ground_stations)
     sim: SatSimulation = SatSimulation(graph)
     sim.min_altitude = min_alt
     sim.calc_only = calc_only
-    sim.run()
+    sim.look_ahead = look_ahead
+    sim.use_passes = use_passes
+    sim.failures = failures if failures is not None else []
+    sim.tick = tick
+    if workers > 0:
+        sim.usePool(workers)
+    if async_updates and not calc_only and batch is None:
+        sim.client = update_filter.UpdateFilter(simclient.AsyncClient(DRIVER_URL))
+    if batch is not None:
+        sim.run_batch(duration if duration is not None else BATCH_DURATION, batch)
+    elif pacing is None:
+        sim.run()
+    else:
+        sim.run_events(pacing, rate, duration)
+
+
+def parse_failures(section) -> list[LinkFailure]:
+    """
+    Read link failures, each entry is: <node1> <node2> <down-seconds> [<up-seconds>]
+    """
+    failures = []
+    for value in section.values():
+        fields = value.split()
+        up = float(fields[3]) if len(fields) > 3 else None
+        failures.append(LinkFailure(fields[0], fields[1], float(fields[2]), up))
+    return failures
+
+
+def run_batch_test() -> bool:
+    """
+    Run a short batch and check the saved trace.
+    """
+    graph = torus_topo.create_network(10, 10, True)
+    sim = SatSimulation(graph)
+    sim.min_altitude = 20
+    sim.pass_horizon = 900
+    sim.failures = [LinkFailure("R0_0", "R0_1", 100, 200)]
+    start = datetime.datetime(2024, 6, 1, tzinfo=datetime.timezone.utc)
+    with tempfile.TemporaryDirectory() as trace_dir:
+        path = f"{trace_dir}/batch_test.npz"
+        trace = sim.run_batch(2000, path, start)
+        loaded = sim_trace.SimTrace.load(path)
+    if len(loaded.tick_time) != 201 or loaded.link_time != trace.link_time:
+        return False
+    if loaded.uplink_satellite != trace.uplink_satellite or loaded.start != start:
+        return False
+    failure = [(t, loaded.node_names[n1], loaded.node_names[n2], up)
+               for t, n1, n2, up in zip(loaded.link_time, loaded.link_node1, loaded.link_node2, loaded.link_up)
+               if loaded.node_names[n1] == "R0_0" and loaded.node_names[n2] == "R0_1"]
+    if failure != [(100.0, "R0_0", "R0_1", False), (200.0, "R0_0", "R0_1", True)]:
+        return False
+    # The uplinks in the last tick follow from the uplink events
+    visible: list[set[int]] = [set() for _ in loaded.station_names]
+    for t, station, satellite, rise in zip(loaded.uplink_time, loaded.uplink_station,
+                                           loaded.uplink_satellite, loaded.uplink_rise):
+        if rise:
+            visible[station].add(satellite)
+        else:
+            visible[station].discard(satellite)
+    if loaded.tick_uplinks[-1] != [len(ids) for ids in visible]:
+        return False
+    # Links up in each tick match the link state snapshots at the same times
+    topo = compact_topo.from_graph(graph)
+    latitudes = link_snapshots.satellite_latitudes(graph, topo, start, sim.tick, len(loaded.tick_time))
+    states = link_snapshots.link_states(topo, latitudes)[:, topo.edge_inter_ring]
+    return loaded.tick_links_up == [int(count) for count in states.sum(axis=1)]
+
+
+def run_resend_test() -> bool:
+    """
+    Restart the driver while updates are pending and check that all link and
+    uplink state is sent to the new driver.
+    """
+
+    def start_driver(port: int) -> http.server.ThreadingHTTPServer:
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", port), simclient._TestHandler)
+        server.received = []  # type: ignore
+        server.failures = 0  # type: ignore
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    graph = torus_topo.create_network(10, 10, True)
+    sim = SatSimulation(graph)
+    sim.min_altitude = 20
+    server = start_driver(0)
+    port = server.server_address[1]
+    sim.client = update_filter.UpdateFilter(simclient.Client(f"http://127.0.0.1:{port}"))
+    saved_delay = simclient.RETRY_DELAY
+    simclient.RETRY_DELAY = 0.0
+    try:
+        start = datetime.datetime(2024, 6, 1, tzinfo=datetime.timezone.utc)
+        sim.positions = sim.propagator.positions_at(start)
+        sim.updateUplinkStatus(start)
+        sim.updateInterPlaneStatus()
+        sim.send_updates()
+        sim.flush_updates()
+
+        # The driver stops and a link failure can not be delivered
+        server.shutdown()
+        server.server_close()
+        failure = event_sim.Event(start, 0, SatSimulation.FAILURE_EVENT, ("R0_0", "R0_1", False))
+        sim.handleFailureEvent(failure)
+        if sim.client.client.pending() != 1:
+            return False
+
+        # The restarted driver gets the failure and then the full state
+        server = start_driver(port)
+        sim.flush_updates()
+        links = {update_filter.link_key(body["node1_name"], body["node2_name"]): body["up"]
+                 for path, body in server.received if path == "/links"}  # type: ignore
+        stations = {body["ground_node"] for path, body in server.received if path == "/uplinks"}  # type: ignore
+        expected = {("R0_0", "R0_1"): False}
+        for node1, node2, inter_ring in graph.edges(data="inter_ring"):
+            if inter_ring:
+                expected[update_filter.link_key(node1, node2)] = sim.inter_ring_link_up(sim.sat_ids[node1], node2)
+        if list(expected.values()).count(False) < 2:
+            return False
+        return links == expected and stations == {g.name for g in sim.ground_stations}
+    finally:
+        simclient.RETRY_DELAY = saved_delay
+        sim.client.client.close()
+        server.shutdown()
+        server.server_close()
 
 
 def usage():
-    print("Usage: sim_sat [config-file] [--calc-ony]")
+    print("Usage: sim_sat [config-file] [--calc-ony] [--async-updates] [--batch trace-file]")
 
 if __name__ == "__main__":
     calc_only = False
@@ -215,6 +690,22 @@ if __name__ == "__main__":
         calc_only = True
         sys.argv.remove("--calc-only")
 
+    async_updates = False
+    if "--async-updates" in sys.argv:
+        # Send updates to the driver in the background
+        async_updates = True
+        sys.argv.remove("--async-updates")
+
+    batch = None
+    if "--batch" in sys.argv:
+        # Simulate the configured duration as fast as possible and write a trace file
+        index = sys.argv.index("--batch")
+        if index + 1 >= len(sys.argv):
+            usage()
+            sys.exit(-1)
+        batch = sys.argv[index + 1]
+        del sys.argv[index:index + 2]
+
     if len(sys.argv) > 2:
         usage()
         sys.exit(-1)
@@ -222,6 +713,8 @@ if __name__ == "__main__":
     parser = configparser.ConfigParser()
     parser['network'] = {}
     parser['physical'] = {}
+    parser['simulation'] = {}
+    parser['failures'] = {}
     try:
         if len(sys.argv) == 2:
             parser.read(sys.argv[1])
@@ -236,6 +729,22 @@ if __name__ == "__main__":
     ground_stations = parser['network'].getboolean('ground_stations', False)
     # Minimum angle above horizon needed to connect to satellites
     min_alt = parser['physical'].getint('min_altitude', SatSimulation.MIN_ALTITUDE)
+    # Number of time slices to propagate ahead of the current time
+    look_ahead = parser['physical'].getint('look_ahead', sat_positions.WINDOW_SIZE)
+    # Number of processes used to propagate positions, 0 for none
+    workers = parser['physical'].getint('workers', 0)
+    # Send uplink changes at predicted rise and set times
+    use_passes = parser['physical'].getboolean('use_passes', False)
+    # Discrete event mode: realtime, accelerated or fast
+    pacing = parser['simulation'].get('pacing', None)
+    rate = parser['simulation'].getfloat('rate', 1.0)
+    duration = parser['simulation'].getfloat('duration', None)
+    failures = parse_failures(parser['failures'])
+    # Send updates to the driver in the background
+    async_updates = async_updates or parser['simulation'].getboolean('async_updates', False)
+    # Seconds between statistics samples in a batch trace
+    tick = parser['simulation'].getfloat('tick', SatSimulation.TIME_SLICE)
 
     print(f"Running {num_rings} rings with {num_routers} per ring, ground stations {ground_stations}")
-    run(num_rings, num_routers, ground_stations, min_alt, calc_only)
+    run(num_rings, num_routers, ground_stations, min_alt, calc_only, look_ahead, use_passes,
+        pacing, rate, duration, failures, batch, tick, workers, async_updates)
@@ -3,8 +3,11 @@ Time consuming tests
 """
 import unittest
 import torus_topo
+import route_matrix
 
 class TestCase(unittest.TestCase):
     def testTorusRouting(self):
         self.assertTrue(torus_topo.run_routing_test())
 
+    def testRouteMatrixRouting(self):
+        self.assertTrue(route_matrix.run_routing_test())
@@ -0,0 +1,234 @@
+"""
+Precomputed link state of a satellite network over time.
+
+Inter plane (inter ring) links are down while either satellite is beyond
+the latitude band used by geosimsat (inclination - 2 degrees). Since this
+depends only on the orbits, the link state for a full orbital period can
+be computed once and replayed or analyzed without propagating orbits again.
+
+The link states are stored over the edge index of a compact topology as
+packed bitsets at keyframe steps plus the list of edges that flip at each
+step. The state at any step is rebuilt from the nearest keyframe.
+"""
+
+import datetime
+import math
+import os
+import tempfile
+
+import numpy
+import networkx
+from skyfield.api import load, wgs84  # type: ignore
+
+import compact_topo
+import sat_records
+import torus_topo
+
+# Default time between snapshots in seconds
+STEP = 10.0
+# Number of steps between full bitsets
+KEYFRAME_INTERVAL = 64
+# Latitude margin below the inclination where inter plane links go down
+LATITUDE_MARGIN = 2
+
+
+class LinkSnapshots:
+    """
+    Link state at a series of time steps, delta encoded over the edge index.
+    """
+
+    def __init__(self, start: datetime.datetime, step: float, num_edges: int,
+                 keyframes: numpy.ndarray, delta_offsets: numpy.ndarray, delta_edges: numpy.ndarray,
+                 keyframe_interval: int = KEYFRAME_INTERVAL) -> None:
+        self.start = start
+        self.step = step
+        self.num_edges = num_edges
+        self.keyframes = keyframes  # packed bitsets, one row per keyframe
+        self.delta_offsets = delta_offsets  # deltas for step i: delta_edges[offsets[i]:offsets[i+1]]
+        self.delta_edges = delta_edges
+        self.keyframe_interval = keyframe_interval
+
+    def count(self) -> int:
+        """
+        Number of time steps
+        """
+        return len(self.delta_offsets) - 1
+
+    def time_at(self, step: int) -> datetime.datetime:
+        return self.start + datetime.timedelta(seconds=self.step * step)
+
+    def step_at(self, time: datetime.datetime) -> int:
+        """
+        Return the step in effect at the given time, wrapping around the
+        period covered by the snapshots.
+        """
+        offset = (time - self.start).total_seconds()
+        return int(math.floor(offset / self.step)) % self.count()
+
+    def changes(self, step: int) -> numpy.ndarray:
+        """
+        Return the ids of the edges that change state at a step.
+        """
+        return self.delta_edges[self.delta_offsets[step]:self.delta_offsets[step + 1]]
+
+    def state_at(self, step: int) -> numpy.ndarray:
+        """
+        Return the up state of each edge at a step as a bool array.
+        """
+        keyframe = step // self.keyframe_interval
+        packed = self.keyframes[keyframe]
+        state = numpy.unpackbits(packed, count=self.num_edges).astype(bool)
+        first = keyframe * self.keyframe_interval + 1
+        flips = self.delta_edges[self.delta_offsets[first]:self.delta_offsets[step + 1]]
+        # An edge that flips an even number of times is unchanged
+        toggled = numpy.bincount(flips, minlength=self.num_edges) % 2 == 1
+        return state ^ toggled
+
+    def state_at_time(self, time: datetime.datetime) -> numpy.ndarray:
+        return self.state_at(self.step_at(time))
+
+    def apply(self, topo: compact_topo.CompactTopo, step: int) -> None:
+        """
+        Set the edge state of a topology to the state at a step.
+        """
+        topo.edge_up[:] = self.state_at(step)
+
+    def save(self, path: str) -> None:
+        numpy.savez(
+            path,
+            start=numpy.array(self.start.isoformat()),
+            step=self.step,
+            num_edges=self.num_edges,
+            keyframes=self.keyframes,
+            delta_offsets=self.delta_offsets,
+            delta_edges=self.delta_edges,
+            keyframe_interval=self.keyframe_interval,
+        )
+
+    @staticmethod
+    def load(path: str) -> "LinkSnapshots":
+        with numpy.load(path) as data:
+            return LinkSnapshots(
+                datetime.datetime.fromisoformat(str(data["start"])),
+                float(data["step"]),
+                int(data["num_edges"]),
+                data["keyframes"],
+                data["delta_offsets"],
+                data["delta_edges"],
+                int(data["keyframe_interval"]),
+            )
+
+
+def link_states(topo: compact_topo.CompactTopo, latitudes: numpy.ndarray) -> numpy.ndarray:
+    """
+    Compute edge up states from satellite latitudes, using the orbit
+    inclination of each satellite.
+
+    latitudes: degrees, shape (steps, nodes), indexed by node id
+    Returns a bool array of shape (steps, edges).
+    """
+    limit = topo.orbit_inclination - LATITUDE_MARGIN
+    in_band = (latitudes <= limit) & (latitudes >= -limit)
+    states = numpy.ones((len(latitudes), topo.num_edges()), dtype=bool)
+    inter = numpy.flatnonzero(topo.edge_inter_ring)
+    node1 = topo.edge_nodes[inter, 0]
+    node2 = topo.edge_nodes[inter, 1]
+    states[:, inter] = in_band[:, node1] & in_band[:, node2]
+    return states
+
+
+def encode_link_states(start: datetime.datetime, step: float, states: numpy.ndarray,
+                       keyframe_interval: int = KEYFRAME_INTERVAL) -> LinkSnapshots:
+    """
+    Delta encode a (steps, edges) bool array of link states.
+    """
+    num_edges = states.shape[1]
+    keyframes = numpy.packbits(states[::keyframe_interval], axis=1)
+    flipped = states[1:] != states[:-1]
+    steps, edges = numpy.nonzero(flipped)
+    counts = numpy.bincount(steps + 1, minlength=len(states))
+    delta_offsets = numpy.zeros(len(states) + 1, dtype=numpy.int64)
+    numpy.cumsum(counts, out=delta_offsets[1:])
+    return LinkSnapshots(start, step, num_edges, keyframes, delta_offsets,
+                         edges.astype(numpy.int32), keyframe_interval)
+
+
+def satellite_latitudes(graph: networkx.Graph, topo: compact_topo.CompactTopo,
+                        start: datetime.datetime, step: float, count: int) -> numpy.ndarray:
+    """
+    Propagate the satellites of a graph and return latitudes in degrees
+    of shape (count, nodes). Ground stations have nan.
+    """
+    ts = load.timescale()
+    offsets = numpy.arange(count) * step
+    times = ts.utc(start.year, start.month, start.day, start.hour, start.minute,
+                   start.second + start.microsecond / 1e6 + offsets)
+    latitudes = numpy.full((count, topo.num_nodes()), numpy.nan)
+    for satellite in sat_records.build_earth_satellites(graph, ts):
+        lat, lon = wgs84.latlon_of(satellite.at(times))
+        latitudes[:, topo.name_to_id[satellite.name]] = lat.degrees
+    return latitudes
+
+
+def orbital_period(graph: networkx.Graph) -> float:
+    """
+    Return the orbital period in seconds of the satellites in the graph.
+    """
+    name = torus_topo.satellites(graph)[0]
+    satrec = sat_records.satrec_from_orbit(graph.nodes[name]["orbit"], sat_records.default_epoch())
+    # Mean motion is in radians per minute
+    return 2 * math.pi / satrec.no_kozai * 60
+
+
+def generate_link_snapshots(graph: networkx.Graph, start: datetime.datetime | None = None,
+                            step: float = STEP, keyframe_interval: int = KEYFRAME_INTERVAL) -> LinkSnapshots:
+    """
+    Generate link state snapshots covering one orbital period.
+    Edge ids are those of compact_topo.from_graph(graph).
+    """
+    if start is None:
+        start = datetime.datetime.now(tz=datetime.timezone.utc)
+    topo = compact_topo.from_graph(graph)
+    count = int(math.ceil(orbital_period(graph) / step))
+    latitudes = satellite_latitudes(graph, topo, start, step, count)
+    states = link_states(topo, latitudes)
+    return encode_link_states(start, step, states, keyframe_interval)
+
+
+def run_link_snapshots_test() -> bool:
+    """
+    Generate snapshots for a small network and check random access reconstruction.
+    """
+    graph = torus_topo.create_network(4, 4)
+    start = datetime.datetime(2024, 6, 1, tzinfo=datetime.timezone.utc)
+    topo = compact_topo.from_graph(graph)
+    count = 200
+    latitudes = satellite_latitudes(graph, topo, start, STEP, count)
+    states = link_states(topo, latitudes)
+    if states.all() or not states.any():
+        # Expect some inter plane links to go down over the interval
+        return False
+    snapshots = encode_link_states(start, STEP, states, keyframe_interval=16)
+
+    for step in (0, 1, 15, 16, 17, 63, 150, count - 1):
+        if not (snapshots.state_at(step) == states[step]).all():
+            return False
+        if step > 0 and set(snapshots.changes(step)) != set(numpy.flatnonzero(states[step] != states[step - 1])):
+            return False
+    if snapshots.step_at(start + datetime.timedelta(seconds=STEP * 20 + 3)) != 20:
+        return False
+
+    fd, path = tempfile.mkstemp(suffix=".npz")
+    os.close(fd)
+    try:
+        snapshots.save(path)
+        loaded = LinkSnapshots.load(path)
+    finally:
+        os.unlink(path)
+    return loaded.start == start and bool((loaded.state_at(150) == states[150]).all())
+
+
+if __name__ == "__main__":
+    graph = torus_topo.create_network()
+    snapshots = generate_link_snapshots(graph)
+    print(f"{snapshots.count()} steps, {len(snapshots.delta_edges)} link changes")
@@ -1,89 +1,196 @@
+import asyncio
+import concurrent.futures
+import copy
+import dataclasses
+from dataclasses import dataclass
 import datetime
-from contextlib import contextmanager
+import queue
 import threading
 import time
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, StreamingResponse
 from pydantic import BaseModel
 
 import uvicorn
 import mininet
 
-from mnet.frr_topo import FrrSimRuntime
+from mnet import event_log
+from mnet import event_stream
+from mnet.frr_topo import FrrSimRuntime, GroundStation
 import simapi
 
 
 # TODO:
-# Open issue around context locking:
-#   We block the calling thread with a lock. Is there a problem between
-#   this and the asyncio model are are using with the server?
 # Add a static page with
 # - status
 # - shutdown links
 # - data
 # Surpress error on shutdown
 
+# Concurrency:
+#   Only the writer thread changes the FrrSimRuntime or calls into mininet.
+#   Changes are submitted to it as jobs on a queue and the async endpoints
+#   await the result without blocking the event loop. After each job the
+#   writer publishes a new Snapshot. Pages and other read only requests
+#   render from the current snapshot and never wait for the writer.
+#   The topology layout does not change after start and is read once.
+#   Node status lists come from the monitor databases, not the runtime.
+#   The writer also publishes each change to the /stream subscribers.
+
+
+# Directory of the event log
+EVENT_DIR = "events"
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """
+    Consistent copy of the state shown by read only requests. Never modified once published.
+    """
+    events: tuple[tuple[datetime.datetime, str], ...]
+    stat_samples: tuple[tuple, ...]
+    ping_stats: dict[str, list[tuple[str, bool]]]
+    stations: dict[str, GroundStation]
+    routers: dict[str, dict]
+    link_count: int
+    links_up: int
+
 
 class NetxContext:
     """
-    References key simulation resources and protects against multi-threaded access.
+    References key simulation resources. Changes are made by a single writer thread.
     """
-    def __init__(self, frrt: FrrSimRuntime, uvicorn_server):
+    def __init__(self, frrt: FrrSimRuntime, uvicorn_server, event_dir: str = EVENT_DIR):
         self.frrt = frrt
         self.server = uvicorn_server
-        self.events = []
+        print(f"Event log {event_dir}")
+        self.event_log = event_log.EventLog(event_dir)
         self.start_time = datetime.datetime.now()
-        self.lock = threading.Lock()
-
-    def add_event(self, event: str):
-        self.events.append((datetime.datetime.now(), event))
-        if len(self.events) > 1000:
-            self.events.pop(0)
+        self.jobs: queue.Queue = queue.Queue()
+        self.writer: threading.Thread | None = None
+        self.broadcaster = event_stream.Broadcaster()
+        # Layout of the topology, fixed once the network is built
+        graph = frrt.get_topo_graph()
+        self.layout = {
+            "rings": graph.graph["rings"],
+            "ring_nodes": graph.graph["ring_nodes"],
+            "shells": graph.graph.get("shells", []),
+            "ring_list": frrt.get_ring_list(),
+            "routers": frrt.get_router_list(),
+            "stable_monitor": frrt.stable_monitor,
+        }
+        self.snapshot = self.build_snapshot()
+
+    def add_event(self, event: str, nodes: tuple[str, ...] = ()):
+        self.event_log.add(datetime.datetime.now(), event, nodes)
+
+    def publish_link(self, node1: str, node2: str, up: bool):
+        self.broadcaster.publish(event_stream.LINK, {
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "node1": node1, "node2": node2, "up": up, "text": link_event(node1, node2, up)})
+
+    def publish_uplinks(self, station: GroundStation):
+        self.broadcaster.publish(event_stream.UPLINKS, {
+            "time": datetime.datetime.now().isoformat(timespec="seconds"),
+            "station": station.name, "uplinks": station.sat_links(), "text": uplinks_event(station)})
+
+    def add_stat_sample(self, sample: tuple):
+        self.frrt.add_stat_sample(sample)
+        self.broadcaster.publish(event_stream.STATS, {
+            "time": sample[0].isoformat(timespec="seconds"),
+            "stable_ok": sample[1], "stable_total": sample[2],
+            "dynamic_ok": sample[3], "dynamic_total": sample[4]})
 
     def run_time(self) -> datetime.timedelta:
         now = datetime.datetime.now()
         return now - self.start_time
 
-    def aquire(self):
-        self.lock.acquire()
-
-    def release(self):
-        self.lock.release()
+    def submit(self, function, *args) -> concurrent.futures.Future:
+        """
+        Queue a call to run on the writer thread. Returns a future for its result.
+        """
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        self.jobs.put((future, function, args))
+        return future
+
+    async def call(self, function, *args):
+        """
+        Run a call on the writer thread and wait for it without blocking the event loop.
+        """
+        return await asyncio.wrap_future(self.submit(function, *args))
+
+    def start_writer(self):
+        self.writer = threading.Thread(target=self.run_writer, daemon=True)
+        self.writer.start()
+
+    def stop_writer(self):
+        self.jobs.put(None)
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+
+    def run_writer(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            future, function, args = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(function(*args))
+            except Exception as e:
+                future.set_exception(e)
+            self.snapshot = self.build_snapshot()
+
+    def build_snapshot(self) -> Snapshot:
+        stations = {}
+        for station in self.frrt.get_ground_stations():
+            view = copy.copy(station)
+            view.uplinks = [dataclasses.replace(uplink) for uplink in station.uplinks]
+            stations[station.name] = view
+        routers = {name: self.frrt.get_router(name) for name in self.frrt.get_topo_graph().nodes}
+        ping_stats = {name: list(pings) for name, pings in self.frrt.get_last_five_stats().items()}
+        link_count, links_up = self.frrt.get_link_counts()
+        return Snapshot(
+            events=tuple(self.event_log.recent(10)),
+            stat_samples=tuple(self.frrt.get_stat_samples()),
+            ping_stats=ping_stats,
+            stations=stations,
+            routers=routers,
+            link_count=link_count,
+            links_up=links_up,
+        )
 
 
 global_context: NetxContext = None
 
 
-@contextmanager
-def get_context():
-    """"
-    Serialize access to the global context
-    """
-    try:
-        global_context.aquire()
-        yield global_context
-    finally:
-        global_context.release()
+def get_context() -> NetxContext:
+    return global_context
+
 
 run_thread: bool = True
 def background_thread():
     """
     Drive background collection of monitoring stats.
+    The monitor databases are read here, only the new sample is added by the writer.
     """
     while run_thread:
         if run_thread:
-            with get_context() as context:
-                context.frrt.sample_stats()
+            context = get_context()
+            sample = context.frrt.collect_monitor_stats()
+            context.submit(context.add_stat_sample, sample)
         time.sleep(20)
 
 
 app = FastAPI()
 
-def run(frrt: FrrSimRuntime):
+def run(frrt: FrrSimRuntime, event_dir: str = EVENT_DIR):
     """
-    Start the control API
+    Start the control API. Events are logged to event_dir, adding to the events of earlier runs.
     """
     global global_context
     global run_thread
@@ -92,13 +199,16 @@ def run(frrt: FrrSimRuntime):
         app, host="0.0.0.0", port=8000, log_level="info", loop="asyncio"
     )
     server = uvicorn.Server(config=config)
-    global_context = NetxContext(frrt, server)
+    global_context = NetxContext(frrt, server, event_dir)
+    global_context.start_writer()
     # Consider using a uvicorn facility to do this instead
     bg_thread = threading.Thread(target=background_thread)
     bg_thread.daemon = True
     bg_thread.start()
     server.run()
     run_thread = False
+    global_context.stop_writer()
+    global_context.event_log.close()
 
 
 # Used with HTML templates to generate pages
@@ -107,52 +217,45 @@ templates = Jinja2Templates(directory="mnet/templates")
 
 @app.get("/", response_class=HTMLResponse)
 def root(request: Request):
-    with get_context() as context:
-        rings = context.frrt.get_topo_graph().graph["rings"]
-        current_time = datetime.datetime.now().isoformat(sep=" ", timespec="seconds")
-        run_time = str(context.run_time())
-        ring_nodes = context.frrt.get_topo_graph().graph["ring_nodes"]
-        routers = context.frrt.get_router_list()
-        links = context.frrt.get_link_list()
-        link_stats = {}
-        link_stats["count"] = len(links)
-        up_count = 0
-        for link in links:
-            up1, up2 = context.frrt.get_link_state(link[0], link[1])
-            if up1 and up2:
-                up_count += 1
-
-        link_stats["up_count"] = up_count
-
-        stat_samples = context.frrt.get_stat_samples()
-
-        monitor_stable_nodes: bool = context.frrt.stable_monitor
-        stats_dates = []
-        stats_stable_fail = []
-        stats_stable_ok = []
-        stats_dynamic_fail = []
-        stats_dynamic_ok = []
-
-        for stat in stat_samples:
-            stats_dates.append(stat[0].time().isoformat(timespec="seconds"))
-            stats_stable_ok.append(stat[1])
-            stats_stable_fail.append(stat[2] - stat[1])
-            stats_dynamic_ok.append(stat[3])
-            stats_dynamic_fail.append(stat[4] - stat[3])
-
-        # dict: key name, value: list of up to five tuples. tuple[name,bool]
-        ping_stats = context.frrt.get_last_five_stats()
-        events = []
-        for entry in context.events[-min(len(context.events), 10) :]:
-            events.append((entry[0].time().isoformat(timespec="seconds"), entry[1]))
-        stations = context.frrt.get_ground_stations()
+    context = get_context()
+    snapshot = context.snapshot
+    layout = context.layout
+    current_time = datetime.datetime.now().isoformat(sep=" ", timespec="seconds")
+    run_time = str(context.run_time())
+    link_stats = {}
+    link_stats["count"] = snapshot.link_count
+    link_stats["up_count"] = snapshot.links_up
+
+    stat_samples = snapshot.stat_samples
+
+    monitor_stable_nodes: bool = layout["stable_monitor"]
+    stats_dates = []
+    stats_stable_fail = []
+    stats_stable_ok = []
+    stats_dynamic_fail = []
+    stats_dynamic_ok = []
+
+    for stat in stat_samples:
+        stats_dates.append(stat[0].time().isoformat(timespec="seconds"))
+        stats_stable_ok.append(stat[1])
+        stats_stable_fail.append(stat[2] - stat[1])
+        stats_dynamic_ok.append(stat[3])
+        stats_dynamic_fail.append(stat[4] - stat[3])
+
+    # dict: key name, value: list of up to five tuples. tuple[name,bool]
+    ping_stats = snapshot.ping_stats
+    events = []
+    for entry in snapshot.events:
+        events.append((entry[0].time().isoformat(timespec="seconds"), entry[1]))
+    stations = list(snapshot.stations.values())
 
     info = {
-        "rings": rings,
-        "ring_nodes": ring_nodes,
+        "rings": layout["rings"],
+        "shells": layout["shells"],
+        "ring_nodes": layout["ring_nodes"],
         "current_time": current_time,
         "run_time": run_time,
-        "routers": routers,
+        "routers": layout["routers"],
         "link_stats": link_stats,
         "events": events,
         "monitor_stable_nodes": monitor_stable_nodes,
@@ -173,16 +276,28 @@ def intf_state(up: bool):
     return "up" if up else "down"
 
 
+# Text of events, the same in the event log and the /stream updates
+def link_event(node1: str, node2: str, up: bool) -> str:
+    return f"set link {node1} - {node2} {intf_state(up)}"
+
+
+def uplinks_event(station: GroundStation) -> str:
+    return f"set uplinks {station.name} - {', '.join(station.sat_links())}"
+
+
 @app.get("/view/router/{node}", response_class=HTMLResponse)
 def view_router(request: Request, node: str):
-    with get_context() as context:
-        router = context.frrt.get_router(node)
-        status_list = context.frrt.get_node_status_list(node)
-        ring_list = context.frrt.get_ring_list()
-        for neighbor in router["neighbors"]:
-            intf1_state = intf_state(router["neighbors"][neighbor]["up"][0])
-            intf2_state = intf_state(router["neighbors"][neighbor]["up"][1])
-            router["neighbors"][neighbor]["up"] = (intf1_state, intf2_state)
+    context = get_context()
+    router = context.snapshot.routers.get(node)
+    if router is None:
+        raise HTTPException(status_code=404, detail=f"{node} does not exist")
+    status_list = context.frrt.get_node_status_list(node)
+    ring_list = context.layout["ring_list"]
+    # Show interface states as text, without changing the snapshot
+    neighbors = {}
+    for neighbor, info in router["neighbors"].items():
+        neighbors[neighbor] = dict(info, up=(intf_state(info["up"][0]), intf_state(info["up"][1])))
+    router = dict(router, neighbors=neighbors)
 
     return templates.TemplateResponse(
         request=request,
@@ -192,10 +307,12 @@ def view_router(request: Request, node: str):
 
 @app.get("/view/station/{name}", response_class=HTMLResponse)
 def view_station(request: Request, name: str):
-    with get_context() as context:
-        station = context.frrt.get_station(name)
-        status_list = context.frrt.get_node_status_list(name)
-        ring_list = context.frrt.get_ring_list()
+    context = get_context()
+    station = context.snapshot.stations.get(name)
+    if station is None:
+        raise HTTPException(status_code=404, detail=f"{name} does not exist")
+    status_list = context.frrt.get_node_status_list(name)
+    ring_list = context.layout["ring_list"]
     return templates.TemplateResponse(
         request=request,
         name="station.html",
@@ -204,50 +321,110 @@ def view_station(request: Request, name: str):
 
 
 @app.put("/link")
-def set_link(link: simapi.Link):
+async def set_link(link: simapi.Link):
     """
     Set link up or down
     """
-    with get_context() as context:
-        state = "up" if link.up else "down"
-        context.add_event(f"set link {link.node1_name} - {link.node2_name} {state}")
+    context = get_context()
+
+    def apply():
+        context.add_event(link_event(link.node1_name, link.node2_name, link.up),
+                          (link.node1_name, link.node2_name))
         err = context.frrt.set_link_state(
             link.node1_name, link.node2_name, link.up
         )
+        if err is None:
+            context.publish_link(link.node1_name, link.node2_name, link.up)
+        return err
+
+    err = await context.call(apply)
     if err is not None:
         return {"error": err}
     return {"status": "OK"}
 
+@app.put("/links")
+async def set_links(links: simapi.Links) -> simapi.LinksResult:
+    """
+    Set a list of links up or down, all in one job of the writer
+    """
+    context = get_context()
+    changes = [(link.node1_name, link.node2_name, link.up) for link in links.links]
+
+    def apply():
+        start = time.monotonic()
+        errors = context.frrt.set_link_states(changes)
+        elapsed = time.monotonic() - start
+        for link, err in zip(links.links, errors):
+            if err is None:
+                context.add_event(link_event(link.node1_name, link.node2_name, link.up),
+                                  (link.node1_name, link.node2_name))
+                context.publish_link(link.node1_name, link.node2_name, link.up)
+        return errors, elapsed
+
+    errors, elapsed = await context.call(apply)
+    results = [simapi.LinkResult(node1_name=link.node1_name, node2_name=link.node2_name, error=err)
+               for link, err in zip(links.links, errors)]
+    return simapi.LinksResult(results=results, elapsed=elapsed)
+
 @app.put("/uplinks")
-def set_uplinks(uplinks: simapi.UpLinks):
+async def set_uplinks(uplinks: simapi.UpLinks):
     """
     Change the current set of uplinks for a ground station
     """
-    with get_context() as context:
+    context = get_context()
+
+    def apply():
         print(f"set uplinks for {uplinks.ground_node}")
-        # TODO: create an event in the event log?
-        context.frrt.set_station_uplinks(uplinks.ground_node, 
-                                             uplinks.uplinks)
-        return {"status": "OK"}
+        if context.frrt.set_station_uplinks(uplinks.ground_node,
+                                            uplinks.uplinks):
+            station = context.frrt.get_station(uplinks.ground_node)
+            context.add_event(uplinks_event(station), (station.name, *station.sat_links()))
+            context.publish_uplinks(station)
+
+    await context.call(apply)
+    return {"status": "OK"}
+
+
+@app.get("/stream")
+async def stream():
+    """
+    Server-Sent Events stream of link changes, uplink changes and stat samples
+    """
+    broadcaster = get_context().broadcaster
+    subscriber = broadcaster.subscribe()
+    return StreamingResponse(broadcaster.stream(subscriber), media_type="text/event-stream")
+
+
+@app.get("/events")
+def events(since: datetime.datetime | None = None, until: datetime.datetime | None = None,
+           node: str | None = None, limit: int = 1000):
+    """
+    Logged events from since up to until, optionally only those for a node
+    """
+    records = get_context().event_log.query(since, until, node, limit)
+    return {"events": records}
 
 
 @app.get("/stats/total")
 def stats_total():
-    with get_context() as context:
-        good, total = context.frrt.get_monitor_stats()
+    samples = get_context().snapshot.stat_samples
+    good, total = 0, 0
+    if len(samples) > 0:
+        good = samples[-1][1] + samples[-1][3]
+        total = samples[-1][2] + samples[-1][4]
     return {"good_count": good, "toital_count": total}
 
 
 @app.get("/shutdown", response_class=HTMLResponse)
 async def shutdown():
-    with get_context() as context:
-        context.server.should_exit = True
-        context.server.force_exit = True
-        await context.server.shutdown()
+    context = get_context()
+    context.server.should_exit = True
+    context.server.force_exit = True
+    await context.server.shutdown()
     return "<html><body><h1>Shutting down...</h1></body></html>"
 
 
 def invoke_shutdown():
-    with get_context() as context:
-        context.server.should_exit = True
-        context.server.force_exit = True
+    context = get_context()
+    context.server.should_exit = True
+    context.server.force_exit = True
@@ -0,0 +1,154 @@
+"""
+Event log for the emulation driver.
+
+Every event is appended to a segment file on disk, one JSON record per
+line, so the full history of a run is kept for later analysis. A new
+segment is started every SEGMENT_EVENTS events. The most recent events
+are also kept in memory in a ring buffer for the status page.
+
+An in-memory index holds the time and file location of each event, and
+for each node the numbers of the events that name it. Time range and per
+node queries find their events with a binary search and read only those
+records from disk.
+
+Opening an existing log directory rebuilds the index from its segments
+and appends to a new segment. Other files in the directory are ignored.
+"""
+
+import array
+import bisect
+import collections
+import datetime
+import json
+import os
+import re
+import threading
+
+# Events kept in memory
+RECENT_EVENTS = 1000
+# Events in each segment file
+SEGMENT_EVENTS = 100000
+
+
+class EventLog:
+    """
+    Append only log of events, with an index by time and node.
+    """
+
+    def __init__(self, directory: str, recent: int = RECENT_EVENTS,
+                 segment_events: int = SEGMENT_EVENTS) -> None:
+        self.directory = directory
+        self.segment_events = segment_events
+        self.recent_events: collections.deque[tuple[datetime.datetime, str]] = collections.deque(maxlen=recent)
+        self.lock = threading.Lock()
+        # Index, by event number
+        self.times = array.array("d")
+        self.segments = array.array("l")
+        self.offsets = array.array("q")
+        # Event numbers of each node
+        self.nodes: dict[str, array.array] = {}
+
+        os.makedirs(directory, exist_ok=True)
+        self.segment = 0
+        for name in sorted(os.listdir(directory)):
+            if re.fullmatch(r"\d{6}\.log", name):
+                self.segment = int(name[:-4])
+                self._load_segment(self.segment)
+                self.segment += 1
+        self.segment_count = 0
+        self.file = open(self._segment_path(self.segment), "ab", buffering=0)
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{segment:06d}.log")
+
+    def _load_segment(self, segment: int) -> None:
+        with open(self._segment_path(segment), "rb") as f:
+            offset = 0
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Incomplete last record of a run that did not finish
+                    break
+                time = datetime.datetime.fromisoformat(record["time"])
+                self._index(time, segment, offset, record["nodes"])
+                self.recent_events.append((time, record["text"]))
+                offset += len(line)
+
+    def _index(self, time: datetime.datetime, segment: int, offset: int, nodes: list[str]) -> None:
+        number = len(self.times)
+        # Keep the times in order for searching, even if the clock steps back
+        timestamp = time.timestamp()
+        if number > 0:
+            timestamp = max(timestamp, self.times[-1])
+        self.times.append(timestamp)
+        self.segments.append(segment)
+        self.offsets.append(offset)
+        for node in nodes:
+            self.nodes.setdefault(node, array.array("l")).append(number)
+
+    def add(self, time: datetime.datetime, text: str, nodes: list[str] | tuple[str, ...] = ()) -> None:
+        """
+        Append an event that names the given nodes.
+        """
+        line = (json.dumps({"time": time.isoformat(), "text": text, "nodes": list(nodes)}) + "\n").encode()
+        with self.lock:
+            if self.segment_count >= self.segment_events:
+                self.file.close()
+                self.segment += 1
+                self.segment_count = 0
+                self.file = open(self._segment_path(self.segment), "ab", buffering=0)
+            offset = self.file.tell()
+            self.file.write(line)
+            self.segment_count += 1
+            self._index(time, self.segment, offset, nodes)
+            self.recent_events.append((time, text))
+
+    def recent(self, count: int) -> list[tuple[datetime.datetime, str]]:
+        """
+        Return the last count events as (time, text).
+        """
+        with self.lock:
+            count = min(count, len(self.recent_events))
+            return [self.recent_events[i] for i in range(len(self.recent_events) - count, len(self.recent_events))]
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def query(self, since: datetime.datetime | None = None, until: datetime.datetime | None = None,
+              node: str | None = None, limit: int | None = None) -> list[dict]:
+        """
+        Return events from since up to and including until, optionally only
+        those naming node, oldest first. Records are dicts with time, text and nodes.
+        """
+        with self.lock:
+            first = 0 if since is None else bisect.bisect_left(self.times, since.timestamp())
+            last = len(self.times) if until is None else bisect.bisect_right(self.times, until.timestamp())
+            if node is None:
+                numbers = range(first, last)
+            else:
+                node_numbers = self.nodes.get(node, array.array("l"))
+                numbers = node_numbers[bisect.bisect_left(node_numbers, first):
+                                       bisect.bisect_left(node_numbers, last)]
+            if limit is not None:
+                numbers = numbers[:limit]
+            locations = [(self.segments[n], self.offsets[n]) for n in numbers]
+
+        # Read the records without holding up new events
+        records = []
+        segment, f = None, None
+        for location in locations:
+            if location[0] != segment:
+                if f is not None:
+                    f.close()
+                segment = location[0]
+                f = open(self._segment_path(segment), "rb")
+            f.seek(location[1])
+            records.append(json.loads(f.readline()))
+        if f is not None:
+            f.close()
+        return records
+
+    def close(self) -> None:
+        with self.lock:
+            self.file.close()
@@ -0,0 +1,129 @@
+"""
+Push driver updates to subscribers as Server-Sent Events.
+
+The writer thread publishes each update to every subscriber. A subscriber
+keeps at most BUFFER_SIZE updates. When a slow client falls behind, the
+oldest updates are dropped and counted, so publishing never waits on a
+client. The stream tells the client how many updates it missed.
+
+Updates are sent as:
+
+    event: <kind>
+    data: <json>
+"""
+
+import asyncio
+import collections
+import json
+import threading
+import typing
+
+# Updates kept for a subscriber that has not caught up
+BUFFER_SIZE = 256
+# Seconds between keep alive comments on an idle stream
+KEEPALIVE = 15.0
+
+# Kinds of update
+LINK = "link"
+UPLINKS = "uplinks"
+STATS = "stats"
+DROPPED = "dropped"
+
+
+class Subscriber:
+    """
+    Bounded buffer of updates for one client, read from an asyncio loop.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, size: int = BUFFER_SIZE) -> None:
+        self.loop = loop
+        self.lock = threading.Lock()
+        self.updates: collections.deque[tuple[str, typing.Any]] = collections.deque(maxlen=size)
+        self.dropped = 0
+        self.ready = asyncio.Event()
+
+    def put(self, kind: str, data: typing.Any) -> None:
+        """
+        Add an update, dropping the oldest if full. Can be called from any thread.
+        """
+        with self.lock:
+            if len(self.updates) == self.updates.maxlen:
+                self.dropped += 1
+            self.updates.append((kind, data))
+        try:
+            self.loop.call_soon_threadsafe(self.ready.set)
+        except RuntimeError:
+            # Loop is closed, the client is gone
+            pass
+
+    def take(self) -> tuple[list[tuple[str, typing.Any]], int]:
+        """
+        Remove and return the buffered updates and the number dropped since the last take.
+        """
+        self.ready.clear()
+        with self.lock:
+            updates = list(self.updates)
+            self.updates.clear()
+            dropped, self.dropped = self.dropped, 0
+        return updates, dropped
+
+    async def wait(self, timeout: float) -> bool:
+        """
+        Wait for updates. Returns False if none arrived before the timeout.
+        """
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+class Broadcaster:
+    """
+    Publishes updates to the current subscribers.
+    """
+
+    def __init__(self, size: int = BUFFER_SIZE) -> None:
+        self.size = size
+        self.lock = threading.Lock()
+        self.subscribers: list[Subscriber] = []
+
+    def subscribe(self) -> Subscriber:
+        """
+        Add a subscriber. Call from the asyncio loop that will read it.
+        """
+        subscriber = Subscriber(asyncio.get_running_loop(), self.size)
+        with self.lock:
+            self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def publish(self, kind: str, data: typing.Any) -> None:
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.put(kind, data)
+
+    async def stream(self, subscriber: Subscriber, keepalive: float = KEEPALIVE):
+        """
+        Yield the updates of a subscriber as Server-Sent Events until the client goes away.
+        """
+        try:
+            while True:
+                updates, dropped = subscriber.take()
+                if dropped > 0:
+                    yield format_event(DROPPED, {"count": dropped})
+                for kind, data in updates:
+                    yield format_event(kind, data)
+                if not await subscriber.wait(keepalive):
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+
+def format_event(kind: str, data: typing.Any) -> str:
+    return f"event: {kind}\ndata: {json.dumps(data)}\n\n"
@@ -349,7 +349,7 @@ class StubMininet:
     def getNodeByName(self, name):
         return None
     
-    def addLink(self, node1: str, node2: str, params1: dict, params2: dict):
+    def addLink(self, node1: str, node2: str, params1: dict, params2: dict, cls=None):
         pass
     
     def delLinkBetween(self, node1, node2):
@@ -463,6 +463,14 @@ class FrrSimRuntime:
             self.net = StubMininet()
             self.stub_net = True
 
+        # Interface states of each link, kept up to date as links and uplinks change.
+        # Keyed by graph edge, and by (station, satellite) for uplinks.
+        self.link_states: dict[tuple[str, str], tuple[bool, bool]] = {}
+        # Number of graph edges with both interfaces up
+        self.links_up = 0
+        for node1, node2 in self.graph.edges:
+            self._store_link_state(node1, node2, self._read_link_state(node1, node2, True))
+
     def start_routers(self) -> None: 
         # Populate master db file
         data = []
@@ -513,6 +521,13 @@ class FrrSimRuntime:
         os.unlink(self.db_file)
 
     def update_monitor_stats(self):
+        self.add_stat_sample(self.collect_monitor_stats())
+
+    def collect_monitor_stats(self) -> tuple:
+        """
+        Read the monitor databases and return a stats sample. Does not change the runtime
+        other than the last pings of each node, so it can run beside the writer.
+        """
         stable_good_count: int = 0
         stable_total_count: int = 0
         dynamic_good_count: int = 0
@@ -533,9 +548,12 @@ class FrrSimRuntime:
                     dynamic_good_count += good
                     dynamic_total_count += total
 
-        self.stat_samples.append((datetime.datetime.now(), 
-                                    stable_good_count, stable_total_count,
-                                    dynamic_good_count, dynamic_total_count))
+        return (datetime.datetime.now(),
+                stable_good_count, stable_total_count,
+                dynamic_good_count, dynamic_total_count)
+
+    def add_stat_sample(self, sample: tuple):
+        self.stat_samples.append(sample)
         if len(self.stat_samples) > 200:
             self.stat_samples.pop(0)
 
@@ -630,8 +648,16 @@ class FrrSimRuntime:
         if self.graph.adj[node1].get(node2) is None:
             return f"{node1} to {node2} does not exist"
         self._config_link_state(node1, node2, state_up)
+        self._store_link_state(node1, node2, self._read_link_state(node1, node2, state_up))
         return None
 
+    def set_link_states(
+        self, links: list[tuple[str, str, bool]]) -> list[str | None]:
+        """
+        Set the state of several links. Returns an error or None for each.
+        """
+        return [self.set_link_state(node1, node2, state_up) for node1, node2, state_up in links]
+
     def _config_link_state(
         self, node1: str, node2: str, state_up: bool 
     ):
@@ -639,6 +665,28 @@ class FrrSimRuntime:
         self.net.configLinkStatus(node1, node2, state)
 
     def get_link_state(self, node1: str, node2: str) -> tuple[bool, bool]:
+        """
+        Interface states of a link or uplink, from the link state table.
+        """
+        state = self.link_states.get((node1, node2))
+        if state is not None:
+            return state
+        up2, up1 = self.link_states.get((node2, node1), (False, False))
+        return up1, up2
+
+    def get_link_counts(self) -> tuple[int, int]:
+        """
+        Return the number of links and the number with both interfaces up.
+        """
+        return self.graph.number_of_edges(), self.links_up
+
+    def _read_link_state(self, node1: str, node2: str, stub_up: bool) -> tuple[bool, bool]:
+        """
+        Read the interface states from the network. In stub mode there are no
+        interfaces, so use the state stub_up that was configured.
+        """
+        if self.stub_net:
+            return stub_up, stub_up
         n1 = self.net.getNodeByName(node1)
         n2 = self.net.getNodeByName(node2)
         links = self.net.linksBetween(n1, n2)
@@ -648,6 +696,24 @@ class FrrSimRuntime:
 
         return False, False
 
+    def _store_link_state(self, node1: str, node2: str, state: tuple[bool, bool] | None) -> None:
+        """
+        Record the state of a link, or remove it if state is None.
+        """
+        key = (node1, node2)
+        if key not in self.link_states and (node2, node1) in self.link_states:
+            key = (node2, node1)
+            if state is not None:
+                state = state[1], state[0]
+        if self.graph.has_edge(node1, node2):
+            old = self.link_states.get(key, (False, False))
+            new = state if state is not None else (False, False)
+            self.links_up += int(all(new)) - int(all(old))
+        if state is None:
+            self.link_states.pop(key, None)
+        else:
+            self.link_states[key] = state
+
     def set_station_uplinks(
         self, station_name: str, uplinks: list[simapi.UpLink]) -> bool:
         if not station_name in self.ground_stations:
@@ -695,6 +761,7 @@ class FrrSimRuntime:
                 station_name, sat_name, params1={"ip": format(ip1), "delay": "1ms"}, params2={"ip": format(ip2), "delay": "1ms"},
             cls=mininet.link.TCLink, 
         )
+        self._store_link_state(station_name, sat_name, self._read_link_state(station_name, sat_name, True))
 
         # Configure FRR daemons to handle the uplink
         station = self.ground_stations[station_name]
@@ -713,6 +780,7 @@ class FrrSimRuntime:
         frr_router = self.routers[sat_name]
         frr_router.config_frr("staticd", [ f"no ip route {station.defaultIP()}/32 {format(ip.ip)}" ])
         self.net.delLinkBetween(station_node, sat_node)
+        self._store_link_state(station_name, sat_name, None)
 
     def _update_default_route(self, station: GroundStation) -> None:
         closest_uplink = None
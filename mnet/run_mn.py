@@ -12,7 +12,7 @@ from mininet.log import setLogLevel, info
 from mininet.cli import CLI
 import mnet.driver
 
-import torus_topo
+import topo_cache
 import frr_config_topo
 import mnet.frr_topo
 
@@ -24,10 +24,10 @@ def signal_handler(sig, frame):
     print("Ctrl-C recieved, shutting down....")
     mnet.driver.invoke_shutdown()
 
-def run(num_rings, num_routers, use_cli, use_mnet, stable_monitors: bool, ground_stations: bool):
+def run(num_rings, num_routers, use_cli, use_mnet, stable_monitors: bool, ground_stations: bool,
+        event_dir: str = mnet.driver.EVENT_DIR):
     # Create a networkx graph annoted with FRR configs
-    graph = torus_topo.create_network(num_rings, num_routers, ground_stations)
-    frr_config_topo.annotate_graph(graph)
+    graph = topo_cache.create_network(num_rings, num_routers, ground_stations, annotate=True)
     frr_config_topo.dump_graph(graph)
 
     # Use the networkx graph to build a mininet topology
@@ -51,7 +51,7 @@ def run(num_rings, num_routers, use_cli, use_mnet, stable_monitors: bool, ground
     else:
         print("Launching web API. Use /shutdown to halt")
         signal.signal(signal.SIGINT, signal_handler)
-        mnet.driver.run(frrt)
+        mnet.driver.run(frrt, event_dir)
     frrt.stop_routers()
 
     if net is not None:
@@ -94,10 +94,11 @@ if __name__ == "__main__":
     num_routers = parser['network'].getint('routers', 4)
     ground_stations = parser['network'].getboolean('ground_stations', False)
     stable_monitors = parser['monitor'].getboolean('stable_monitors', False)
+    event_dir = parser['monitor'].get('event_dir', mnet.driver.EVENT_DIR)
 
     if num_rings < 1 or num_rings > 30 or num_routers < 1 or num_routers > 30:
         print("Rings or nodes count out of range")
         sys.exit(-1)
 
     setLogLevel("info")
-    run(num_rings, num_routers, use_cli, use_mnet, stable_monitors, ground_stations)
+    run(num_rings, num_routers, use_cli, use_mnet, stable_monitors, ground_stations, event_dir)
@@ -1,8 +1,17 @@
+import asyncio
+import datetime
+import tempfile
+import threading
 import unittest
+import fastapi
 import mnet.pmonitor
 import frr_config_topo
 import torus_topo
 import mnet.frr_topo
+import mnet.driver
+import mnet.event_log
+import mnet.event_stream
+import simapi
 
 class TestCase(unittest.TestCase):
     def testPMonitor(self):
@@ -27,10 +36,130 @@ class TestCase(unittest.TestCase):
         links = frrt.get_link_list()
         frrt.get_link(links[0][0], links[0][1])
         frrt.get_node_status_list(routers[0][0])
+        self.assertEqual(frrt.get_link_counts(), (len(links), len(links)))
         frrt.set_link_state(links[0][0], links[0][1], False)
         state1, state2 = frrt.get_link_state(links[0][0], links[0][1])
         self.assertFalse(state1 or state2)
+        self.assertEqual(frrt.get_link_counts(), (len(links), len(links) - 1))
+        errors = frrt.set_link_states([(links[0][1], links[0][0], True), ("X", links[0][1], True)])
+        self.assertIsNone(errors[0])
+        self.assertIsNotNone(errors[1])
+        self.assertEqual(frrt.get_link_state(links[0][0], links[0][1]), (True, True))
+        self.assertEqual(frrt.get_link_counts(), (len(links), len(links)))
+        # Uplinks are in the link state table, but not counted as links
+        station = frrt.get_ground_stations()[0]
+        frrt.set_station_uplinks(station.name, [simapi.UpLink(sat_node=routers[0][0], distance=900)])
+        self.assertEqual(frrt.get_link_state(routers[0][0], station.name), (True, True))
+        self.assertEqual(frrt.get_link_counts(), (len(links), len(links)))
+        frrt.set_station_uplinks(station.name, [])
+        self.assertEqual(frrt.get_link_state(station.name, routers[0][0]), (False, False))
         # TODO: add more calls here
         # set station uplinks
         frrt.stop_routers()
 
+
+    def testDriverLinks(self):
+        graph = torus_topo.create_network(4, 4)
+        frr_config_topo.annotate_graph(graph)
+        topo = mnet.frr_topo.NetxTopo(graph)
+        frrt = mnet.frr_topo.FrrSimRuntime(topo, None)
+        event_dir = tempfile.TemporaryDirectory()
+        context = mnet.driver.NetxContext(frrt, None, event_dir.name)
+        mnet.driver.global_context = context
+        context.start_writer()
+        links = frrt.get_link_list()
+        request = simapi.Links(links=[
+            simapi.Link(node1_name=links[0][0], node2_name=links[0][1], up=False),
+            simapi.Link(node1_name="X", node2_name=links[0][1], up=False),
+            simapi.Link(node1_name=links[1][0], node2_name=links[1][1], up=False)])
+
+        async def send():
+            subscriber = context.broadcaster.subscribe()
+            result = await mnet.driver.set_links(request)
+            updates, dropped = subscriber.take()
+            context.broadcaster.unsubscribe(subscriber)
+            return result, updates
+
+        result, updates = asyncio.run(send())
+        context.stop_writer()
+        # Links that were set are pushed to subscribers
+        self.assertEqual([update[0] for update in updates], ["link", "link"])
+        self.assertEqual(updates[0][1]["node1"], links[0][0])
+        # With the same text as the logged event
+        self.assertEqual(updates[0][1]["text"], context.snapshot.events[0][1])
+        self.assertEqual(len(result.results), 3)
+        self.assertIsNone(result.results[0].error)
+        self.assertIsNotNone(result.results[1].error)
+        self.assertGreaterEqual(result.elapsed, 0)
+        # One event for each link that was set
+        self.assertEqual(len(context.snapshot.events), 2)
+        self.assertEqual(context.snapshot.links_up, len(links) - 2)
+        self.assertEqual(mnet.driver.stats_total()["good_count"], 0)
+        # Router views and ping stats are copies in the snapshot
+        router = context.snapshot.routers[links[0][0]]
+        self.assertEqual(router["neighbors"][links[0][1]]["up"], (False, False))
+        node = frrt.nodes[links[0][0]]
+        self.assertIsNot(context.snapshot.ping_stats[node.name], node.last_five_pings)
+        # Unknown nodes are not found
+        for view in (mnet.driver.view_router, mnet.driver.view_station):
+            with self.assertRaises(fastapi.HTTPException) as raised:
+                view(None, "X")
+            self.assertEqual(raised.exception.status_code, 404)
+        # Events are logged by node
+        records = mnet.driver.events(node=links[1][1])["events"]
+        self.assertEqual([record["nodes"] for record in records], [[links[1][0], links[1][1]]])
+        context.event_log.close()
+
+        # A restart reopens the log with the earlier events
+        context = mnet.driver.NetxContext(frrt, None, event_dir.name)
+        mnet.driver.global_context = context
+        self.assertEqual(len(context.snapshot.events), 2)
+        self.assertEqual(mnet.driver.events(node=links[1][1])["events"], records)
+        context.event_log.close()
+        event_dir.cleanup()
+
+    def testEventStream(self):
+        async def run():
+            broadcaster = mnet.event_stream.Broadcaster(size=3)
+            subscriber = broadcaster.subscribe()
+            # Publish from another thread, more than the subscriber keeps
+            thread = threading.Thread(target=lambda: [broadcaster.publish("link", {"n": n}) for n in range(5)])
+            thread.start()
+            thread.join()
+            stream = broadcaster.stream(subscriber, keepalive=0.01)
+            messages = [await anext(stream) for i in range(5)]
+            await stream.aclose()
+            return messages, broadcaster.subscribers
+
+        messages, subscribers = asyncio.run(run())
+        self.assertEqual(messages[0], 'event: dropped\ndata: {"count": 2}\n\n')
+        self.assertEqual(messages[1:4], [f'event: link\ndata: {{"n": {n}}}\n\n' for n in range(2, 5)])
+        self.assertEqual(messages[4], ": keepalive\n\n")
+        # Closing the stream unsubscribes
+        self.assertEqual(subscribers, [])
+
+    def testEventLog(self):
+        with tempfile.TemporaryDirectory() as event_dir:
+            # Other log files in the directory are not segments
+            open(f"{event_dir}/frr.log", "w").close()
+            start = datetime.datetime(2024, 6, 1)
+            log = mnet.event_log.EventLog(event_dir, recent=4, segment_events=3)
+            for i in range(8):
+                log.add(start + datetime.timedelta(seconds=i), f"event {i}", (f"R{i % 2}_0", "G_0"))
+            self.assertEqual([entry[1] for entry in log.recent(10)], [f"event {i}" for i in range(4, 8)])
+            # Spread over segments of 3 events
+            records = log.query(start + datetime.timedelta(seconds=2), start + datetime.timedelta(seconds=5))
+            self.assertEqual([record["text"] for record in records], [f"event {i}" for i in range(2, 6)])
+            records = log.query(since=start + datetime.timedelta(seconds=2), node="R1_0", limit=2)
+            self.assertEqual([record["text"] for record in records], ["event 3", "event 5"])
+            self.assertEqual(log.query(node="R5_0"), [])
+            log.close()
+
+            # Reopen and continue the log
+            log = mnet.event_log.EventLog(event_dir, recent=4, segment_events=3)
+            log.add(start + datetime.timedelta(seconds=8), "event 8", ("R0_0",))
+            self.assertEqual(len(log), 9)
+            records = log.query(node="R0_0")
+            self.assertEqual([record["text"] for record in records], [f"event {i}" for i in range(0, 9, 2)])
+            self.assertEqual(records[-1]["time"], (start + datetime.timedelta(seconds=8)).isoformat())
+            log.close()
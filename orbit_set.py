@@ -18,6 +18,9 @@ import time
 import threading
 
 import torus_topo
+import topo_cache
+import sat_records
+import sat_pool
 
 from direct.actor.Actor import Actor
 from panda3d.core import TextNode
@@ -52,6 +55,8 @@ class PositionUpdate:
 done = False
 DEFAULT_TIME_RATE = 10  # Default to 10x speed
 time_rate = DEFAULT_TIME_RATE
+# Processes used to propagate positions, 0 to compute each satellite in the update thread
+workers = 0
 
 # Global variables accessed by both threads, not protected by a mutex
 # As currently structured, this should not cause a problem (right??)
@@ -92,7 +97,7 @@ def resume_vtime():
     vtime_paused = False
 
 
-def generate_positions(update_q: queue.Queue, sat_entries):
+def generate_positions(update_q: queue.Queue, sat_entries, propagator: sat_pool.PoolPropagator | None = None):
     """
     Loop generating future position for the earch and satellites and place
     in the queue for consumption by the UI.
@@ -100,6 +105,8 @@ def generate_positions(update_q: queue.Queue, sat_entries):
     Notes:
         - sleep during the update to give the UI a chance to run.
         - pause when the queue gets full
+        - with a propagator, positions of all satellites are computed at once
+          for each pass
 
     """
     ts = load.timescale()
@@ -136,6 +143,11 @@ def generate_positions(update_q: queue.Queue, sat_entries):
         update = PositionUpdate("earth", (), rotate, False, time_future)
         update_q.put(update)
 
+        positions = None
+        if propagator is not None:
+            # Positions of all satellites for this pass in one call to the pool
+            positions, errors = propagator.propagate_gcrs([time_now, time_future])
+
         # Generate position for each satellite
         count = 0
         for sat in sat_entries:
@@ -157,7 +169,7 @@ def generate_positions(update_q: queue.Queue, sat_entries):
                 time.sleep(0)
                 recalc_time = True
 
-            if recalc_time:
+            if recalc_time and positions is None:
                 # Recalculate time values after potentially sleeping
                 recalc_time = False
                 time_now = vtime_now()
@@ -168,18 +180,24 @@ def generate_positions(update_q: queue.Queue, sat_entries):
             # print(f"Gen Pos Name: {sat.name}")
             if first:
                 # Create initial position
-                geo = sat.at(sf_time_now)
-                if not math.isnan(geo.position.km[0]):
+                if positions is not None:
+                    position_now = positions[0, count]
+                else:
+                    position_now = sat.at(sf_time_now).position.km
+                if not math.isnan(position_now[0]):
                     update = PositionUpdate(
-                        sat.name, geo.position.km, 0, True, time_now
+                        sat.name, position_now, 0, True, time_now
                     )
                     update_q.put(update)
 
             # Create future position
-            geo = sat.at(sf_time_future)
-            if not math.isnan(geo.position.km[0]):
+            if positions is not None:
+                position_future = positions[1, count]
+            else:
+                position_future = sat.at(sf_time_future).position.km
+            if not math.isnan(position_future[0]):
                 update = PositionUpdate(
-                    sat.name, geo.position.km, 0, False, time_future
+                    sat.name, position_future, 0, False, time_future
                 )
                 update_q.put(update)
             count += 1
@@ -266,16 +284,8 @@ class World(DirectObject):
             self.satellites[name].setScale(self.get_sat_size_scale())
 
     def build_sat_entries(self) -> list[EarthSatellite]:
-        graph = torus_topo.create_network()
-        result = []
-
-        for name in torus_topo.satellites(graph):
-            orbit = graph.nodes[name]["orbit"]
-            ts = load.timescale()
-            l1, l2 = orbit.tle_format()
-            satellite = EarthSatellite(l1, l2, name, ts)
-            result.append(satellite)
-        return result
+        graph = topo_cache.create_network()
+        return sat_records.build_earth_satellites(graph, load.timescale())
 
     URLS = {
         "kuiper": "https://celestrak.org/NORAD/elements/gp.php?INTDES=2023-154",
@@ -324,9 +334,13 @@ class World(DirectObject):
         self.accept("mouse1", self.clickTarget)
         self.heading = 0
         self.pitch = 0
+        propagator = None
+        if workers > 0:
+            print(f"propagating with {workers} processes")
+            propagator = sat_pool.PoolPropagator([sat.model for sat in self.sat_entries], load.timescale(), workers)
         self.t = threading.Thread(
             target=generate_positions,
-            args=[self.update_q, self.sat_entries],
+            args=[self.update_q, self.sat_entries, propagator],
             daemon=True,
         )
         self.t.start()
@@ -479,8 +493,10 @@ if len(sys.argv) > 1:
     selection = sys.argv[1]
 if len(sys.argv) > 2:
     time_rate = int(sys.argv[2])
+if len(sys.argv) > 3:
+    workers = int(sys.argv[3])
 
-print("orbit set: [ <satellite set>  [ <time_factor> ]]")
+print("orbit set: [ <satellite set>  [ <time_factor> [ <workers> ]]]")
 print()
 print(f"\tRunning '{selection}' set at {time_rate}X speed")
 print("\tUse arrow keys to move the view")
@@ -0,0 +1,263 @@
+"""
+Predict satellite passes over ground stations.
+
+For every (ground station, satellite) pair, find the times over a horizon
+where the satellite rises above or sets below min_altitude degrees of
+elevation. Elevations for all pairs are sampled on a coarse time grid from
+vectorized propagation. Each sign change between samples is then refined
+by bisection, for all brackets at once, to the time of the crossing.
+
+Passes shorter than the coarse step may be missed, so the step should be
+well below the shortest pass of interest (a 550 km orbit is above 35
+degrees for about two minutes).
+
+The result is a PassSchedule: the visible satellites of each station at
+the start and a time sorted list of rise and set events.
+"""
+
+from dataclasses import dataclass, field
+import datetime
+
+import numpy
+
+import sat_positions
+import sat_records
+import torus_topo
+import visibility
+
+# Default time between coarse samples, seconds
+COARSE_STEP = 30.0
+# Refined event times are within this many seconds of the crossing
+TOLERANCE = 0.05
+# Number of coarse samples evaluated together
+SAMPLE_BATCH = 64
+
+
+@dataclass
+class PassEvent:
+    """A satellite rising above or setting below min altitude for a station"""
+
+    time: datetime.datetime
+    station: int  # Ground station id
+    satellite: int  # Satellite id
+    rise: bool
+
+
+@dataclass
+class PassSchedule:
+    """Rise and set events over a time interval"""
+
+    start: datetime.datetime
+    end: datetime.datetime
+    initial: list[set[int]]  # Visible satellite ids for each station at start
+    events: list[PassEvent] = field(default_factory=list)  # Sorted by time
+
+    def visible_at(self, time: datetime.datetime) -> list[set[int]]:
+        """
+        Return the visible satellites of each station at a time in the interval.
+        """
+        visible = [set(ids) for ids in self.initial]
+        for event in self.events:
+            if event.time > time:
+                break
+            if event.rise:
+                visible[event.station].add(event.satellite)
+            else:
+                visible[event.station].discard(event.satellite)
+        return visible
+
+    def event_groups(self) -> list[tuple[datetime.datetime, list[PassEvent]]]:
+        """
+        Return the events grouped by time.
+        """
+        groups: list[tuple[datetime.datetime, list[PassEvent]]] = []
+        for event in self.events:
+            if len(groups) > 0 and groups[-1][0] == event.time:
+                groups[-1][1].append(event)
+            else:
+                groups.append((event.time, [event]))
+        return groups
+
+
+def _elevations(propagator: sat_positions.Propagator, frames: visibility.StationFrames,
+                times: list[datetime.datetime]) -> numpy.ndarray:
+    """
+    Elevation of all pairs at each time, shape (times, stations, satellites).
+    """
+    result = numpy.empty((len(times), len(frames.ecef), propagator.count))
+    for i, positions in enumerate(propagator.propagate(times)):
+        result[i] = visibility.look_angles(frames, positions.ecef)[0]
+    return result
+
+
+def _pair_elevations(propagator: sat_positions.Propagator, frames: visibility.StationFrames,
+                     stations: numpy.ndarray, satellites: numpy.ndarray,
+                     times: list[datetime.datetime]) -> numpy.ndarray:
+    """
+    Elevation of satellites[i] from stations[i] at times[i].
+    """
+    ecef = propagator.ecef_at(satellites, times)
+    up = numpy.einsum("ij,ij->i", frames.up[stations], ecef - frames.ecef[stations])
+    distance = numpy.linalg.norm(ecef - frames.ecef[stations], axis=1)
+    return numpy.degrees(numpy.arcsin(numpy.clip(up / distance, -1.0, 1.0)))
+
+
+def _bisect(low: numpy.ndarray, high: numpy.ndarray, low_state: numpy.ndarray,
+            state_at, tolerance: float) -> numpy.ndarray:
+    """
+    Narrow all brackets [low, high] of a state change together and return
+    the first time of the new state. state_at(offsets) returns the state
+    of each bracket at the given offsets.
+    """
+    while len(low) > 0 and (high - low).max() > tolerance:
+        mid = (low + high) / 2
+        before = state_at(mid) == low_state
+        low = numpy.where(before, mid, low)
+        high = numpy.where(before, high, mid)
+    return high
+
+
+def predict_passes(propagator: sat_positions.Propagator, frames: visibility.StationFrames,
+                   start: datetime.datetime, horizon: float, min_altitude: float,
+                   step: float = COARSE_STEP, tolerance: float = TOLERANCE) -> PassSchedule:
+    """
+    Predict the rise and set events of all station / satellite pairs from
+    start over horizon seconds.
+    """
+    count = int(numpy.ceil(horizon / step)) + 1
+    offsets = numpy.minimum(numpy.arange(count) * step, horizon)
+    end = start + datetime.timedelta(seconds=horizon)
+
+    # Coarse samples, in batches that overlap by one sample
+    brackets = []
+    initial = None
+    previous = None
+    for first in range(0, count, SAMPLE_BATCH):
+        batch = offsets[first:first + SAMPLE_BATCH]
+        above = _elevations(propagator, frames, [start + datetime.timedelta(seconds=x) for x in batch]) > min_altitude
+        if initial is None:
+            initial = [set(numpy.flatnonzero(row).tolist()) for row in above[0]]
+        if previous is not None:
+            above = numpy.concatenate([previous[None], above])
+            batch = numpy.concatenate([[offsets[first - 1]], batch])
+        sample, station, satellite = numpy.nonzero(above[1:] != above[:-1])
+        brackets.append((batch[sample], batch[sample + 1], station, satellite, above[sample, station, satellite]))
+        previous = above[-1]
+
+    low = numpy.concatenate([b[0] for b in brackets])
+    high = numpy.concatenate([b[1] for b in brackets])
+    station = numpy.concatenate([b[2] for b in brackets])
+    satellite = numpy.concatenate([b[3] for b in brackets])
+    low_above = numpy.concatenate([b[4] for b in brackets])
+
+    def above_at(offsets: numpy.ndarray) -> numpy.ndarray:
+        times = [start + datetime.timedelta(seconds=x) for x in offsets]
+        return _pair_elevations(propagator, frames, station, satellite, times) > min_altitude
+
+    high = _bisect(low, high, low_above, above_at, tolerance)
+    events = [PassEvent(start + datetime.timedelta(seconds=float(t)), int(g), int(s), not bool(a))
+              for t, g, s, a in zip(high, station, satellite, low_above)]
+    events.sort(key=lambda event: (event.time, event.station, event.satellite))
+    return PassSchedule(start, end, initial if initial is not None else [], events)
+
+
+@dataclass
+class BandEvent:
+    """A satellite entering or leaving the latitude band where inter plane links are up"""
+
+    time: datetime.datetime
+    satellite: int  # Satellite id
+    inside: bool
+
+
+def predict_band_crossings(propagator: sat_positions.Propagator, limit: numpy.ndarray,
+                           start: datetime.datetime, horizon: float, step: float = COARSE_STEP,
+                           tolerance: float = TOLERANCE) -> tuple[numpy.ndarray, list[BandEvent]]:
+    """
+    Predict when each satellite crosses the latitude limit[sat] (degrees,
+    north or south) from start over horizon seconds. Returns the inside
+    state of each satellite at start and the time sorted events.
+    """
+    count = int(numpy.ceil(horizon / step)) + 1
+    offsets = numpy.minimum(numpy.arange(count) * step, horizon)
+    inside = numpy.empty((count, propagator.count), dtype=bool)
+    for first in range(0, count, SAMPLE_BATCH):
+        batch = offsets[first:first + SAMPLE_BATCH]
+        results = propagator.propagate([start + datetime.timedelta(seconds=x) for x in batch])
+        for i, positions in enumerate(results):
+            inside[first + i] = numpy.abs(positions.lat) <= limit
+
+    sample, satellite = numpy.nonzero(inside[1:] != inside[:-1])
+    low_inside = inside[sample, satellite]
+
+    def inside_at(times_offsets: numpy.ndarray) -> numpy.ndarray:
+        times = [start + datetime.timedelta(seconds=x) for x in times_offsets]
+        lat = sat_positions.geodetic(propagator.ecef_at(satellite, times))[0]
+        return numpy.abs(lat) <= limit[satellite]
+
+    high = _bisect(offsets[sample], offsets[sample + 1], low_inside, inside_at, tolerance)
+    events = [BandEvent(start + datetime.timedelta(seconds=float(t)), int(s), not bool(a))
+              for t, s, a in zip(high, satellite, low_inside)]
+    events.sort(key=lambda event: (event.time, event.satellite))
+    return inside[0], events
+
+
+def run_passes_test() -> bool:
+    """
+    Check predicted events against elevations sampled every few seconds.
+    """
+    graph = torus_topo.create_network(10, 10)
+    names, satrecs = sat_records.build_satrecs(graph)
+    propagator = sat_positions.Propagator(satrecs)
+    stations = [graph.nodes[name] for name in torus_topo.ground_stations(graph)]
+    frames = visibility.station_frames(numpy.array([node[torus_topo.LAT] for node in stations]),
+                                       numpy.array([node[torus_topo.LON] for node in stations]))
+    start = datetime.datetime(2024, 6, 1, tzinfo=datetime.timezone.utc)
+    horizon = 3 * 3600.0
+    min_altitude = 20
+    schedule = predict_passes(propagator, frames, start, horizon, min_altitude)
+    if len(schedule.events) == 0:
+        return False
+    if any(a.time > b.time for a, b in zip(schedule.events, schedule.events[1:])):
+        return False
+
+    # Each event is a crossing: just before it the state differs from just after
+    for event in schedule.events[:40]:
+        before = event.time - datetime.timedelta(seconds=2 * TOLERANCE)
+        after = event.time + datetime.timedelta(seconds=TOLERANCE)
+        elevation = _pair_elevations(propagator, frames, numpy.array([event.station] * 2),
+                                     numpy.array([event.satellite] * 2), [before, after])
+        if (elevation[0] > min_altitude) == event.rise or (elevation[1] > min_altitude) != event.rise:
+            return False
+
+    # The visible sets follow the sampled elevations
+    for seconds in (0, 500, 2000, 7777):
+        time = start + datetime.timedelta(seconds=seconds)
+        expected = _elevations(propagator, frames, [time])[0] > min_altitude
+        visible = schedule.visible_at(time)
+        for g in range(len(stations)):
+            if visible[g] != set(numpy.flatnonzero(expected[g]).tolist()):
+                return False
+
+    # Latitude band crossings follow the sampled latitudes
+    limit = numpy.full(len(names), torus_topo.INCLINATION - 2)
+    initial, band_events = predict_band_crossings(propagator, limit, start, horizon)
+    if len(band_events) == 0:
+        return False
+    for event in band_events[:20]:
+        before = event.time - datetime.timedelta(seconds=2 * TOLERANCE)
+        after = event.time + datetime.timedelta(seconds=TOLERANCE)
+        ecef = propagator.ecef_at(numpy.array([event.satellite] * 2), [before, after])
+        lat = numpy.abs(sat_positions.geodetic(ecef)[0])
+        if (lat[0] <= limit[0]) == event.inside or (lat[1] <= limit[0]) != event.inside:
+            return False
+    time = start + datetime.timedelta(seconds=4321)
+    inside = initial.copy()
+    for event in band_events:
+        if event.time <= time:
+            inside[event.satellite] = event.inside
+    return bool((inside == (numpy.abs(propagator.positions_at(time).lat) <= limit)).all())
+
+
+if __name__ == "__main__":
+    print(run_passes_test())
@@ -0,0 +1,163 @@
+"""
+Trace paths for many source / destination pairs at once.
+
+Follows a next hop matrix (from route_matrix, dynamic_routes or a route_store
+file) for all pairs, or a chosen subset, in parallel with numpy. Each pair
+either reaches its destination, hits a blackhole (no route at some hop), or
+loops. The report includes a reachability matrix, a histogram of path
+lengths and the stretch of each path compared to the ideal torus distance.
+
+This is the validation step to run after a simulated failure scenario.
+"""
+
+from dataclasses import dataclass
+
+import numpy
+
+import compact_topo
+import dynamic_routes
+import route_matrix
+import torus_routes
+import torus_topo
+
+# Number of source rows traced at once
+BATCH_SIZE = 512
+
+
+@dataclass
+class TraceReport:
+    """Results of tracing a set of source / destination pairs"""
+
+    sources: numpy.ndarray  # Source node ids
+    dests: numpy.ndarray  # Destination node ids
+    reachable: numpy.ndarray  # bool, sources x dests
+    path_len: numpy.ndarray  # hops taken to reach the destination, -1 if not reached
+    loops: numpy.ndarray  # bool, the path revisits a node
+    blackholes: numpy.ndarray  # bool, the path hits a node with no route
+    histogram: numpy.ndarray  # number of reachable pairs for each path length
+    stretch: numpy.ndarray  # path_len / ideal distance, nan where undefined
+
+    def summary(self) -> dict[str, float]:
+        pairs = self.reachable.size
+        stretch = self.stretch[~numpy.isnan(self.stretch)]
+        return {
+            "pairs": pairs,
+            "reachable": int(self.reachable.sum()),
+            "loops": int(self.loops.sum()),
+            "blackholes": int(self.blackholes.sum()),
+            "mean_stretch": float(stretch.mean()) if len(stretch) > 0 else float("nan"),
+            "max_stretch": float(stretch.max()) if len(stretch) > 0 else float("nan"),
+        }
+
+
+def _trace_batch(next_hop: numpy.ndarray, sources: numpy.ndarray, dests: numpy.ndarray,
+                 no_hop: int) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """
+    Trace all pairs of a batch of sources. Returns path_len, loop and blackhole arrays.
+    """
+    num_nodes = next_hop.shape[0]
+    shape = (len(sources), len(dests))
+    path_len = numpy.full(shape, -1, dtype=numpy.int32)
+    loops = numpy.zeros(shape, dtype=bool)
+    blackholes = numpy.zeros(shape, dtype=bool)
+
+    # Flat index of each pair still being followed
+    pair = numpy.arange(len(sources) * len(dests))
+    current = numpy.repeat(sources, len(dests)).astype(numpy.int64)
+    dest = numpy.tile(dests, len(sources)).astype(numpy.int64)
+
+    steps = 0
+    while len(pair) > 0:
+        done = current == dest
+        path_len.flat[pair[done]] = steps
+        pair, current, dest = pair[~done], current[~done], dest[~done]
+        if steps >= num_nodes:
+            # A simple path never has more hops than there are nodes
+            loops.flat[pair] = True
+            break
+        hop = next_hop[current, dest].astype(numpy.int64)
+        dead = hop == no_hop
+        blackholes.flat[pair[dead]] = True
+        pair, current, dest = pair[~dead], hop[~dead], dest[~dead]
+        steps += 1
+    return path_len, loops, blackholes
+
+
+def trace_all(next_hop: numpy.ndarray, topo: compact_topo.CompactTopo | None = None,
+              sources: numpy.ndarray | None = None, dests: numpy.ndarray | None = None,
+              batch_size: int = BATCH_SIZE) -> TraceReport:
+    """
+    Trace the paths between each source and dest node id by following next hops.
+    Defaults to all pairs. If a torus topology is given, stretch is computed
+    against the ideal torus distance.
+    """
+    num_nodes = next_hop.shape[0]
+    sources = numpy.arange(num_nodes) if sources is None else numpy.asarray(sources)
+    dests = numpy.arange(num_nodes) if dests is None else numpy.asarray(dests)
+    no_hop = route_matrix.no_route(next_hop)
+
+    shape = (len(sources), len(dests))
+    path_len = numpy.empty(shape, dtype=numpy.int32)
+    loops = numpy.empty(shape, dtype=bool)
+    blackholes = numpy.empty(shape, dtype=bool)
+    for start in range(0, len(sources), batch_size):
+        rows = slice(start, start + batch_size)
+        path_len[rows], loops[rows], blackholes[rows] = _trace_batch(next_hop, sources[rows], dests, no_hop)
+
+    reachable = path_len >= 0
+    histogram = numpy.bincount(path_len[reachable], minlength=1)
+
+    stretch = numpy.full(shape, numpy.nan)
+    if topo is not None:
+        ideal = torus_routes.torus_distance(topo, sources[:, None], dests[None, :])
+        valid = reachable & (ideal > 0)
+        stretch[valid] = path_len[valid] / ideal[valid]
+    return TraceReport(sources, dests, reachable, path_len, loops, blackholes, histogram, stretch)
+
+
+def check_failure(topo: compact_topo.CompactTopo, routes: dynamic_routes.DynamicRoutes,
+                  changes: list[tuple[str, str, bool]]) -> TraceReport:
+    """
+    Apply a failure scenario (a list of link changes), update the routes
+    and trace all pairs between satellites.
+    """
+    routes.set_link_states(changes)
+    satellites = topo.satellite_ids()
+    return trace_all(routes.routes.next_hop, topo, satellites, satellites)
+
+
+def run_path_check_test() -> bool:
+    """
+    Trace all pairs of a network with down links, then with a damaged next hop table.
+    """
+    topo = compact_topo.create_compact_network(8, 8, ground_stations=False)
+    routes = dynamic_routes.DynamicRoutes(topo)
+    changes = [(torus_topo.get_node_name(ring, 0), torus_topo.get_node_name(ring + 1, 0), False)
+               for ring in range(7)]
+    report = check_failure(topo, routes, changes)
+    if not report.reachable.all() or report.loops.any() or report.blackholes.any():
+        return False
+    if not (report.path_len == routes.routes.hops).all():
+        return False
+    summary = report.summary()
+    if summary["mean_stretch"] < 1 or summary["max_stretch"] <= 1:
+        return False
+    if report.histogram.sum() != report.reachable.sum():
+        return False
+
+    # Make a loop between two nodes and a blackhole
+    next_hop = routes.routes.next_hop.copy()
+    node1, node2, dest = 0, 1, 20
+    next_hop[node1, dest] = node2
+    next_hop[node2, dest] = node1
+    next_hop[5, 30] = route_matrix.no_route(next_hop)
+    report = trace_all(next_hop, topo)
+    if not report.loops[node1, dest] or not report.loops[node2, dest]:
+        return False
+    if not report.blackholes[5, 30] or report.reachable[5, 30]:
+        return False
+    return int(report.loops.sum()) >= 2 and report.reachable.sum() < report.reachable.size
+
+
+if __name__ == "__main__":
+    print(run_path_check_test())
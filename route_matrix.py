@@ -0,0 +1,272 @@
+"""
+All pairs routing over a compact torus topology.
+
+Runs a breadth first search from many source nodes at once and produces
+an NxN next hop matrix and an NxN hop count matrix as small integer numpy
+arrays. Only edges marked up are used.
+
+RouteTables provides a read only view of the matrices in the same
+{ "source" : { "dest" : (path_len, "next hop") } } form used by
+torus_topo.generate_route_table, so it can be passed to torus_topo.trace_path.
+"""
+
+from collections.abc import Mapping, Iterator
+
+import numpy
+
+import torus_topo
+import compact_topo
+
+# Number of source rows searched at once
+BATCH_SIZE = 256
+
+
+def no_route(array: numpy.ndarray) -> int:
+    """
+    Value marking an unreachable entry in a next hop or hop count array
+    """
+    return int(numpy.iinfo(array.dtype).max)
+
+
+def next_hop_dtype(num_nodes: int) -> numpy.dtype:
+    if num_nodes < 0xFFFF:
+        return numpy.dtype(numpy.uint16)
+    return numpy.dtype(numpy.uint32)
+
+
+def bfs_routes(topo: compact_topo.CompactTopo, sources: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Breadth first search from each of the source node ids in one batch.
+
+    Returns int32 arrays next_hop and hops of shape (len(sources), N).
+    Unreachable entries are -1. The entry for the source itself has 0 hops
+    and the source as next hop.
+    """
+    num_nodes = topo.num_nodes()
+    sources = numpy.asarray(sources, dtype=numpy.int64)
+    rows = numpy.arange(len(sources), dtype=numpy.int64)
+    hops = numpy.full((len(sources), num_nodes), -1, dtype=numpy.int32)
+    next_hop = numpy.full((len(sources), num_nodes), -1, dtype=numpy.int32)
+    hops[rows, sources] = 0
+    next_hop[rows, sources] = sources
+
+    # Up flag for each entry of the adjacency arrays
+    adj_up = topo.edge_up[topo.adj_edges]
+
+    frontier_rows = rows
+    frontier_nodes = sources
+    level = 0
+    while len(frontier_rows) > 0:
+        level += 1
+        # Expand every (row, node) pair in the frontier to all neighbors
+        starts = topo.adj_offsets[frontier_nodes].astype(numpy.int64)
+        counts = topo.adj_offsets[frontier_nodes + 1] - starts
+        total = int(counts.sum())
+        if total == 0:
+            break
+        offsets = numpy.cumsum(counts) - counts
+        pos = numpy.repeat(starts - offsets, counts) + numpy.arange(total)
+        cand_rows = numpy.repeat(frontier_rows, counts)
+        via = numpy.repeat(frontier_nodes, counts)
+        nbrs = topo.adj_nodes[pos].astype(numpy.int64)
+
+        keep = adj_up[pos] & (hops[cand_rows, nbrs] < 0)
+        cand_rows = cand_rows[keep]
+        via = via[keep]
+        nbrs = nbrs[keep]
+
+        # A node reached from several frontier nodes keeps the first
+        _, first = numpy.unique(cand_rows * num_nodes + nbrs, return_index=True)
+        cand_rows = cand_rows[first]
+        via = via[first]
+        nbrs = nbrs[first]
+
+        hops[cand_rows, nbrs] = level
+        if level == 1:
+            next_hop[cand_rows, nbrs] = nbrs
+        else:
+            next_hop[cand_rows, nbrs] = next_hop[cand_rows, via]
+        frontier_rows = cand_rows
+        frontier_nodes = nbrs
+    return next_hop, hops
+
+
+class RouteTables(Mapping):
+    """
+    Read only view of next hop and hop count matrices as route tables.
+
+    route_tables[source][dest] returns (path_len, next_hop_name).
+    Unreachable destinations and the source itself are not present.
+    """
+
+    def __init__(self, names: list[str], name_to_id: dict[str, int],
+                 next_hop: numpy.ndarray, hops: numpy.ndarray) -> None:
+        self.names = names
+        self.name_to_id = name_to_id
+        self.next_hop = next_hop
+        self.hops = hops
+
+    def __getitem__(self, source: str) -> "RouteRow":
+        return RouteRow(self, self.name_to_id[source])
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+class RouteRow(Mapping):
+    """
+    Routes from one source node
+    """
+
+    def __init__(self, tables: RouteTables, source: int) -> None:
+        self.tables = tables
+        self.source = source
+        self.no_hop = no_route(tables.hops)
+
+    def __getitem__(self, dest: str) -> tuple[int, str]:
+        dest_id = self.tables.name_to_id[dest]
+        path_len = int(self.tables.hops[self.source, dest_id])
+        if dest_id == self.source or path_len == self.no_hop:
+            raise KeyError(dest)
+        next_hop = int(self.tables.next_hop[self.source, dest_id])
+        return path_len, self.tables.names[next_hop]
+
+    def _dest_ids(self) -> numpy.ndarray:
+        reachable = numpy.asarray(self.tables.hops[self.source]) != self.no_hop
+        reachable[self.source] = False
+        return numpy.flatnonzero(reachable)
+
+    def __iter__(self) -> Iterator[str]:
+        return (self.tables.names[i] for i in self._dest_ids())
+
+    def __len__(self) -> int:
+        return len(self._dest_ids())
+
+
+class RouteMatrix:
+    """
+    Next hop and hop count matrices for all pairs of nodes.
+    next_hop[s, d] is the node id of the next hop from s toward d.
+    hops[s, d] is the path length.
+    """
+
+    def __init__(self, names: list[str], next_hop: numpy.ndarray, hops: numpy.ndarray) -> None:
+        self.names = names
+        self.name_to_id: dict[str, int] = {name: i for i, name in enumerate(names)}
+        self.next_hop = next_hop
+        self.hops = hops
+
+    def route(self, source: str, dest: str) -> tuple[int, str] | None:
+        """
+        Return (path_len, next hop) from source to dest, or None if unreachable.
+        """
+        return self.tables()[source].get(dest)
+
+    def route_table(self, source: str) -> dict[str, tuple[int, str]]:
+        """
+        Return the routes for a source in the generate_route_table format.
+        """
+        return dict(self.tables()[source])
+
+    def tables(self) -> RouteTables:
+        return RouteTables(self.names, self.name_to_id, self.next_hop, self.hops)
+
+    def trace_path(self, start_node_name: str, target_node_name: str) -> bool:
+        return torus_topo.trace_path(start_node_name, target_node_name, self.tables())
+
+
+def generate_route_matrix(topo: compact_topo.CompactTopo, batch_size: int = BATCH_SIZE) -> RouteMatrix:
+    """
+    Generate routes between all pairs of nodes in the topology.
+    """
+    num_nodes = topo.num_nodes()
+    next_hop = numpy.empty((num_nodes, num_nodes), dtype=next_hop_dtype(num_nodes))
+    hops = numpy.empty((num_nodes, num_nodes), dtype=numpy.uint8)
+
+    for start in range(0, num_nodes, batch_size):
+        sources = numpy.arange(start, min(start + batch_size, num_nodes))
+        batch_next, batch_hops = bfs_routes(topo, sources)
+        if batch_hops.max(initial=0) >= no_route(hops):
+            # Long paths, widen the hop count type
+            wide = hops.astype(numpy.uint16)
+            wide[:start][hops[:start] == no_route(hops)] = no_route(wide)
+            hops = wide
+        unreachable = batch_hops < 0
+        batch_next[unreachable] = no_route(next_hop)
+        batch_hops[unreachable] = no_route(hops)
+        next_hop[sources] = batch_next
+        hops[sources] = batch_hops
+    return RouteMatrix(topo.names, next_hop, hops)
+
+
+def check_routes(topo: compact_topo.CompactTopo, routes: RouteMatrix) -> bool:
+    """
+    Check every route uses an up link to a neighbor one hop closer to the destination.
+    """
+    num_nodes = topo.num_nodes()
+    no_hop = no_route(routes.hops)
+    src, dst = numpy.nonzero(routes.hops != no_hop)
+    step = src != dst
+    src = src[step]
+    dst = dst[step]
+    nxt = routes.next_hop[src, dst].astype(numpy.int64)
+    if (routes.hops[nxt, dst].astype(numpy.int64) != routes.hops[src, dst].astype(numpy.int64) - 1).any():
+        return False
+
+    # Each (src, next hop) pair must be an up edge
+    up_edges = topo.edge_nodes[topo.edge_up].astype(numpy.int64)
+    links = numpy.concatenate([up_edges[:, 0] * num_nodes + up_edges[:, 1],
+                               up_edges[:, 1] * num_nodes + up_edges[:, 0]])
+    return bool(numpy.isin(src * num_nodes + nxt, links).all())
+
+
+def run_route_matrix_test() -> bool:
+    """
+    Compare the route matrix with generate_route_table on a small network
+    """
+    graph = torus_topo.create_network(10, 10)
+    torus_topo.down_inter_ring_links(graph, [0, 1, 5], 10)
+    topo = compact_topo.from_graph(graph)
+    routes = generate_route_matrix(topo, batch_size=16)
+
+    for name in graph.nodes:
+        table = torus_topo.generate_route_table(graph, name)
+        matrix_table = routes.route_table(name)
+        if table.keys() != matrix_table.keys():
+            return False
+        for dest, entry in table.items():
+            if entry[0] != matrix_table[dest][0]:
+                return False
+    if not check_routes(topo, routes):
+        return False
+    return routes.trace_path(torus_topo.get_node_name(0, 0), torus_topo.get_node_name(5, 5))
+
+
+def run_routing_test() -> bool:
+    """
+    Make a graph and exercise path tracing using the route matrix.
+    """
+    graph = torus_topo.create_network()
+    torus_topo.down_inter_ring_links(graph, [0, 1, 2, 3, 4, 5, 20, 21, 22, 23, 24, 25])
+    topo = compact_topo.from_graph(graph)
+
+    print("Number nodes: %d" % topo.num_nodes())
+    print("Number edges: %d" % topo.num_edges())
+    routes = generate_route_matrix(topo)
+    route_tables = routes.tables()
+
+    result: bool = torus_topo.trace_path(torus_topo.get_node_name(0, 0), torus_topo.get_node_name(0, 1), route_tables)
+    print()
+    result = result and torus_topo.trace_path(torus_topo.get_node_name(0, 0), torus_topo.get_node_name(0, 2), route_tables)
+    print()
+    result = result and torus_topo.trace_path(torus_topo.get_node_name(0, 0), torus_topo.get_node_name(1, 0), route_tables)
+    print()
+    result = result and torus_topo.trace_path(torus_topo.get_node_name(0, 0), torus_topo.get_node_name(18, 26), route_tables)
+    return result and check_routes(topo, routes)
+
+
+if __name__ == "__main__":
+    run_routing_test()
@@ -0,0 +1,199 @@
+"""
+Packed on disk storage for all pairs route tables.
+
+A route store file holds the next hop matrix (uint16 node ids) and the hop
+count matrix (uint8) generated by route_matrix, plus the index of node names.
+The matrices are memory mapped when the file is opened, so several processes
+(tests, trace tools, the driver) share one copy through the page cache
+without building Python route table objects.
+
+File layout:
+    8 bytes   magic "SATROUTE"
+    uint32    format version
+    uint32    header length
+    header    JSON: node names and the dtype of each matrix
+    padding   to a 64 byte boundary
+    next hop  N x N, row major
+    hop count N x N, row major
+"""
+
+import json
+import os
+import struct
+import sys
+import tempfile
+
+import numpy
+
+import compact_topo
+import route_matrix
+import torus_topo
+
+MAGIC = b"SATROUTE"
+VERSION = 1
+ALIGN = 64
+
+
+def _aligned(offset: int) -> int:
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+
+def write_route_store(path: str, routes: route_matrix.RouteMatrix) -> None:
+    """
+    Write the route matrix to a file. The file is replaced atomically so
+    readers never see a partial file.
+    """
+    header = json.dumps({
+        "names": routes.names,
+        "next_hop_dtype": routes.next_hop.dtype.str,
+        "hops_dtype": routes.hops.dtype.str,
+    }).encode("utf-8")
+    prefix = MAGIC + struct.pack("<II", VERSION, len(header)) + header
+    padding = _aligned(len(prefix)) - len(prefix)
+
+    dir_name = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=dir_name, suffix=".tmp")
+    try:
+        with open(fd, "wb") as f:
+            f.write(prefix)
+            f.write(b"\0" * padding)
+            f.write(numpy.ascontiguousarray(routes.next_hop).tobytes())
+            f.write(numpy.ascontiguousarray(routes.hops).tobytes())
+        # Readable by other processes sharing the routes
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class RouteStore:
+    """
+    Read only, memory mapped route tables.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        with open(path, "rb") as f:
+            fixed = f.read(len(MAGIC) + 8)
+            if fixed[: len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not a route store file")
+            version, header_len = struct.unpack("<II", fixed[len(MAGIC):])
+            if version != VERSION:
+                raise ValueError(f"{path}: unsupported route store version {version}")
+            header = json.loads(f.read(header_len).decode("utf-8"))
+
+        self.names: list[str] = header["names"]
+        self.name_to_id: dict[str, int] = {name: i for i, name in enumerate(self.names)}
+        num_nodes = len(self.names)
+        offset = _aligned(len(MAGIC) + 8 + header_len)
+        next_hop_dtype = numpy.dtype(header["next_hop_dtype"])
+        hops_dtype = numpy.dtype(header["hops_dtype"])
+        shape = (num_nodes, num_nodes)
+        self.next_hop = numpy.memmap(path, dtype=next_hop_dtype, mode="r", offset=offset, shape=shape)
+        offset += num_nodes * num_nodes * next_hop_dtype.itemsize
+        self.hops = numpy.memmap(path, dtype=hops_dtype, mode="r", offset=offset, shape=shape)
+        self.no_hop = route_matrix.no_route(self.hops)
+
+    def close(self) -> None:
+        # The mapping is released once no views of the arrays remain
+        self.next_hop = None
+        self.hops = None
+
+    def __enter__(self) -> "RouteStore":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def lookup(self, source: str, dest: str) -> tuple[int, str] | None:
+        """
+        Return (path_len, next hop) from source to dest, or None if unreachable.
+        """
+        src = self.name_to_id[source]
+        dst = self.name_to_id[dest]
+        path_len = int(self.hops[src, dst])
+        if path_len == self.no_hop:
+            return None
+        return path_len, self.names[int(self.next_hop[src, dst])]
+
+    def row_ids(self, source: str) -> tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Return the next hop and hop count arrays for a source, without copying.
+        """
+        src = self.name_to_id[source]
+        return self.next_hop[src], self.hops[src]
+
+    def row(self, source: str) -> dict[str, tuple[int, str]]:
+        """
+        Return the routes for a source in the generate_route_table format.
+        """
+        return dict(self.tables()[source])
+
+    def trace_path(self, source: str, dest: str) -> list[str] | None:
+        """
+        Follow the next hops from source to dest. Return the list of nodes
+        on the path, or None if dest is unreachable or the path loops.
+        """
+        src = self.name_to_id[source]
+        dst = self.name_to_id[dest]
+        path = [source]
+        while src != dst:
+            if self.hops[src, dst] == self.no_hop or len(path) > len(self.names):
+                return None
+            src = int(self.next_hop[src, dst])
+            path.append(self.names[src])
+        return path
+
+    def tables(self) -> route_matrix.RouteTables:
+        return route_matrix.RouteTables(self.names, self.name_to_id, self.next_hop, self.hops)
+
+
+def run_route_store_test() -> bool:
+    """
+    Write routes for a small network, then check lookups and traces.
+    """
+    graph = torus_topo.create_network(8, 8)
+    torus_topo.down_inter_ring_links(graph, [0, 1], 8)
+    topo = compact_topo.from_graph(graph)
+    routes = route_matrix.generate_route_matrix(topo)
+
+    fd, path = tempfile.mkstemp(suffix=".routes")
+    os.close(fd)
+    try:
+        write_route_store(path, routes)
+        with RouteStore(path) as store:
+            if store.next_hop.dtype != numpy.uint16 or store.hops.dtype != numpy.uint8:
+                return False
+            source = torus_topo.get_node_name(0, 0)
+            dest = torus_topo.get_node_name(5, 3)
+            if store.row(source) != routes.route_table(source):
+                return False
+            if store.lookup(source, dest) != routes.route(source, dest):
+                return False
+            if store.lookup(source, "G_PAO") is not None:
+                return False
+            path_list = store.trace_path(source, dest)
+            if path_list is None or len(path_list) != store.lookup(source, dest)[0] + 1:
+                return False
+            return torus_topo.trace_path(source, dest, store.tables())
+    finally:
+        os.unlink(path)
+
+
+def usage():
+    print("Usage: route_store <file> [<rings> <routers-per-ring>]")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 4):
+        usage()
+        sys.exit(-1)
+    num_rings = torus_topo.NUM_RINGS
+    num_routers = torus_topo.NUM_RING_NODES
+    if len(sys.argv) == 4:
+        num_rings = int(sys.argv[2])
+        num_routers = int(sys.argv[3])
+    topo = compact_topo.create_compact_network(num_rings, num_routers)
+    write_route_store(sys.argv[1], route_matrix.generate_route_matrix(topo))
+    print(f"Wrote routes for {topo.num_nodes()} nodes to {sys.argv[1]}")
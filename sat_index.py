@@ -0,0 +1,242 @@
+"""
+Spatial index of satellite positions for ground station lookups.
+
+Satellites are bucketed by their unit position vector into a uniform 3D
+grid of cells. Unlike a latitude / longitude box there is no seam at
++/-180 degrees longitude or at the poles. The index is rebuilt for each
+time slice with a radix sort over the cell keys, in linear time.
+
+A satellite can only be above min_elevation for a station if the angle
+between them at the earth's center is below a limit that follows from
+the elevation and the largest satellite radius. A station looks up only
+the cells within that angle and the candidates are then filtered exactly
+on the angle, so every satellite that can be visible is returned.
+
+Run this module to benchmark against the lat / lon box filter that
+geosimsat used.
+"""
+
+import datetime
+import math
+import time
+
+import numpy
+from skyfield.api import load  # type: ignore
+
+import constellation
+import sat_positions
+import sat_records
+import torus_topo
+import visibility
+
+# Extra central angle allowed for the difference between geodetic and
+# geocentric up, degrees
+ANGLE_MARGIN = 0.5
+
+
+def max_central_angle(min_elevation: float, sat_radius: float, station_radius: float) -> float:
+    """
+    Return the largest angle at the earth's center, in radians, between a
+    station and a satellite that is above min_elevation degrees, on a
+    sphere. Radii in km.
+    """
+    elevation = math.radians(min_elevation)
+    ratio = min(station_radius * math.cos(elevation) / sat_radius, 1.0)
+    return math.acos(ratio) - elevation
+
+
+class SatelliteIndex:
+    """
+    Uniform grid over satellite unit vectors, cells stored in CSR form.
+    """
+
+    def __init__(self, ecef: numpy.ndarray, cell_size: float) -> None:
+        self.cell_size = cell_size
+        self.cells_per_axis = max(int(math.ceil(2.0 / cell_size)), 1)
+        self.unit = ecef / numpy.linalg.norm(ecef, axis=1)[:, None]
+
+        cell = self._cell(self.unit)
+        n = self.cells_per_axis
+        keys = (cell[:, 0] * n + cell[:, 1]) * n + cell[:, 2]
+        # Cell ranges from the counts, satellite ids ordered by cell
+        counts = numpy.bincount(keys, minlength=n * n * n)
+        self.offsets = numpy.zeros(n * n * n + 1, dtype=numpy.int64)
+        numpy.cumsum(counts, out=self.offsets[1:])
+        self.sat_ids = _radix_argsort(keys)
+
+    def _cell(self, unit: numpy.ndarray) -> numpy.ndarray:
+        cell = numpy.floor((unit + 1.0) / self.cell_size).astype(numpy.int64)
+        return numpy.clip(cell, 0, self.cells_per_axis - 1)
+
+    def query(self, unit: numpy.ndarray, angle: float) -> numpy.ndarray:
+        """
+        Return the sorted ids of satellites within angle radians of the unit vector.
+        """
+        return self.query_many(unit[None, :], angle)[0]
+
+    def query_many(self, units: numpy.ndarray, angle: float) -> list[numpy.ndarray]:
+        """
+        Return the sorted ids of satellites within angle radians of each of
+        the unit vectors (queries, 3).
+        """
+        chord = 2.0 * math.sin(min(angle, math.pi) / 2.0)
+        low = self._cell(units - chord)
+        high = self._cell(units + chord)
+        # With cells at least as large as the chord, a query spans at most 3 cells per axis
+        span = int((high - low).max()) + 1 if len(units) > 0 else 1
+        steps = numpy.stack(numpy.meshgrid(*[numpy.arange(span)] * 3, indexing="ij"), axis=-1).reshape(-1, 3)
+        cells = low[:, None, :] + steps[None, :, :]
+        inside = (cells <= high[:, None, :]).all(axis=2)
+        n = self.cells_per_axis
+        keys = (cells[..., 0] * n + cells[..., 1]) * n + cells[..., 2]
+        keys = numpy.where(inside, keys, 0)
+        starts = self.offsets[keys]
+        lengths = numpy.where(inside, self.offsets[keys + 1] - starts, 0).ravel()
+
+        # Expand the cell ranges into satellite ids, grouped by query
+        total = int(lengths.sum())
+        first = numpy.repeat(numpy.cumsum(lengths) - lengths, lengths)
+        position = numpy.repeat(starts.ravel(), lengths) + numpy.arange(total) - first
+        query = numpy.repeat(numpy.arange(len(units)).repeat(len(steps)), lengths)
+        ids = self.sat_ids[position]
+
+        close = numpy.einsum("ij,ij->i", self.unit[ids], units[query]) >= math.cos(angle)
+        ids, query = ids[close], query[close]
+        order = numpy.lexsort((ids, query))
+        counts = numpy.bincount(query, minlength=len(units))
+        return numpy.split(ids[order], numpy.cumsum(counts)[:-1])
+
+
+def _radix_argsort(keys: numpy.ndarray) -> numpy.ndarray:
+    """
+    Stable argsort of keys below 2**32 in linear time. numpy sorts 16 bit
+    integers with a radix sort, so sort on the low then the high 16 bits.
+    """
+    order = numpy.argsort((keys & 0xFFFF).astype(numpy.uint16), kind="stable")
+    if len(keys) > 0 and keys.max() > 0xFFFF:
+        high = (keys[order] >> 16).astype(numpy.uint16)
+        order = order[numpy.argsort(high, kind="stable")]
+    return order
+
+
+def build_index(ecef: numpy.ndarray, min_elevation: float, station_radius: float) -> tuple[SatelliteIndex, float]:
+    """
+    Build an index sized for queries at min_elevation.
+    Returns the index and the central angle to query with.
+    """
+    sat_radius = float(numpy.linalg.norm(ecef, axis=1).max()) if len(ecef) > 0 else station_radius
+    angle = max_central_angle(min_elevation, sat_radius, station_radius) + math.radians(ANGLE_MARGIN)
+    cell_size = max(2.0 * math.sin(min(angle, math.pi) / 2.0), 0.05)
+    return SatelliteIndex(ecef, cell_size), angle
+
+
+def candidates(frames: visibility.StationFrames, ecef: numpy.ndarray, min_elevation: float) -> list[numpy.ndarray]:
+    """
+    Return, for each station, the ids of satellites that may be above min_elevation.
+    """
+    station_radius = numpy.linalg.norm(frames.ecef, axis=1)
+    if len(station_radius) == 0:
+        return []
+    index, angle = build_index(ecef, min_elevation, float(station_radius.min()))
+    return index.query_many(frames.ecef / station_radius[:, None], angle)
+
+
+def box_candidates(station_lat: float, station_lon: float, lat: numpy.ndarray, lon: numpy.ndarray,
+                   size: float = 20) -> numpy.ndarray:
+    """
+    The lat / lon box filter previously used by geosimsat.
+    Misses satellites across the +/-180 degree longitude seam.
+    """
+    return numpy.flatnonzero((lon > station_lon - size) & (lon < station_lon + size) &
+                             (lat > station_lat - size) & (lat < station_lat + size))
+
+
+def _random_stations(count: int, seed: int = 1) -> tuple[numpy.ndarray, numpy.ndarray]:
+    rng = numpy.random.default_rng(seed)
+    lat = numpy.degrees(numpy.arcsin(rng.uniform(-0.9, 0.9, count)))
+    lon = rng.uniform(-180, 180, count)
+    return lat, lon
+
+
+def run_sat_index_test() -> bool:
+    """
+    Check that index candidates contain every visible satellite, including
+    stations next to the longitude seam and near a pole.
+    """
+    graph = torus_topo.create_network(20, 20, False)
+    names, satrecs = sat_records.build_satrecs(graph)
+    time = datetime.datetime.now(tz=datetime.timezone.utc)
+    positions = sat_positions.Propagator(satrecs).positions_at(time)
+
+    lat, lon = _random_stations(60)
+    lat = numpy.concatenate([lat, [0.0, 10.0, 80.0, -52.0]])
+    lon = numpy.concatenate([lon, [179.9, -179.9, 45.0, 180.0]])
+    frames = visibility.station_frames(lat, lon)
+    elevation, azimuth, distance = visibility.look_angles(frames, positions.ecef)
+
+    for min_elevation in (0, 25):
+        results = candidates(frames, positions.ecef, min_elevation)
+        index, angle = build_index(positions.ecef, min_elevation, float(numpy.linalg.norm(frames.ecef, axis=1).min()))
+        unit = positions.ecef / numpy.linalg.norm(positions.ecef, axis=1)[:, None]
+        for station, ids in enumerate(results):
+            visible = numpy.flatnonzero(elevation[station] > min_elevation)
+            if not numpy.isin(visible, ids).all():
+                return False
+            # Exactly the satellites within the query angle
+            station_unit = frames.ecef[station] / numpy.linalg.norm(frames.ecef[station])
+            if not numpy.array_equal(ids, numpy.flatnonzero(unit @ station_unit >= math.cos(angle))):
+                return False
+
+    # Ordering by cell matches a full sort, also for keys above 16 bits
+    rng = numpy.random.default_rng(2)
+    for high in (64000, 1 << 30):
+        keys = rng.integers(0, high, 5000)
+        if not numpy.array_equal(_radix_argsort(keys), numpy.argsort(keys, kind="stable")):
+            return False
+    index = SatelliteIndex(positions.ecef, 0.04)
+    if index.cells_per_axis ** 3 <= 0xFFFF or not numpy.array_equal(
+            index.query(unit[0], 0.3), numpy.flatnonzero(unit @ unit[0] >= math.cos(0.3))):
+        return False
+
+    # A satellite just across the seam from a station is found by the
+    # index but not by the box filter
+    sat_frames = visibility.station_frames(numpy.array([0.0]), numpy.array([-179.0]), numpy.array([550.0]))
+    frames = visibility.station_frames(numpy.array([0.0]), numpy.array([179.0]))
+    found = candidates(frames, sat_frames.ecef, 25)[0]
+    box = box_candidates(0.0, 179.0, numpy.array([0.0]), numpy.array([-179.0]))
+    return list(found) == [0] and len(box) == 0
+
+
+def benchmark(num_stations: int = 500, min_elevation: float = 25) -> None:
+    """
+    Compare candidate lookup time of the box filter, the index and the full
+    look angle matrix for a Starlink sized constellation.
+    """
+    graph = constellation.create_constellation(constellation.STARLINK_SHELLS, ground_stations=False)
+    names, satrecs = sat_records.build_satrecs(graph)
+    ts = load.timescale()
+    positions = sat_positions.Propagator(satrecs, ts).positions_at(datetime.datetime.now(tz=datetime.timezone.utc))
+    lat, lon = _random_stations(num_stations)
+    frames = visibility.station_frames(lat, lon)
+    print(f"{len(names)} satellites, {num_stations} stations")
+
+    start = time.time()
+    box = [box_candidates(lat[g], lon[g], positions.lat, positions.lon) for g in range(num_stations)]
+    print(f"box filter: {time.time() - start:.3f}s, {sum(len(ids) for ids in box)} candidates")
+
+    start = time.time()
+    found = candidates(frames, positions.ecef, min_elevation)
+    print(f"index: {time.time() - start:.3f}s, {sum(len(ids) for ids in found)} candidates")
+
+    start = time.time()
+    elevation, azimuth, distance = visibility.look_angles(frames, positions.ecef)
+    visible = elevation > min_elevation
+    print(f"full matrix: {time.time() - start:.3f}s, {int(visible.sum())} visible")
+
+    missed = sum(int((~numpy.isin(numpy.flatnonzero(visible[g]), box[g])).sum()) for g in range(num_stations))
+    print(f"visible satellites missed by the box filter: {missed}")
+
+
+if __name__ == "__main__":
+    print(run_sat_index_test())
+    benchmark()
@@ -0,0 +1,215 @@
+"""
+Propagate a large catalog of satellites with a pool of worker processes.
+
+The satellites are split into one contiguous shard per worker. Each
+shard has its own single process pool, so a shard always runs in the same
+worker. Satrec objects can not be pickled, so a worker is started with
+the elements of its shard only and builds their records once. After that
+a request only sends the times and frame rotations. Workers write their
+rotated positions and error codes directly into their rows of a block of
+shared memory, so no per satellite results are pickled.
+
+The workers and the shared memory are kept for the life of the
+propagator, so each call pays only for the computation. Call close() when
+done.
+
+PoolPropagator can be used anywhere a sat_positions.Propagator is used.
+Run this module to compare the time with the single process propagator.
+"""
+
+import datetime
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import threading
+import time
+import weakref
+
+import numpy
+from sgp4.api import Satrec, SatrecArray  # type: ignore
+from skyfield.api import load  # type: ignore
+
+import constellation
+import sat_positions
+import sat_records
+import torus_topo
+
+# Most times computed in one request to the workers
+MAX_TIMES = 64
+
+
+def _views(buffer, count: int, max_times: int) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Position (times, satellites, 3) and error (times, satellites) arrays in a shared buffer.
+    """
+    position = numpy.ndarray((max_times, count, 3), dtype=numpy.float64, buffer=buffer)
+    error = numpy.ndarray((max_times, count), dtype=numpy.uint8, buffer=buffer, offset=position.nbytes)
+    return position, error
+
+
+# State of a worker process, set by _init_worker
+_worker: dict = {}
+
+
+def _init_worker(name: str, count: int, first: int, elements: list[tuple], max_times: int) -> None:
+    memory = shared_memory.SharedMemory(name=name)
+    position, error = _views(memory.buf, count, max_times)
+    _worker["memory"] = memory
+    _worker["position"] = position
+    _worker["error"] = error
+    _worker["bounds"] = (first, first + len(elements))
+    _worker["array"] = SatrecArray([sat_records.satrec_from_elements(e) for e in elements])
+
+
+def _worker_bounds() -> tuple[int, int]:
+    return _worker["bounds"]
+
+
+def _propagate_shard(jd: numpy.ndarray, fr: numpy.ndarray, rotation: numpy.ndarray) -> None:
+    first, last = _worker["bounds"]
+    error, position, velocity = _worker["array"].sgp4(jd, fr)
+    count = len(jd)
+    _worker["position"][:count, first:last] = numpy.einsum("ikt,stk->tsi", rotation, position)
+    _worker["error"][:count, first:last] = error.T
+
+
+def _close(pools: list, memory: shared_memory.SharedMemory) -> None:
+    for pool in pools:
+        pool.terminate()
+    for pool in pools:
+        pool.join()
+    try:
+        memory.close()
+    except BufferError:
+        # Views of the buffer still exist, the mapping is released with them
+        pass
+    memory.unlink()
+
+
+class PoolPropagator(sat_positions.Propagator):
+    """
+    Propagator that shards the satellites across persistent worker processes, one per shard.
+    """
+
+    def __init__(self, satrecs: list[Satrec], ts=None, workers: int | None = None,
+                 max_times: int = MAX_TIMES) -> None:
+        super().__init__(satrecs, ts)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.max_times = max_times
+        edges = numpy.linspace(0, self.count, max(min(workers, self.count), 1) + 1).astype(int)
+        self.bounds = [(int(a), int(b)) for a, b in zip(edges, edges[1:])]
+        self.workers = len(self.bounds)
+
+        size = max_times * self.count * (3 * 8 + 1)
+        self.memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.position, self.error = _views(self.memory.buf, self.count, max_times)
+
+        # Fork where available, spawn would run the main module again in each worker
+        method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        context = multiprocessing.get_context(method)
+        self.pools = []
+        for first, last in self.bounds:
+            elements = [sat_records.satrec_elements(satrec) for satrec in satrecs[first:last]]
+            self.pools.append(context.Pool(1, initializer=_init_worker,
+                                           initargs=(self.memory.name, self.count, first, elements, max_times)))
+        # One request at a time uses the shared memory
+        self.lock = threading.Lock()
+        self.finalizer = weakref.finalize(self, _close, self.pools, self.memory)
+
+    def propagate_frame(self, t, rotation: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray]:
+        whole, fraction = sat_positions.utc_julian(t)
+        jd = numpy.atleast_1d(whole)
+        fraction = numpy.atleast_1d(fraction)
+        count = len(jd)
+        position = numpy.empty((count, self.count, 3))
+        error = numpy.empty((count, self.count), dtype=numpy.uint8)
+        with self.lock:
+            for first in range(0, count, self.max_times):
+                last = min(first + self.max_times, count)
+                results = [pool.apply_async(_propagate_shard,
+                                            (jd[first:last], fraction[first:last], rotation[:, :, first:last]))
+                           for pool in self.pools]
+                for result in results:
+                    result.get()
+                position[first:last] = self.position[:last - first]
+                error[first:last] = self.error[:last - first]
+        return position, error
+
+    def close(self) -> None:
+        """
+        Stop the workers and release the shared memory.
+        """
+        with self.lock:
+            del self.position, self.error
+            self.finalizer()
+
+
+def run_sat_pool_test() -> bool:
+    """
+    Compare pool results with the single process propagator.
+    """
+    graph = torus_topo.create_network(10, 10)
+    names, satrecs = sat_records.build_satrecs(graph)
+    ts = load.timescale()
+    propagator = sat_positions.Propagator(satrecs, ts)
+    # More times than fit in one request
+    pool = PoolPropagator(satrecs, ts, workers=3, max_times=4)
+    try:
+        # Each worker holds only its own shard
+        if [worker.apply(_worker_bounds) for worker in pool.pools] != pool.bounds:
+            return False
+        start = datetime.datetime(2024, 6, 1, tzinfo=datetime.timezone.utc)
+        times = [start + datetime.timedelta(seconds=37 * i) for i in range(10)]
+        for expected, positions in zip(propagator.propagate(times), pool.propagate(times)):
+            if not numpy.allclose(expected.ecef, positions.ecef, rtol=0, atol=1e-9):
+                return False
+            if not numpy.array_equal(expected.error, positions.error) or positions.time != expected.time:
+                return False
+
+        # GCRS positions match skyfield
+        position, error = pool.propagate_gcrs(times[:2])
+        satellites = sat_records.build_earth_satellites(graph, ts)
+        for s in range(0, len(satellites), 11):
+            expected = satellites[s].at(ts.from_datetime(times[1])).position.km
+            if numpy.abs(expected - position[1, s]).max() > 1e-6:
+                return False
+
+        # Works in a position window
+        window = sat_positions.PositionWindow(pool, datetime.timedelta(seconds=10), size=4)
+        positions = window.positions_at(start)
+        positions = window.positions_at(start + datetime.timedelta(seconds=10))
+        if not numpy.allclose(positions.lat, propagator.positions_at(positions.time).lat):
+            return False
+    finally:
+        pool.close()
+    return pool.workers == 3 and not pool.finalizer.alive
+
+
+def benchmark(workers: int | None = None, count: int = 64) -> None:
+    """
+    Time propagation of a Starlink sized constellation for count times.
+    """
+    graph = constellation.create_constellation(constellation.STARLINK_SHELLS, ground_stations=False)
+    names, satrecs = sat_records.build_satrecs(graph)
+    ts = load.timescale()
+    start = datetime.datetime.now(tz=datetime.timezone.utc)
+    times = [start + datetime.timedelta(seconds=10 * i) for i in range(count)]
+    print(f"{len(names)} satellites, {count} times")
+
+    propagator = sat_positions.Propagator(satrecs, ts)
+    begin = time.time()
+    propagator.propagate(times)
+    print(f"single process: {time.time() - begin:.3f}s")
+
+    pool = PoolPropagator(satrecs, ts, workers)
+    pool.propagate(times[:1])
+    begin = time.time()
+    pool.propagate(times)
+    print(f"pool of {pool.workers}: {time.time() - begin:.3f}s")
+    pool.close()
+
+
+if __name__ == "__main__":
+    print(run_sat_pool_test())
+    benchmark()
@@ -0,0 +1,309 @@
+"""
+Propagate all satellites of a constellation at once.
+
+Uses an sgp4 SatrecArray to compute TEME positions for every satellite
+in one call, rotates them into the earth fixed ITRS frame and converts to
+WGS84 latitude, longitude and height with numpy. The frame rotation is
+the one skyfield uses, computed once per time instead of once per
+satellite.
+
+Results are numpy arrays indexed by satellite id, the position of the
+satellite in the list of records.
+
+PositionWindow keeps the positions for the next few time slices, computed
+in one batched call and refilled by a background thread as time advances.
+"""
+
+from collections import deque
+from dataclasses import dataclass
+import datetime
+import threading
+
+import numpy
+from sgp4.api import Satrec, SatrecArray  # type: ignore
+from skyfield.api import load, wgs84  # type: ignore
+from skyfield.framelib import itrs  # type: ignore
+from skyfield.sgp4lib import TEME  # type: ignore
+from skyfield.constants import DAY_S  # type: ignore
+
+import sat_records
+import torus_topo
+
+# Default number of time slices computed ahead
+WINDOW_SIZE = 6
+
+# WGS84 parameters in km
+WGS84_RADIUS = wgs84.radius.km
+_WGS84_FLATTENING = 1 / wgs84.inverse_flattening
+WGS84_E2 = _WGS84_FLATTENING * (2 - _WGS84_FLATTENING)
+
+
+@dataclass
+class Positions:
+    """Positions of all satellites at one time"""
+
+    time: datetime.datetime
+    ecef: numpy.ndarray  # km, ITRS, shape (satellites, 3)
+    lat: numpy.ndarray  # degrees
+    lon: numpy.ndarray  # degrees
+    height: numpy.ndarray  # km
+    error: numpy.ndarray  # sgp4 error code per satellite, 0 for success
+
+
+def geodetic(ecef: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """
+    Convert earth fixed positions in km (..., 3) to WGS84 latitude and
+    longitude in degrees and height in km.
+    """
+    x, y, z = ecef[..., 0], ecef[..., 1], ecef[..., 2]
+    r = numpy.sqrt(x * x + y * y)
+    lat = numpy.arctan2(z, r)
+    for _ in range(3):
+        sin_lat = numpy.sin(lat)
+        e2_sin_lat = WGS84_E2 * sin_lat
+        radius = WGS84_RADIUS / numpy.sqrt(1.0 - e2_sin_lat * sin_lat)
+        lat = numpy.arctan2(z + radius * e2_sin_lat, r)
+    height = r / numpy.cos(lat) - radius
+    lon = numpy.arctan2(y, x)
+    return numpy.degrees(lat), numpy.degrees(lon), height
+
+
+def teme_to_itrs(t) -> numpy.ndarray:
+    """
+    Rotation matrices from TEME to ITRS for a skyfield Time array, shape (3, 3, times).
+    """
+    return numpy.einsum("ijt,kjt->ikt", itrs.rotation_at(t), TEME.rotation_at(t))
+
+
+def utc_julian(t) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Return the UTC based julian date whole and fraction that sgp4 takes for
+    a skyfield Time, as in skyfield EarthSatellite.
+    """
+    # TAI - UTC in whole seconds, from the public UT1 - UTC offset
+    leap_seconds = numpy.round((t.tai - t.ut1) * DAY_S + t.dut1)
+    return t.whole, t.tai_fraction - leap_seconds / DAY_S
+
+
+class Propagator:
+    """
+    Propagates a list of SGP4 records together.
+    """
+
+    def __init__(self, satrecs: list[Satrec], ts=None) -> None:
+        self.ts = ts if ts is not None else load.timescale()
+        self.count = len(satrecs)
+        self.satrecs = satrecs
+        self.satrec_array = SatrecArray(satrecs)
+
+    def propagate_teme(self, t) -> tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Return TEME positions in km with shape (satellites, times, 3) and
+        error codes for a skyfield Time array.
+        """
+        whole, fraction = utc_julian(t)
+        error, position, velocity = self.satrec_array.sgp4(whole, fraction)
+        return position, error
+
+    def propagate_frame(self, t, rotation: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Return positions in km rotated from TEME by rotation (3, 3, times),
+        shape (times, satellites, 3), and error codes (times, satellites).
+        """
+        position, error = self.propagate_teme(t)
+        return numpy.einsum("ikt,stk->tsi", rotation, position), error.T
+
+    def propagate(self, times: list[datetime.datetime]) -> list[Positions]:
+        """
+        Compute the positions of all satellites at each of the times.
+        """
+        if len(times) == 0:
+            return []
+        t = self.ts.from_datetimes(times)
+        ecef, error = self.propagate_frame(t, teme_to_itrs(t))
+        lat, lon, height = geodetic(ecef)
+        return [Positions(time, ecef[i], lat[i], lon[i], height[i], error[i])
+                for i, time in enumerate(times)]
+
+    def propagate_gcrs(self, times: list[datetime.datetime]) -> tuple[numpy.ndarray, numpy.ndarray]:
+        """
+        Return GCRS positions in km, as from skyfield EarthSatellite.at, with
+        shape (times, satellites, 3) and error codes (times, satellites).
+        """
+        t = self.ts.from_datetimes(times)
+        return self.propagate_frame(t, numpy.swapaxes(TEME.rotation_at(t), 0, 1))
+
+    def positions_at(self, time: datetime.datetime) -> Positions:
+        return self.propagate([time])[0]
+
+    def ecef_at(self, sat_ids: numpy.ndarray, times: list[datetime.datetime]) -> numpy.ndarray:
+        """
+        Return the earth fixed position in km (n, 3) of each satellite
+        sat_ids[i] at times[i].
+        """
+        if len(times) == 0:
+            return numpy.zeros((0, 3))
+        t = self.ts.from_datetimes(times)
+        whole, fraction = utc_julian(t)
+        position = numpy.array([self.satrecs[sat_id].sgp4(jd, fr)[1]
+                                for sat_id, jd, fr in zip(sat_ids, whole, fraction)])
+        return numpy.einsum("ikt,tk->ti", teme_to_itrs(t), position)
+
+
+class PositionWindow:
+    """
+    Positions for a window of future time slices start + n * step.
+
+    When fewer than half of the slices remain ahead of the requested time,
+    the window is refilled with one batched propagate call, in a background
+    thread unless background is False. A request for a time outside of the
+    window is computed directly and restarts the window at that time.
+    If a refill fails, requests waiting for it raise its exception.
+    """
+
+    def __init__(self, propagator: Propagator, step: datetime.timedelta,
+                 size: int = WINDOW_SIZE, background: bool = True) -> None:
+        self.propagator = propagator
+        self.step = step
+        self.size = max(size, 1)
+        self.background = background
+        self.cond = threading.Condition()
+        self.slices: deque[Positions] = deque()
+        self.next_time: datetime.datetime | None = None  # First time not yet in the window
+        self.fill_end: datetime.datetime | None = None  # End of a refill in progress
+        self.fill_error: BaseException | None = None  # Exception of the last refill
+        self.generation = 0  # Incremented when the window restarts
+        self.hits = 0
+        self.misses = 0
+
+    def positions_at(self, time: datetime.datetime) -> Positions:
+        """
+        Return the positions at time, waiting for a refill in progress if it covers the time.
+        """
+        with self.cond:
+            while True:
+                while len(self.slices) > 0 and self.slices[0].time < time:
+                    self.slices.popleft()
+                if len(self.slices) > 0 and self.slices[0].time == time:
+                    self.hits += 1
+                    positions = self.slices[0]
+                    break
+                if self.fill_end is not None and self.next_time is not None and \
+                        self.next_time <= time < self.fill_end and self._aligned(time):
+                    self.cond.wait()
+                    if self.fill_error is not None:
+                        raise self.fill_error
+                    continue
+                # Not in the window, compute now and restart the window after it
+                self.misses += 1
+                self.generation += 1
+                self.slices.clear()
+                self.fill_end = None
+                positions = self.propagator.positions_at(time)
+                self.slices.append(positions)
+                self.next_time = time + self.step
+                break
+            refill = len(self.slices) <= self.size // 2 and self.fill_end is None
+            if refill:
+                count = self.size - len(self.slices)
+                start = self.next_time
+                self.fill_end = start + self.step * count
+                self.fill_error = None
+                generation = self.generation
+
+        if refill:
+            if self.background:
+                threading.Thread(target=self._refill, args=(start, count, generation), daemon=True).start()
+            else:
+                self._refill(start, count, generation)
+        return positions
+
+    def _aligned(self, time: datetime.datetime) -> bool:
+        return (time - self.next_time) % self.step == datetime.timedelta(0)
+
+    def _refill(self, start: datetime.datetime, count: int, generation: int) -> None:
+        times = [start + self.step * i for i in range(count)]
+        results: list[Positions] = []
+        error: BaseException | None = None
+        try:
+            results = self.propagator.propagate(times)
+        except BaseException as e:
+            error = e
+        with self.cond:
+            if generation == self.generation:
+                # On failure the window is not extended and waiting requests raise the error
+                if error is None:
+                    self.slices.extend(results)
+                    self.next_time = start + self.step * count
+                self.fill_error = error
+                self.fill_end = None
+            self.cond.notify_all()
+
+
+def run_sat_positions_test() -> bool:
+    """
+    Compare vectorized positions with skyfield computed for each satellite.
+    """
+    graph = torus_topo.create_network(5, 5)
+    ts = load.timescale()
+    satellites = sat_records.build_earth_satellites(graph, ts)
+    names, satrecs = sat_records.build_satrecs(graph)
+    propagator = Propagator(satrecs, ts)
+    start = datetime.datetime.now(tz=datetime.timezone.utc)
+    times = [start, start + datetime.timedelta(minutes=17)]
+    results = propagator.propagate(times)
+    for time, positions in zip(times, results):
+        if positions.error.any():
+            return False
+        geo = [satellite.at(ts.from_datetime(time)) for satellite in satellites]
+        lat = numpy.array([wgs84.latlon_of(g)[0].degrees for g in geo])
+        lon = numpy.array([wgs84.latlon_of(g)[1].degrees for g in geo])
+        height = numpy.array([wgs84.height_of(g).km for g in geo])
+        if numpy.abs(lat - positions.lat).max() > 1e-6:
+            return False
+        if numpy.abs((lon - positions.lon + 180) % 360 - 180).max() > 1e-6:
+            return False
+        if numpy.abs(height - positions.height).max() > 1e-5:
+            return False
+    if names != [satellite.name for satellite in satellites]:
+        return False
+
+    # Window results match direct propagation, in order and after a jump
+    step = datetime.timedelta(seconds=10)
+    for background in (False, True):
+        window = PositionWindow(propagator, step, size=4, background=background)
+        times = [start + step * i for i in range(9)] + [start + step * 30 + datetime.timedelta(seconds=1)]
+        for time in times:
+            positions = window.positions_at(time)
+            if positions.time != time or not numpy.allclose(positions.lat, propagator.positions_at(time).lat):
+                return False
+        if window.misses != 2 or window.hits != 8:
+            return False
+
+    # A failed refill raises in the waiting request instead of blocking it
+    class FailingPropagator:
+        def __init__(self) -> None:
+            self.release = threading.Event()
+
+        def positions_at(self, time: datetime.datetime) -> Positions:
+            return propagator.positions_at(time)
+
+        def propagate(self, times: list[datetime.datetime]) -> list[Positions]:
+            self.release.wait()
+            raise ValueError("bad epoch")
+
+    failing = FailingPropagator()
+    window = PositionWindow(failing, step, size=4)  # type: ignore
+    window.positions_at(start)
+    threading.Timer(0.1, failing.release.set).start()
+    try:
+        window.positions_at(start + step)
+        return False
+    except ValueError:
+        pass
+    # Later requests are computed directly
+    return window.fill_end is None and window.positions_at(start + step * 2).time == start + step * 2
+
+
+if __name__ == "__main__":
+    print(run_sat_positions_test())
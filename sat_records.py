@@ -0,0 +1,160 @@
+"""
+Build SGP4 propagator records directly from OrbitData.
+
+OrbitData.tle_format produces TLE text that is then parsed back into a
+satellite record. For large networks this is slow and every call reads the
+clock separately. Here the records are initialized from the orbital
+elements with sgp4init, all sharing one epoch. The canned values used in
+the TLE lines (drag, eccentricity, argument of perigee) are used here as
+well, so the positions match those of the TLE path.
+
+TLE text is still available from OrbitData.tle_format when needed.
+
+Satrec objects can not be pickled. satrec_elements returns the values
+needed to build an identical record in another process.
+"""
+
+import datetime
+import math
+
+import numpy
+import networkx
+from sgp4.api import Satrec, SatrecArray, WGS72, jday  # type: ignore
+from skyfield.api import load  # type: ignore
+from skyfield.api import EarthSatellite  # type: ignore
+
+import torus_topo
+
+# Values matching the canned fields of torus_topo.LINE1 and LINE2
+NDOT = 0.00009878  # revolutions per day^2 / 2
+BSTAR = 0.47637e-3
+ECCENTRICITY = 0.0003572
+ARG_PERIGEE = 297.6243  # degrees
+
+# Minutes per day / radians per revolution
+XPDOTP = 1440.0 / (2.0 * math.pi)
+# Julian date of the sgp4 epoch reference, 1949 December 31 00:00 UT
+SGP4_EPOCH_JD = 2433281.5
+
+
+def default_epoch() -> datetime.datetime:
+    """
+    Return the epoch used by OrbitData.tle_format: the start of the current day.
+    """
+    today = datetime.datetime.now().date()
+    return datetime.datetime(today.year, today.month, today.day, tzinfo=datetime.timezone.utc)
+
+
+def satrec_from_orbit(orbit: torus_topo.OrbitData, epoch: datetime.datetime) -> Satrec:
+    """
+    Create an SGP4 record from orbital elements at the given epoch.
+    """
+    jd, fr = jday(epoch.year, epoch.month, epoch.day, epoch.hour, epoch.minute,
+                  epoch.second + epoch.microsecond / 1e6)
+    satrec = Satrec()
+    satrec.sgp4init(
+        WGS72,
+        "i",
+        orbit.cat_num,
+        jd - SGP4_EPOCH_JD + fr,
+        BSTAR,
+        NDOT / (XPDOTP * 1440.0),
+        0.0,
+        ECCENTRICITY,
+        math.radians(ARG_PERIGEE),
+        math.radians(orbit.inclination),
+        math.radians(orbit.mean_anomaly),
+        orbit.mean_motion / XPDOTP,
+        math.radians(orbit.right_ascension),
+    )
+    return satrec
+
+
+def satrec_elements(satrec: Satrec) -> tuple:
+    """
+    Return the sgp4init arguments of a record, a tuple that can be pickled.
+    """
+    epoch = (satrec.jdsatepoch - SGP4_EPOCH_JD) + satrec.jdsatepochF
+    return (satrec.operationmode, satrec.satnum, epoch, satrec.bstar, satrec.ndot, satrec.nddot,
+            satrec.ecco, satrec.argpo, satrec.inclo, satrec.mo, satrec.no_kozai, satrec.nodeo)
+
+
+def satrec_from_elements(elements: tuple) -> Satrec:
+    """
+    Create an SGP4 record from the values returned by satrec_elements.
+    """
+    satrec = Satrec()
+    satrec.sgp4init(WGS72, *elements)
+    return satrec
+
+
+def build_satrecs(graph: networkx.Graph, epoch: datetime.datetime | None = None) -> tuple[list[str], list[Satrec]]:
+    """
+    Create SGP4 records for all satellites in the graph with a shared epoch.
+    Returns the satellite names and records in the same order.
+    """
+    if epoch is None:
+        epoch = default_epoch()
+    names = torus_topo.satellites(graph)
+    satrecs = [satrec_from_orbit(graph.nodes[name]["orbit"], epoch) for name in names]
+    return names, satrecs
+
+
+def build_satrec_array(graph: networkx.Graph, epoch: datetime.datetime | None = None) -> tuple[list[str], SatrecArray]:
+    """
+    Create a SatrecArray to propagate all satellites of the graph in one call.
+    """
+    names, satrecs = build_satrecs(graph, epoch)
+    return names, SatrecArray(satrecs)
+
+
+def build_earth_satellites(graph: networkx.Graph, ts=None,
+                           epoch: datetime.datetime | None = None) -> list[EarthSatellite]:
+    """
+    Create skyfield EarthSatellites for all satellites in the graph.
+    """
+    if ts is None:
+        ts = load.timescale()
+    names, satrecs = build_satrecs(graph, epoch)
+    result = []
+    for name, satrec in zip(names, satrecs):
+        satellite = EarthSatellite.from_satrec(satrec, ts)
+        satellite.name = name
+        result.append(satellite)
+    return result
+
+
+def run_sat_records_test() -> bool:
+    """
+    Compare positions from records built from elements with those parsed from TLE text.
+    """
+    graph = torus_topo.create_network(4, 4)
+    ts = load.timescale()
+    satellites = build_earth_satellites(graph, ts)
+    time = ts.utc(datetime.datetime.now(tz=datetime.timezone.utc) + datetime.timedelta(hours=3))
+    for satellite in satellites:
+        l1, l2 = graph.nodes[satellite.name]["orbit"].tle_format()
+        expected = EarthSatellite(l1, l2, satellite.name, ts)
+        if expected.epoch.tt != satellite.epoch.tt:
+            return False
+        distance = (satellite.at(time) - expected.at(time)).distance().km
+        if distance > 0.001:
+            return False
+
+    names, satrec_array = build_satrec_array(graph)
+    jd, fr = jday(2024, 6, 1, 12, 0, 0)
+    error, position, velocity = satrec_array.sgp4(numpy.array([jd]), numpy.array([fr]))
+    if len(names) != 16 or error.any() or position.shape != (16, 1, 3):
+        return False
+
+    # Records rebuilt from their elements propagate the same, including those from TLE text
+    l1, l2 = graph.nodes[names[0]]["orbit"].tle_format()
+    for satrec in [satellite.model for satellite in satellites] + [Satrec.twoline2rv(l1, l2)]:
+        copy = satrec_from_elements(satrec_elements(satrec))
+        if numpy.abs(numpy.array(copy.sgp4(jd, fr)[1]) - numpy.array(satrec.sgp4(jd, fr)[1])).max() > 1e-6:
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    print(run_sat_records_test())
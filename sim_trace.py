@@ -0,0 +1,128 @@
+"""
+Columnar trace of a simulation run.
+
+Records link state changes, uplink rise / set events and statistics
+sampled at each tick. Each kind of record is kept as a set of columns
+that are saved together in a compressed numpy .npz file, so that a long
+run can be loaded and analyzed without parsing text output.
+
+Node names are stored once in a table and referenced by index.
+
+Columns:
+- link_time, link_node1, link_node2, link_up
+- uplink_time, uplink_station, uplink_satellite, uplink_rise
+- tick_time, tick_uplinks (stations, uplink count per station), tick_links_up (inter plane links with both satellites in band)
+
+Times are seconds after the start of the run.
+"""
+
+import datetime
+
+import numpy
+
+
+class SimTrace:
+    """
+    Accumulates events and tick statistics for a run.
+    """
+
+    def __init__(self, start: datetime.datetime, station_names: list[str], satellite_names: list[str]) -> None:
+        self.start = start
+        self.station_names = station_names
+        self.satellite_names = satellite_names
+        self.node_names: list[str] = []
+        self.node_ids: dict[str, int] = {}
+        self.duration = 0.0
+        self.wall_seconds = 0.0
+
+        self.link_time: list[float] = []
+        self.link_node1: list[int] = []
+        self.link_node2: list[int] = []
+        self.link_up: list[bool] = []
+
+        self.uplink_time: list[float] = []
+        self.uplink_station: list[int] = []
+        self.uplink_satellite: list[int] = []
+        self.uplink_rise: list[bool] = []
+
+        self.tick_time: list[float] = []
+        self.tick_uplinks: list[list[int]] = []
+        self.tick_links_up: list[int] = []
+
+    def seconds(self, time: datetime.datetime) -> float:
+        return (time - self.start).total_seconds()
+
+    def node_id(self, name: str) -> int:
+        node_id = self.node_ids.get(name)
+        if node_id is None:
+            node_id = len(self.node_names)
+            self.node_ids[name] = node_id
+            self.node_names.append(name)
+        return node_id
+
+    def link(self, time: datetime.datetime, node1: str, node2: str, up: bool) -> None:
+        self.link_time.append(self.seconds(time))
+        self.link_node1.append(self.node_id(node1))
+        self.link_node2.append(self.node_id(node2))
+        self.link_up.append(up)
+
+    def uplink(self, time: datetime.datetime, station: int, satellite: int, rise: bool) -> None:
+        self.uplink_time.append(self.seconds(time))
+        self.uplink_station.append(station)
+        self.uplink_satellite.append(satellite)
+        self.uplink_rise.append(rise)
+
+    def tick(self, time: datetime.datetime, uplinks: list[int], links_up: int) -> None:
+        """
+        Record the number of uplinks of each station and inter plane links up.
+        """
+        self.tick_time.append(self.seconds(time))
+        self.tick_uplinks.append(uplinks)
+        self.tick_links_up.append(links_up)
+
+    def zero_uplink_ratio(self) -> float:
+        """
+        Fraction of ticks where at least one station has no uplinks.
+        """
+        if len(self.tick_uplinks) == 0:
+            return 0.0
+        uplinks = numpy.array(self.tick_uplinks, dtype=numpy.int16).reshape(len(self.tick_uplinks), -1)
+        return float((uplinks == 0).any(axis=1).mean())
+
+    def save(self, path: str) -> None:
+        numpy.savez_compressed(
+            path,
+            start=numpy.array(self.start.isoformat()),
+            duration=self.duration,
+            wall_seconds=self.wall_seconds,
+            node_names=numpy.array(self.node_names, dtype=str),
+            station_names=numpy.array(self.station_names, dtype=str),
+            satellite_names=numpy.array(self.satellite_names, dtype=str),
+            link_time=numpy.array(self.link_time, dtype=numpy.float64),
+            link_node1=numpy.array(self.link_node1, dtype=numpy.int32),
+            link_node2=numpy.array(self.link_node2, dtype=numpy.int32),
+            link_up=numpy.array(self.link_up, dtype=bool),
+            uplink_time=numpy.array(self.uplink_time, dtype=numpy.float64),
+            uplink_station=numpy.array(self.uplink_station, dtype=numpy.int32),
+            uplink_satellite=numpy.array(self.uplink_satellite, dtype=numpy.int32),
+            uplink_rise=numpy.array(self.uplink_rise, dtype=bool),
+            tick_time=numpy.array(self.tick_time, dtype=numpy.float64),
+            tick_uplinks=numpy.array(self.tick_uplinks, dtype=numpy.int16).reshape(
+                len(self.tick_uplinks), len(self.station_names)),
+            tick_links_up=numpy.array(self.tick_links_up, dtype=numpy.int32),
+        )
+
+    @staticmethod
+    def load(path: str) -> "SimTrace":
+        with numpy.load(path) as data:
+            trace = SimTrace(datetime.datetime.fromisoformat(str(data["start"])),
+                             data["station_names"].tolist(), data["satellite_names"].tolist())
+            trace.duration = float(data["duration"])
+            trace.wall_seconds = float(data["wall_seconds"])
+            for name in data["node_names"].tolist():
+                trace.node_id(name)
+            for column in ("link_time", "link_node1", "link_node2", "link_up",
+                           "uplink_time", "uplink_station", "uplink_satellite", "uplink_rise",
+                           "tick_time", "tick_uplinks", "tick_links_up"):
+                setattr(trace, column, data[column].tolist())
+        return trace
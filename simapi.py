@@ -12,6 +12,18 @@ class Link(BaseModel):
     node2_name: str
     up: bool
 
+class Links(BaseModel):
+    links: list[Link]
+
+class LinkResult(BaseModel):
+    node1_name: str
+    node2_name: str
+    error: str | None = None
+
+class LinksResult(BaseModel):
+    results: list[LinkResult]
+    elapsed: float  # Seconds to reconfigure the network
+
 class UpLink(BaseModel):
     sat_node: str
     distance: int
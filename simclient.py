@@ -1,36 +1,337 @@
 """
 Client to drive the JSON api implemented in driver.py
+
+Updates are collected until flush() is called, once per simulation tick.
+Only the latest update for each link and each ground station is sent.
+All link changes of a tick go out in one PUT /links request, applied by
+the driver in one job of its writer thread. Requests use a session that
+keeps connections to the driver open, one session for each thread that
+sends, since a requests.Session is not safe to share between threads.
+
+Updates that can not be delivered, because the driver is not reachable or
+returns a server error, are kept and sent again on a later flush after a
+growing delay. Updates made in the meantime replace them, so nothing is
+lost while the driver restarts. When sending works again after a failure,
+reconnected is set, since the driver may have lost the state sent before.
+
+AsyncClient sends each batch from an asyncio loop in a background thread,
+with the requests of a batch made concurrently. flush() returns at once.
 """
+
+import asyncio
+import http.server
+import json
+import threading
+import time
+
 import requests
+import requests.adapters
 import simapi
 
+# Connections kept open to the driver
+POOL_SIZE = 8
+# Seconds to wait before sending again after a failure, doubled up to MAX_RETRY_DELAY
+RETRY_DELAY = 1.0
+MAX_RETRY_DELAY = 30.0
+# Seconds to wait for a response
+TIMEOUT = 30.0
+
+
 class Client:
-    def __init__(self, url: str) -> None:
+    def __init__(self, url: str, pool_size: int = POOL_SIZE, verbose: bool = False) -> None:
         self.url = url
+        self.verbose = verbose
+        self.pool_size = pool_size
+        self.local = threading.local()
+        self.sessions: list[requests.Session] = []
+        self.lock = threading.Lock()
+        # Pending updates, the latest for each link and ground station
+        self.links: dict[tuple[str, str], simapi.Link] = {}
+        self.uplinks: dict[str, simapi.UpLinks] = {}
+        self.retry_delay = 0.0
+        self.retry_at = 0.0
+        self.failing = False
+        # Set when a batch is delivered after a failure, cleared by the user
+        self.reconnected = False
+        self.sent = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def session(self) -> requests.Session:
+        """
+        Return the session of the calling thread.
+        """
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self.local.session = session
+            with self.lock:
+                self.sessions.append(session)
+        return session
 
     def set_link_state(self, node1: str, node2: str, up: bool) -> None:
-        try:
-            print(f"send link state {node1}, {node2}, state up {up}")
-            data = simapi.Link(node1_name=node1, node2_name=node2, up="true" if up else "false")
-            url = f"{self.url}/link"
-            r = requests.put(url, 
-                    json=data.model_dump())
-            print(r.text)
-        except requests.exceptions.ConnectionError as e:
-            print(e)
-            pass
+        data = simapi.Link(node1_name=node1, node2_name=node2, up=up)
+        key = (node1, node2) if node1 <= node2 else (node2, node1)
+        with self.lock:
+            self.links[key] = data
 
     def set_uplinks(self, ground_node: str, links: list[tuple[str, int]]) -> None:
+        data = simapi.UpLinks(ground_node=ground_node, uplinks=[])
+        for link in links:
+            data.uplinks.append(simapi.UpLink(sat_node=link[0], distance=link[1]))
+        with self.lock:
+            self.uplinks[ground_node] = data
+
+    def pending(self) -> int:
+        with self.lock:
+            return len(self.links) + len(self.uplinks)
+
+    def take_batch(self) -> tuple[dict[tuple[str, str], simapi.Link], dict[str, simapi.UpLinks]] | None:
+        """
+        Remove and return the pending updates, or None if there are none or
+        it is too soon to try again after a failure.
+        """
+        with self.lock:
+            if len(self.links) + len(self.uplinks) == 0 or time.monotonic() < self.retry_at:
+                return None
+            batch = self.links, self.uplinks
+            self.links, self.uplinks = {}, {}
+            return batch
+
+    def requeue(self, links: dict[tuple[str, str], simapi.Link], uplinks: dict[str, simapi.UpLinks]) -> None:
+        """
+        Keep failed updates for the next flush, unless newer updates replaced them.
+        """
+        with self.lock:
+            for key, link in links.items():
+                self.links.setdefault(key, link)
+            for key, station in uplinks.items():
+                self.uplinks.setdefault(key, station)
+
+    def put(self, path: str, data) -> dict | None:
+        """
+        Send one request. Returns the response, or None if it should be sent again.
+        """
         try:
-            print(f"send up links: {ground_node}")
-            data = simapi.UpLinks(ground_node=ground_node, uplinks=[])
-            for link in links:
-                data.uplinks.append(simapi.UpLink(sat_node=link[0], distance=link[1]))
-            url = f"{self.url}/uplinks"
-            print(data.model_dump())
-            r = requests.put(url, json=data.model_dump())
-            print(r.text)
-        except requests.exceptions.ConnectionError as e:
-            print(e)
+            r = self.session().put(f"{self.url}{path}", json=data.model_dump(), timeout=TIMEOUT)
+        except requests.exceptions.RequestException as e:
+            if self.verbose:
+                print(e)
+            return None
+        if self.verbose:
+            print(f"{path} {r.status_code} {r.text}")
+        if r.status_code >= 500:
+            return None
+        if r.status_code >= 400:
+            # Retrying a bad request will not help
+            print(f"{path} rejected: {r.status_code} {r.text}")
+            self.rejected += 1
+            return {}
+        return r.json()
+
+    def send_links(self, links: list[simapi.Link]) -> bool:
+        """
+        Send link changes in one request. Returns False if they should be sent again.
+        """
+        if len(links) == 0:
+            return True
+        response = self.put("/links", simapi.Links(links=links))
+        if response is None:
+            return False
+        for result in response.get("results", []):
+            if result.get("error") is not None:
+                print(f"link {result['node1_name']} - {result['node2_name']} rejected: {result['error']}")
+                self.rejected += 1
+        return True
+
+    def send_uplinks(self, station: simapi.UpLinks) -> bool:
+        return self.put("/uplinks", station) is not None
+
+    def finish_batch(self, links: dict[tuple[str, str], simapi.Link], uplinks: dict[str, simapi.UpLinks],
+                     links_ok: bool, uplink_ok: list[bool]) -> bool:
+        """
+        Count the results of a batch and keep what failed. Returns True if all were sent.
+        """
+        failed_links = {} if links_ok else links
+        failed_uplinks = {key: station for (key, station), ok in zip(uplinks.items(), uplink_ok) if not ok}
+        failures = len(failed_links) + len(failed_uplinks)
+        self.sent += len(links) + len(uplinks) - failures
+        if failures == 0:
+            if self.failing:
+                self.reconnected = True
+            self.failing = False
+            self.retry_delay = 0.0
+            return True
+        self.failing = True
+        self.failed += failures
+        self.requeue(failed_links, failed_uplinks)
+        self.retry_delay = min(max(self.retry_delay * 2, RETRY_DELAY), MAX_RETRY_DELAY)
+        self.retry_at = time.monotonic() + self.retry_delay
+        print(f"{failures} updates not delivered, retry in {self.retry_delay}s")
+        return False
+
+    def flush(self) -> bool:
+        """
+        Send the pending updates. Returns True if nothing is left pending.
+        """
+        batch = self.take_batch()
+        if batch is not None:
+            links, uplinks = batch
+            links_ok = self.send_links(list(links.values()))
+            uplink_ok = [self.send_uplinks(station) for station in uplinks.values()]
+            self.finish_batch(links, uplinks, links_ok, uplink_ok)
+        return self.pending() == 0
+
+    def close(self) -> None:
+        with self.lock:
+            for session in self.sessions:
+                session.close()
+            self.sessions = []
+
+
+class AsyncClient(Client):
+    """
+    Client that sends batches in the background, with concurrent requests.
+    """
+
+    def __init__(self, url: str, pool_size: int = POOL_SIZE, verbose: bool = False) -> None:
+        super().__init__(url, pool_size, verbose)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.limit = asyncio.Semaphore(pool_size)
+        self.batch_lock = asyncio.Lock()
+        self.futures: list = []
+
+    async def send(self, function, data) -> bool:
+        async with self.limit:
+            return await asyncio.to_thread(function, data)
+
+    async def send_batch(self) -> None:
+        # One batch at a time, so the updates of a link or station arrive in order
+        async with self.batch_lock:
+            batch = self.take_batch()
+            if batch is None:
+                return
+            links, uplinks = batch
+            results = await asyncio.gather(self.send(self.send_links, list(links.values())),
+                                           *[self.send(self.send_uplinks, station) for station in uplinks.values()])
+            self.finish_batch(links, uplinks, results[0], results[1:])
+
+    def flush(self) -> bool:
+        """
+        Start sending the pending updates and return without waiting.
+        """
+        self.futures = [future for future in self.futures if not future.done()]
+        self.futures.append(asyncio.run_coroutine_threadsafe(self.send_batch(), self.loop))
+        return True
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """
+        Wait for the batches in progress. Returns True if nothing is left pending.
+        """
+        for future in self.futures:
+            future.result(timeout)
+        self.futures = []
+        return self.pending() == 0
+
+    def close(self) -> None:
+        self.wait()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        super().close()
+
+
+class _TestHandler(http.server.BaseHTTPRequestHandler):
+    def do_PUT(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server = self.server
+        response: dict = {"status": "OK"}
+        if server.failures > 0:  # type: ignore
+            server.failures -= 1  # type: ignore
+            self.send_response(503)
+        elif self.path == "/links":
+            # Links to unknown nodes, named X..., fail
+            server.received.extend([("/links", link) for link in body["links"]])  # type: ignore
+            response = {"results": [{"node1_name": link["node1_name"], "node2_name": link["node2_name"],
+                                     "error": "unknown" if link["node1_name"].startswith("X") else None}
+                                    for link in body["links"]], "elapsed": 0.0}
+            self.send_response(200)
+        else:
+            server.received.append((self.path, body))  # type: ignore
+            self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps(response).encode())
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def run_simclient_test() -> bool:
+    """
+    Send to a local server: coalesced batches, retries after server errors and the async client.
+    """
+    global RETRY_DELAY
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _TestHandler)
+    server.received = []  # type: ignore
+    server.failures = 0  # type: ignore
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    saved_delay = RETRY_DELAY
+    RETRY_DELAY = 0.0
+    try:
+        client = Client(url)
+        client.set_link_state("R0_0", "R1_0", False)
+        client.set_link_state("R1_0", "R0_0", True)  # Replaces the first
+        client.set_link_state("X0_0", "R1_0", True)
+        client.set_uplinks("G_0", [("R0_0", 900)])
+        if not client.flush() or client.sent != 3 or client.rejected != 1:
+            return False
+        if server.received != [  # type: ignore
+                ("/links", {"node1_name": "R1_0", "node2_name": "R0_0", "up": True}),
+                ("/links", {"node1_name": "X0_0", "node2_name": "R1_0", "up": True}),
+                ("/uplinks", {"ground_node": "G_0", "uplinks": [{"sat_node": "R0_0", "distance": 900}]})]:
+            return False
+
+        # Failed updates are kept and replaced by newer ones
+        server.failures = 2  # type: ignore
+        client.set_link_state("R0_0", "R1_0", False)
+        client.set_uplinks("G_0", [])
+        if client.flush() or client.pending() != 2 or client.failed != 2:
+            return False
+        client.set_uplinks("G_0", [("R0_1", 800)])
+        if not client.flush() or client.sent != 5 or not client.reconnected:
+            return False
+        if server.received[-1] != ("/uplinks", {"ground_node": "G_0",  # type: ignore
+                                                 "uplinks": [{"sat_node": "R0_1", "distance": 800}]}):
+            return False
+        client.close()
+
+        # Async client sends batches in the background. A tick not yet
+        # taken when the next one is flushed is replaced by it.
+        server.received = []  # type: ignore
+        async_client = AsyncClient(url, pool_size=4)
+        for tick in range(3):
+            for ring in range(10):
+                async_client.set_link_state(f"R{ring}_0", f"R{ring + 1}_0", tick % 2 == 0)
+            async_client.flush()
+        if not async_client.wait(10) or async_client.sent != len(server.received):  # type: ignore
+            return False
+        # Requests are made with sessions of the worker threads, not this one
+        if len(async_client.sessions) == 0 or getattr(async_client.local, "session", None) is not None:
+            return False
+        final = {body["node1_name"]: body["up"] for path, body in server.received}  # type: ignore
+        async_client.close()
+        return final == {f"R{ring}_0": True for ring in range(10)}
+    finally:
+        RETRY_DELAY = saved_delay
+        server.shutdown()
+        server.server_close()
 
 
+if __name__ == "__main__":
+    print(run_simclient_test())
@@ -1,5 +1,24 @@
 import unittest
 import torus_topo
+import compact_topo
+import route_matrix
+import dynamic_routes
+import torus_routes
+import route_store
+import path_check
+import link_snapshots
+import constellation
+import sat_records
+import sat_positions
+import sat_pool
+import visibility
+import sat_index
+import passes
+import event_sim
+import geosimsat
+import update_filter
+import simclient
+import topo_cache
 import frr_config_topo
 import sat_pos_samples
 import gps_sats
@@ -8,6 +27,66 @@ class TestCase(unittest.TestCase):
     def testTorus(self):
         self.assertTrue(torus_topo.run_small_test())
 
+    def testCompactTopo(self):
+        self.assertTrue(compact_topo.run_compact_test())
+
+    def testRouteMatrix(self):
+        self.assertTrue(route_matrix.run_route_matrix_test())
+
+    def testDynamicRoutes(self):
+        self.assertTrue(dynamic_routes.run_dynamic_routes_test())
+
+    def testTorusRoutes(self):
+        self.assertTrue(torus_routes.run_torus_routes_test())
+
+    def testRouteStore(self):
+        self.assertTrue(route_store.run_route_store_test())
+
+    def testPathCheck(self):
+        self.assertTrue(path_check.run_path_check_test())
+
+    def testLinkSnapshots(self):
+        self.assertTrue(link_snapshots.run_link_snapshots_test())
+
+    def testConstellation(self):
+        self.assertTrue(constellation.run_constellation_test())
+
+    def testSatRecords(self):
+        self.assertTrue(sat_records.run_sat_records_test())
+
+    def testSatPositions(self):
+        self.assertTrue(sat_positions.run_sat_positions_test())
+
+    def testSatPool(self):
+        self.assertTrue(sat_pool.run_sat_pool_test())
+
+    def testVisibility(self):
+        self.assertTrue(visibility.run_visibility_test())
+
+    def testSatIndex(self):
+        self.assertTrue(sat_index.run_sat_index_test())
+
+    def testPasses(self):
+        self.assertTrue(passes.run_passes_test())
+
+    def testEventSim(self):
+        self.assertTrue(event_sim.run_event_sim_test())
+
+    def testUpdateFilter(self):
+        self.assertTrue(update_filter.run_update_filter_test())
+
+    def testSimClient(self):
+        self.assertTrue(simclient.run_simclient_test())
+
+    def testBatchSim(self):
+        self.assertTrue(geosimsat.run_batch_test())
+
+    def testResendState(self):
+        self.assertTrue(geosimsat.run_resend_test())
+
+    def testTopoCache(self):
+        self.assertTrue(topo_cache.run_topo_cache_test())
+
     def testFrrConfig(self):
         self.assertTrue(frr_config_topo.test_config_graph())
 
@@ -0,0 +1,163 @@
+"""
+On disk cache of generated topologies.
+
+Building a large torus with create_network, and annotating it with IP
+addresses and FRR configs, is repeated with the same parameters on every
+launch. The finished graph (including the addresses, interface names and
+FRR configs set by frr_config_topo.annotate_graph) is pickled into the
+cache directory under a key made from the parameters, and loaded from
+there on the next run. The cache directory is next to this module, so
+every working directory shares it.
+
+A cache file that can not be loaded, for example one written by an older
+version of the code, is treated as missing and replaced.
+
+The key includes frr_config_topo.ADDRESS_SCHEME and FORMAT_VERSION, so a
+change to the generators is picked up by changing those values.
+"""
+
+import gc
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import time
+
+import networkx
+
+import frr_config_topo
+import torus_topo
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+FORMAT_VERSION = 1
+
+
+def cache_key(num_rings: int, num_ring_nodes: int, ground_stations: bool, inclination: float,
+              annotate: bool) -> str:
+    """
+    Return the key of a topology with the given parameters.
+    """
+    params = {
+        "format": FORMAT_VERSION,
+        "rings": num_rings,
+        "routers": num_ring_nodes,
+        "ground_stations": ground_stations,
+        "inclination": inclination,
+        "address_scheme": frr_config_topo.ADDRESS_SCHEME if annotate else None,
+    }
+    text = json.dumps(params, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def cache_path(key: str, cache_dir: str = CACHE_DIR) -> str:
+    return os.path.join(cache_dir, f"topo-{key}.pickle")
+
+
+def save_graph(path: str, graph: networkx.Graph) -> None:
+    """
+    Write a graph to the cache. Written to a temporary file and renamed so
+    that a concurrent reader never sees a partial file.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(graph, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_graph(path: str) -> networkx.Graph | None:
+    """
+    Read a graph from the cache, None if missing or unreadable.
+    """
+    # Collection passes while unpickling many small objects only cost time
+    gc.disable()
+    try:
+        with open(path, "rb") as f:
+            graph = pickle.load(f)
+        cat_nums = [graph.nodes[name]["orbit"].cat_num for name in torus_topo.satellites(graph)]
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # Stale or incompatible pickles can fail in many ways
+        print(f"ignoring topology cache {path}: {e!r}")
+        return None
+    finally:
+        gc.enable()
+    # Keep catalog numbers of newly created orbits unique
+    if len(cat_nums) > 0:
+        torus_topo.OrbitData.cat_num_count = max(torus_topo.OrbitData.cat_num_count, max(cat_nums) + 1)
+    return graph
+
+
+def create_network(num_rings: int = torus_topo.NUM_RINGS, num_ring_nodes: int = torus_topo.NUM_RING_NODES,
+                   ground_stations: bool = True, inclination: float = torus_topo.INCLINATION,
+                   annotate: bool = False, cache_dir: str | None = CACHE_DIR) -> networkx.Graph:
+    """
+    Return a torus network, optionally annotated with FRR configs, from the
+    cache if present. Otherwise build it and add it to the cache.
+    A cache_dir of None disables the cache.
+    """
+    if cache_dir is not None:
+        key = cache_key(num_rings, num_ring_nodes, ground_stations, inclination, annotate)
+        path = cache_path(key, cache_dir)
+        graph = load_graph(path)
+        if graph is not None:
+            return graph
+
+    graph = torus_topo.create_network(num_rings, num_ring_nodes, ground_stations, inclination)
+    if annotate:
+        frr_config_topo.annotate_graph(graph)
+    if cache_dir is not None:
+        save_graph(path, graph)
+    return graph
+
+
+def run_topo_cache_test() -> bool:
+    """
+    Build an annotated network through the cache, then load it back.
+    """
+    with tempfile.TemporaryDirectory() as cache_dir:
+        graph = create_network(6, 6, True, annotate=True, cache_dir=cache_dir)
+        key = cache_key(6, 6, True, torus_topo.INCLINATION, True)
+        if not os.path.exists(cache_path(key, cache_dir)):
+            return False
+        if key == cache_key(6, 6, True, torus_topo.INCLINATION, False):
+            return False
+
+        loaded = create_network(6, 6, True, annotate=True, cache_dir=cache_dir)
+        if list(loaded.nodes) != list(graph.nodes) or list(loaded.edges) != list(graph.edges):
+            return False
+        name = torus_topo.get_node_name(2, 3)
+        if loaded.nodes[name]["ospf"] != graph.nodes[name]["ospf"]:
+            return False
+        if loaded.nodes[name]["orbit"] != graph.nodes[name]["orbit"]:
+            return False
+        neighbor = next(iter(graph.adj[name]))
+        if loaded.adj[name][neighbor]["ip"] != graph.adj[name][neighbor]["ip"]:
+            return False
+        if torus_topo.OrbitData.cat_num_count <= loaded.nodes[name]["orbit"].cat_num:
+            return False
+
+        # Unloadable cache files are rebuilt and replaced
+        path = cache_path(key, cache_dir)
+        for data in (b"cno_such_module\nGraph\n.", pickle.dumps([1, 2]), b"garbage"):
+            with open(path, "wb") as f:
+                f.write(data)
+            rebuilt = create_network(6, 6, True, annotate=True, cache_dir=cache_dir)
+            if list(rebuilt.edges) != list(graph.edges) or load_graph(path) is None:
+                return False
+        return True
+
+
+if __name__ == "__main__":
+    for attempt in ("build", "cached"):
+        start = time.time()
+        graph = create_network(annotate=True)
+        print(f"{attempt}: {graph.number_of_nodes()} nodes in {time.time() - start:.3f}s")
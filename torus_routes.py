@@ -0,0 +1,385 @@
+"""
+Closed form routing over a torus topology.
+
+In a torus built by torus_topo.create_network, satellite R{a}_{b} has links
+to the neighboring satellites on its ring (b +/- 1) and to the satellites
+with the same index on the neighboring rings (a +/- 1), with wraparound.
+The hop count and next hop between two satellites follow from the ring and
+node offsets without any route tables.
+
+When links are down, a shortest path is still used if one of the
+dimension ordered paths (ring offset first or node offset first) between
+the nodes has no down links. Only when all of these are blocked, or for
+ground stations, does a query fall back to a breadth first search from
+the source, which is cached. A link change updates the down link index for
+that link only, and drops only the cached searches whose shortest routes
+it can change.
+
+A constellation with several shells is not one torus, so all of its
+queries use the search.
+"""
+
+from collections.abc import Mapping, Iterator
+
+import numpy
+
+import compact_topo
+import constellation
+import route_matrix
+import torus_topo
+
+
+def _directions(offset: int, size: int) -> list[tuple[int, int]]:
+    """
+    Return the (direction, steps) choices giving a shortest move of offset
+    around a ring of the given size.
+    """
+    offset = offset % size
+    if offset == 0:
+        return [(1, 0)]
+    forward = (1, offset)
+    backward = (-1, size - offset)
+    if offset * 2 < size:
+        return [forward]
+    if offset * 2 > size:
+        return [backward]
+    return [forward, backward]
+
+
+def _blocked(down: numpy.ndarray | None, start: int, direction: int, steps: int, size: int) -> bool:
+    """
+    Check if any down link position is on a move of steps from start.
+    Link position p joins p and p + 1.
+    """
+    if down is None or steps == 0:
+        return False
+    first = start if direction > 0 else (start - steps) % size
+    return bool((((down - first) % size) < steps).any())
+
+
+def torus_distance(topo: compact_topo.CompactTopo, sources: numpy.ndarray, dests: numpy.ndarray) -> numpy.ndarray:
+    """
+    Hop count between each source and dest node id in an intact torus.
+    Arrays broadcast together. Entries involving ground stations, or
+    satellites in different shells, are -1.
+    """
+    # Torus of each ring
+    first = numpy.full(max(topo.rings, 1), -1, dtype=numpy.int64)
+    rings = numpy.ones(max(topo.rings, 1), dtype=numpy.int64)
+    ring_nodes = numpy.ones(max(topo.rings, 1), dtype=numpy.int64)
+    for first_ring, shell_rings, shell_ring_nodes in topo.shells:
+        first[first_ring:first_ring + shell_rings] = first_ring
+        rings[first_ring:first_ring + shell_rings] = shell_rings
+        ring_nodes[first_ring:first_ring + shell_rings] = shell_ring_nodes
+
+    ring1 = topo.ring[sources].astype(numpy.int64)
+    ring2 = topo.ring[dests].astype(numpy.int64)
+    index1 = topo.ring_index[sources].astype(numpy.int64)
+    index2 = topo.ring_index[dests].astype(numpy.int64)
+    shell1 = numpy.maximum(ring1, 0)
+    size = rings[shell1]
+    nodes = ring_nodes[shell1]
+    ring_offset = (ring2 - ring1) % size
+    node_offset = (index2 - index1) % nodes
+    distance = (numpy.minimum(ring_offset, size - ring_offset)
+                + numpy.minimum(node_offset, nodes - node_offset))
+    other_shell = first[shell1] != first[numpy.maximum(ring2, 0)]
+    return numpy.where((ring1 < 0) | (ring2 < 0) | other_shell, -1, distance)
+
+
+class TorusRouter:
+    """
+    Answers route queries for a torus topology without route tables.
+    """
+
+    def __init__(self, topo: compact_topo.CompactTopo) -> None:
+        self.topo = topo
+        self.rings = topo.rings
+        self.ring_nodes = topo.ring_nodes
+        # Closed form routes only apply to a single torus
+        self.torus = topo.shells == [(0, topo.rings, topo.ring_nodes)]
+        self.analytic_count = 0
+        self.fallback_count = 0
+        self.refresh()
+
+    def refresh(self) -> None:
+        """
+        Rebuild the index of down links from the topology edge state.
+        """
+        intra: dict[int, list[int]] = {}  # ring -> down link positions
+        inter: dict[int, list[int]] = {}  # ring index -> down link positions
+        down_edges = numpy.flatnonzero(~self.topo.edge_up) if self.torus else []
+        for edge in down_edges:
+            for inter_ring, key, pos in self._link_positions(edge):
+                (inter if inter_ring else intra).setdefault(key, []).append(pos)
+        self.down_intra = {k: numpy.array(v) for k, v in intra.items()}
+        self.down_inter = {k: numpy.array(v) for k, v in inter.items()}
+        self.search_cache: dict[int, tuple[numpy.ndarray, numpy.ndarray]] = {}
+
+    def _link_positions(self, edge: int) -> list[tuple[bool, int, int]]:
+        """
+        Return the (inter ring, ring or ring index, position) entries of an
+        edge in the down link index.
+        """
+        node1, node2 = self.topo.edge_nodes[edge]
+        ring1, ring2 = self.topo.ring[node1], self.topo.ring[node2]
+        index1, index2 = self.topo.ring_index[node1], self.topo.ring_index[node2]
+        positions = []
+        if ring1 < 0 or ring2 < 0:
+            return positions
+        if ring1 == ring2:
+            for pos, other in ((index1, index2), (index2, index1)):
+                if (pos + 1) % self.ring_nodes == other:
+                    positions.append((False, int(ring1), int(pos)))
+        if index1 == index2:
+            for pos, other in ((ring1, ring2), (ring2, ring1)):
+                if (pos + 1) % self.rings == other:
+                    positions.append((True, int(index1), int(pos)))
+        return positions
+
+    def set_link_state(self, node1: str, node2: str, up: bool) -> bool:
+        """
+        Set the state of a link, and update the down link index and the
+        cached searches for that link only.
+        """
+        edge = self.topo.edge_id(node1, node2)
+        if edge is None:
+            return False
+        if bool(self.topo.edge_up[edge]) == up:
+            return True
+        self.topo.edge_up[edge] = up
+        if self.torus:
+            for inter_ring, key, pos in self._link_positions(edge):
+                index = self.down_inter if inter_ring else self.down_intra
+                down = index.get(key, numpy.array([], dtype=int))
+                if up:
+                    # Remove one entry, a link can be listed twice on a ring of two
+                    down = numpy.delete(down, numpy.flatnonzero(down == pos)[:1])
+                else:
+                    down = numpy.append(down, pos)
+                index[key] = down
+
+        # A cached search is kept while its routes stay shortest: a link going
+        # down that joins nodes one hop apart from the source may be on a
+        # route, a link coming up may shorten routes if its nodes are further apart.
+        id1, id2 = self.topo.edge_nodes[edge]
+        for source in list(self.search_cache):
+            hops = self.search_cache[source][1]
+            hops1, hops2 = int(hops[id1]), int(hops[id2])
+            if up:
+                stale = (hops1 < 0) != (hops2 < 0) or abs(hops1 - hops2) > 1
+            else:
+                stale = hops1 >= 0 and hops2 >= 0 and abs(hops1 - hops2) == 1
+            if stale:
+                del self.search_cache[source]
+        return True
+
+    def _analytic(self, source: int, dest: int) -> tuple[int, int] | None:
+        """
+        Return (hops, next hop id) along a dimension ordered shortest path
+        without down links, or None.
+        """
+        ring1, index1 = int(self.topo.ring[source]), int(self.topo.ring_index[source])
+        ring2, index2 = int(self.topo.ring[dest]), int(self.topo.ring_index[dest])
+        if ring1 < 0 or ring2 < 0:
+            return None
+        for ring_dir, ring_steps in _directions(ring2 - ring1, self.rings):
+            for node_dir, node_steps in _directions(index2 - index1, self.ring_nodes):
+                hops = ring_steps + node_steps
+                if hops == 0:
+                    return 0, source
+
+                # Ring offset first: inter ring links at index1, then ring links on ring2
+                if not _blocked(self.down_inter.get(index1), ring1, ring_dir, ring_steps, self.rings) and \
+                        not _blocked(self.down_intra.get(ring2), index1, node_dir, node_steps, self.ring_nodes):
+                    if ring_steps > 0:
+                        return hops, self._node_id((ring1 + ring_dir) % self.rings, index1)
+                    return hops, self._node_id(ring1, (index1 + node_dir) % self.ring_nodes)
+
+                # Node offset first: ring links on ring1, then inter ring links at index2
+                if not _blocked(self.down_intra.get(ring1), index1, node_dir, node_steps, self.ring_nodes) and \
+                        not _blocked(self.down_inter.get(index2), ring1, ring_dir, ring_steps, self.rings):
+                    if node_steps > 0:
+                        return hops, self._node_id(ring1, (index1 + node_dir) % self.ring_nodes)
+                    return hops, self._node_id((ring1 + ring_dir) % self.rings, index1)
+        return None
+
+    def _node_id(self, ring: int, index: int) -> int:
+        return self.topo.name_to_id[torus_topo.get_node_name(ring, index)]
+
+    def _search(self, source: int, dest: int) -> tuple[int, int] | None:
+        if source not in self.search_cache:
+            next_hop, hops = route_matrix.bfs_routes(self.topo, numpy.array([source]))
+            self.search_cache[source] = (next_hop[0], hops[0])
+        next_hop, hops = self.search_cache[source]
+        if hops[dest] < 0:
+            return None
+        return int(hops[dest]), int(next_hop[dest])
+
+    def route_ids(self, source: int, dest: int) -> tuple[int, int] | None:
+        """
+        Return (hops, next hop id) from source to dest node ids, or None if unreachable.
+        """
+        result = self._analytic(source, dest) if self.torus else None
+        if result is not None:
+            self.analytic_count += 1
+            return result
+        self.fallback_count += 1
+        return self._search(source, dest)
+
+    def route(self, source: str, dest: str) -> tuple[int, str] | None:
+        """
+        Return (path_len, next hop) from source to dest, or None if unreachable.
+        """
+        result = self.route_ids(self.topo.name_to_id[source], self.topo.name_to_id[dest])
+        if result is None:
+            return None
+        return result[0], self.topo.names[result[1]]
+
+    def tables(self) -> "RouterTables":
+        return RouterTables(self)
+
+    def trace_path(self, start_node_name: str, target_node_name: str) -> bool:
+        return torus_topo.trace_path(start_node_name, target_node_name, self.tables())
+
+
+class RouterTables(Mapping):
+    """
+    Route table view over a TorusRouter for use with torus_topo.trace_path.
+    """
+
+    def __init__(self, router: TorusRouter) -> None:
+        self.router = router
+
+    def __getitem__(self, source: str) -> "RouterRow":
+        if source not in self.router.topo.name_to_id:
+            raise KeyError(source)
+        return RouterRow(self.router, source)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.router.topo.names)
+
+    def __len__(self) -> int:
+        return len(self.router.topo.names)
+
+
+class RouterRow(Mapping):
+    """
+    Routes from one source node, computed on demand.
+    """
+
+    def __init__(self, router: TorusRouter, source: str) -> None:
+        self.router = router
+        self.source = source
+
+    def __getitem__(self, dest: str) -> tuple[int, str]:
+        if dest == self.source or dest not in self.router.topo.name_to_id:
+            raise KeyError(dest)
+        result = self.router.route(self.source, dest)
+        if result is None:
+            raise KeyError(dest)
+        return result
+
+    def __iter__(self) -> Iterator[str]:
+        return (name for name in self.router.topo.names if name in self)
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+
+def run_torus_routes_test() -> bool:
+    """
+    Compare closed form routes with the route matrix, with and without down links.
+    """
+    topo = compact_topo.create_compact_network(7, 6)
+    router = TorusRouter(topo)
+    rng = numpy.random.default_rng(2)
+
+    for down_count in (0, 6, 20):
+        topo.edge_up[:] = True
+        links = numpy.flatnonzero(topo.node_type[topo.edge_nodes[:, 0]] == compact_topo.NODE_SAT)
+        topo.edge_up[rng.choice(links, size=down_count, replace=False)] = False
+        router.refresh()
+        matrix = route_matrix.generate_route_matrix(topo)
+        no_hop = route_matrix.no_route(matrix.hops)
+
+        for source in range(topo.num_nodes()):
+            for dest in range(topo.num_nodes()):
+                result = router.route_ids(source, dest)
+                if result is None:
+                    if matrix.hops[source, dest] != no_hop:
+                        return False
+                    continue
+                hops, next_hop = result
+                if hops != matrix.hops[source, dest]:
+                    return False
+                if source == dest:
+                    continue
+                # The next hop must be an up neighbor one hop closer
+                edge = topo.edge_id(topo.names[source], topo.names[next_hop])
+                if edge is None or not topo.edge_up[edge]:
+                    return False
+                if matrix.hops[next_hop, dest] != hops - 1:
+                    return False
+
+    if router.fallback_count == 0 or router.analytic_count == 0:
+        return False
+    if not router.trace_path(torus_topo.get_node_name(0, 0), torus_topo.get_node_name(3, 4)):
+        return False
+
+    # Single link changes update the index and cache in place
+    down_edges = numpy.flatnonzero(~topo.edge_up)[:6]
+    up_edges = rng.choice(numpy.flatnonzero(topo.edge_up[links]), size=6, replace=False)
+    kept = 0
+    for step, edge in enumerate(list(down_edges) + list(links[up_edges])):
+        node1, node2 = (topo.names[n] for n in topo.edge_nodes[edge])
+        if not router.set_link_state(node1, node2, step < 6):
+            return False
+        kept += len(router.search_cache)
+        matrix = route_matrix.generate_route_matrix(topo)
+        no_hop = route_matrix.no_route(matrix.hops)
+        for source in range(topo.num_nodes()):
+            for dest in range(topo.num_nodes()):
+                result = router.route_ids(source, dest)
+                hops = no_hop if result is None else result[0]
+                if hops != matrix.hops[source, dest]:
+                    return False
+                if result is not None and source != dest:
+                    edge_id = topo.edge_id(topo.names[source], topo.names[result[1]])
+                    if edge_id is None or not topo.edge_up[edge_id] or matrix.hops[result[1], dest] != hops - 1:
+                        return False
+    if kept == 0 or router.set_link_state("R0_0", "R3_3", False):
+        return False
+    intra = {k: sorted(v) for k, v in router.down_intra.items() if len(v) > 0}
+    inter = {k: sorted(v) for k, v in router.down_inter.items() if len(v) > 0}
+    router.refresh()
+    if intra != {k: sorted(v) for k, v in router.down_intra.items()} or \
+            inter != {k: sorted(v) for k, v in router.down_inter.items()}:
+        return False
+
+    # Shells of different sizes are not one torus: routes come from the search
+    topo = constellation.create_compact_constellation(
+        [constellation.Shell(53.0, 24, 4, 1, 550), constellation.Shell(70.0, 18, 3, 0, 600)])
+    router = TorusRouter(topo)
+    matrix = route_matrix.generate_route_matrix(topo)
+    no_hop = route_matrix.no_route(matrix.hops)
+    for source in range(topo.num_nodes()):
+        for dest in range(topo.num_nodes()):
+            result = router.route_ids(source, dest)
+            hops = no_hop if result is None else result[0]
+            if hops != matrix.hops[source, dest]:
+                return False
+    if router.analytic_count != 0:
+        return False
+
+    # Ideal distances are within a shell
+    sats = topo.satellite_ids()
+    distance = torus_distance(topo, sats[:, None], sats[None, :])
+    same_shell = (topo.ring[sats][:, None] < 4) == (topo.ring[sats][None, :] < 4)
+    if not numpy.array_equal(distance[same_shell], matrix.hops[sats][:, sats][same_shell]):
+        return False
+    return bool((distance[~same_shell] == -1).all())
+
+
+if __name__ == "__main__":
+    print(run_torus_routes_test())
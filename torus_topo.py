@@ -13,13 +13,16 @@ import datetime
 # Default network size
 NUM_RINGS = 40
 NUM_RING_NODES = 40
+# Default orbit inclination, degrees
+INCLINATION = 53.9
 TYPE = "type"
 TYPE_SAT = "satellite"
 TYPE_GROUND = "ground_station"
 LAT = "latitude"
 LON = "longitude"
 
-def create_network(num_rings: int =NUM_RINGS, num_ring_nodes: int =NUM_RING_NODES, ground_stations: bool = True) -> networkx.Graph:
+def create_network(num_rings: int =NUM_RINGS, num_ring_nodes: int =NUM_RING_NODES, ground_stations: bool = True,
+                   inclination: float = INCLINATION) -> networkx.Graph:
     """
     Create a torus network of the given size annotated with orbital information.
     """
@@ -27,7 +30,7 @@ def create_network(num_rings: int =NUM_RINGS, num_ring_nodes: int =NUM_RING_NODE
     graph.graph["rings"] = num_rings
     graph.graph["ring_nodes"] = num_ring_nodes
     graph.graph["ring_list"] = []
-    graph.graph["inclination"] = 53.9
+    graph.graph["inclination"] = inclination
     prev_ring_num = None
     for ring_num in range(num_rings):
         create_ring(graph, ring_num, num_ring_nodes)
@@ -73,7 +76,9 @@ def satellites(graph: networkx.Graph) -> list[str]:
 LINE1 = "1 {:05d}U 24067A   {:2d}{:012.8f}  .00009878  00000-0  47637-3 0  999"
 # Use a perigee of 297 (could just be 0). Canned data for orbit count, prbits per day,
 # and exccentricity
-LINE2 = "2 {:05d} {:8.4f} {:8.4f} 0003572 297.6243 {:8.4f} 15.33600000 6847"
+LINE2 = "2 {:05d} {:8.4f} {:8.4f} 0003572 297.6243 {:8.4f} {:11.8f} 6847"
+# Default mean motion, revolutions per day
+MEAN_MOTION = 15.336
 
 
 @dataclass
@@ -84,6 +89,7 @@ class OrbitData:
     inclination: float  # degrees
     mean_anomaly: float  # degrees
     cat_num: int = 0
+    mean_motion: float = MEAN_MOTION  # revolutions per day
 
     cat_num_count: ClassVar[int] = 1
 
@@ -91,6 +97,15 @@ class OrbitData:
         self.cat_num = OrbitData.cat_num_count
         OrbitData.cat_num_count += 1
 
+    @staticmethod
+    def reserve_cat_nums(count: int) -> int:
+        """
+        Reserve a block of consecutive catalog numbers, return the first.
+        """
+        first = OrbitData.cat_num_count
+        OrbitData.cat_num_count += count
+        return first
+
     @staticmethod
     def tle_check_sum(line: str) -> str:
         val = 0
@@ -108,7 +123,8 @@ class OrbitData:
         
         l1 = LINE1.format(self.cat_num, year, day, 342)
         l2 = LINE2.format(
-            self.cat_num, self.inclination, self.right_ascension, self.mean_anomaly
+            self.cat_num, self.inclination, self.right_ascension, self.mean_anomaly,
+            self.mean_motion
         )
         l1 = l1 + OrbitData.tle_check_sum(l1)
         l2 = l2 + OrbitData.tle_check_sum(l2)
@@ -120,7 +136,6 @@ def get_node_name(ring_num: int, node_num: int) -> str:
 
 
 def create_ring(graph: networkx.Graph, ring_num: int , num_ring_nodes: int) -> None:
-    prev_node_name: str|None = None
     ring_nodes: list[str] = []
     graph.graph["ring_list"].append(ring_nodes)
 
@@ -128,71 +143,62 @@ def create_ring(graph: networkx.Graph, ring_num: int , num_ring_nodes: int) -> N
     num_rings: int = graph.graph["rings"]
     right_ascension: float = 360 / num_rings * ring_num
     inclination: float = graph.graph["inclination"]
+    first_cat_num = OrbitData.reserve_cat_nums(num_ring_nodes)
 
+    nodes = []
     for node_num in range(num_ring_nodes):
         # Create a node in the ring
         node_name = get_node_name(ring_num, node_num)
-        graph.add_node(node_name)
-        graph.nodes[node_name][TYPE] = TYPE_SAT
         mean_anomaly = 360 / num_ring_nodes * node_num
         # offset 1/2 spacing for odd rings
         if ring_num % 2 == 1:
             mean_anomaly += 360 / num_ring_nodes / 2
-        orbit = OrbitData(right_ascension, inclination, mean_anomaly)
-        orbit.assign_cat_num()
-        graph.nodes[node_name]["orbit"] = orbit
+        orbit = OrbitData(right_ascension, inclination, mean_anomaly, first_cat_num + node_num)
+        nodes.append((node_name, {TYPE: TYPE_SAT, "orbit": orbit}))
         ring_nodes.append(node_name)
+    graph.add_nodes_from(nodes)
 
-        # Create a link to the previously created node
-        if prev_node_name is not None:
-            graph.add_edge(prev_node_name, node_name)
-            graph.edges[prev_node_name, node_name]["inter_ring"] = False
-        prev_node_name = node_name
-    # Create a link between first and last node
-    if prev_node_name is not None:
-        graph.add_edge(prev_node_name, get_node_name(ring_num, 0))
-        graph.edges[prev_node_name, get_node_name(ring_num, 0)]["inter_ring"] = False
+    # Link each node to the next, and the last node to the first
+    edges = []
+    for node_num in range(num_ring_nodes):
+        next_name = ring_nodes[(node_num + 1) % num_ring_nodes]
+        edges.append((ring_nodes[node_num], next_name, {"inter_ring": False}))
+    graph.add_edges_from(edges)
 
 
 def connect_rings(graph: networkx.Graph, ring1: int, ring2: int, num_ring_nodes: int) -> None:
-    for node_num in range(num_ring_nodes):
-        node1_name = get_node_name(ring1, node_num)
-        node2_name = get_node_name(ring2, node_num)
-        graph.add_edge(node1_name, node2_name)
-        graph.edges[node1_name, node2_name]["inter_ring"] = True
+    graph.add_edges_from(
+        (get_node_name(ring1, node_num), get_node_name(ring2, node_num), {"inter_ring": True})
+        for node_num in range(num_ring_nodes)
+    )
+
+
+# Ground stations: name, latitude, longitude
+GROUND_STATIONS: list[tuple[str, float, float]] = [
+    ("G_PAO", 37.44651, -122.13861),
+    ("G_SYD", -33.94056, 151.17268),
+    ("G_ZRH", 47.45516, 8.56350),
+    ("G_HND", 35.54852, 139.78079),
+]
 
 
 def add_ground_stations(graph: networkx.Graph) -> None:
     # Create ground stations with links
     # We need links because mininet doesn't handle nodes without links the
     # way we want (e.g. will not call config on the mininet node)
-    graph.add_node("G_PAO")
-    node = graph.nodes["G_PAO"]
-    node[TYPE] = TYPE_GROUND
-    node[LAT] = 37.44651
-    node[LON] = -122.13861
-
-    graph.add_node("G_SYD")
-    node = graph.nodes["G_SYD"]
-    node[TYPE] = TYPE_GROUND
-    node[LAT] = -33.94056
-    node[LON] = 151.17268
-    graph.add_edge("G_PAO", "G_SYD")
-
-    graph.add_node("G_ZRH")
-    node = graph.nodes["G_ZRH"]
-    node[TYPE] = TYPE_GROUND
-    node[LAT] = 47.45516
-    node[LON] = 8.56350
-    graph.add_edge("G_SYD", "G_ZRH")
-
-    graph.add_node("G_HND")
-    node = graph.nodes["G_HND"]
-    node[TYPE] = TYPE_GROUND
-    node[LAT] = 35.54852
-    node[LON] = 139.78079
-    graph.add_edge("G_ZRH", "G_HND")
-    graph.add_edge("G_HND", "G_PAO")
+    prev_name: str | None = None
+    for name, lat, lon in GROUND_STATIONS:
+        graph.add_node(name)
+        node = graph.nodes[name]
+        node[TYPE] = TYPE_GROUND
+        node[LAT] = lat
+        node[LON] = lon
+        if prev_name is not None:
+            graph.add_edge(prev_name, name)
+        prev_name = name
+    # Close the ring of ground station links
+    if len(GROUND_STATIONS) > 2:
+        graph.add_edge(GROUND_STATIONS[-1][0], GROUND_STATIONS[0][0])
 
 
 #
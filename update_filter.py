@@ -0,0 +1,137 @@
+"""
+Send only the updates that change the state of the simulated network.
+
+UpdateFilter sits in front of a simclient.Client and remembers the last
+state sent for each link and the last set of uplink satellites sent for
+each ground station. An update that matches what was last sent is
+dropped instead of making a request, so an unchanged station or a link
+reported from both of its satellites is sent once.
+
+Uplinks are compared by satellite only. The driver uses the distance when
+an uplink is created, so a change of distance alone does not need to be
+sent.
+
+When the client reports that it reconnected to the driver after a failure,
+the driver may have restarted without the state sent before. The filter
+then forgets what was sent and flush() returns True, so the caller can send
+the state of every link and station again.
+"""
+
+import typing
+
+
+def link_key(node1: str, node2: str) -> tuple[str, str]:
+    return (node1, node2) if node1 <= node2 else (node2, node1)
+
+
+class UpdateFilter:
+    """
+    Client wrapper that drops updates matching the last sent state.
+    """
+
+    def __init__(self, client: typing.Any) -> None:
+        self.client = client
+        self.link_states: dict[tuple[str, str], bool] = {}
+        self.uplinks: dict[str, frozenset[str]] = {}
+        self.sent = 0
+        self.suppressed = 0
+
+    def set_link_state(self, node1: str, node2: str, up: bool) -> None:
+        key = link_key(node1, node2)
+        if self.link_states.get(key) == up:
+            self.suppressed += 1
+            return
+        self.link_states[key] = up
+        self.sent += 1
+        self.client.set_link_state(node1, node2, up)
+
+    def set_uplinks(self, ground_node: str, links: list[tuple[str, int]]) -> None:
+        satellites = frozenset(link[0] for link in links)
+        if self.uplinks.get(ground_node) == satellites:
+            self.suppressed += 1
+            return
+        self.uplinks[ground_node] = satellites
+        self.sent += 1
+        self.client.set_uplinks(ground_node, links)
+
+    def flush(self) -> bool:
+        """
+        Send the pending updates. Returns True if the client reconnected and
+        the sent state was forgotten.
+        """
+        self.client.flush()
+        if getattr(self.client, "reconnected", False):
+            self.client.reconnected = False
+            self.reset()
+            return True
+        return False
+
+    def reset(self) -> None:
+        """
+        Forget the sent state, so that the next update of everything is sent.
+        Use when the receiver restarts.
+        """
+        self.link_states.clear()
+        self.uplinks.clear()
+
+
+def run_update_filter_test() -> bool:
+    """
+    Check which updates are passed to the client.
+    """
+
+    class Recorder:
+        def __init__(self) -> None:
+            self.calls: list[tuple] = []
+
+        def set_link_state(self, node1: str, node2: str, up: bool) -> None:
+            self.calls.append(("link", node1, node2, up))
+
+        def set_uplinks(self, ground_node: str, links: list[tuple[str, int]]) -> None:
+            self.calls.append(("uplinks", ground_node, tuple(links)))
+
+        def flush(self) -> None:
+            pass
+
+    recorder = Recorder()
+    update_filter = UpdateFilter(recorder)
+    update_filter.set_link_state("R0_0", "R1_0", False)
+    update_filter.set_link_state("R1_0", "R0_0", False)  # Same edge from the other end
+    update_filter.set_link_state("R0_0", "R1_0", True)
+    update_filter.set_uplinks("G_0", [("R0_0", 900)])
+    update_filter.set_uplinks("G_0", [("R0_0", 850)])  # Only the distance changed
+    update_filter.set_uplinks("G_0", [("R0_0", 800), ("R0_1", 1200)])
+    update_filter.set_uplinks("G_0", [("R0_1", 1100), ("R0_0", 700)])
+    update_filter.set_uplinks("G_1", [])
+    update_filter.set_uplinks("G_1", [])
+    expected = [
+        ("link", "R0_0", "R1_0", False),
+        ("link", "R0_0", "R1_0", True),
+        ("uplinks", "G_0", (("R0_0", 900),)),
+        ("uplinks", "G_0", (("R0_0", 800), ("R0_1", 1200))),
+        ("uplinks", "G_1", ()),
+    ]
+    if recorder.calls != expected or update_filter.sent != 5 or update_filter.suppressed != 4:
+        return False
+    update_filter.reset()
+    update_filter.set_link_state("R1_0", "R0_0", True)
+    if recorder.calls[-1] != ("link", "R1_0", "R0_0", True) or update_filter.sent != 6:
+        return False
+
+    # After the client reconnects to the driver, unchanged state is sent again
+    update_filter.set_uplinks("G_0", [("R0_0", 800)])
+    if update_filter.flush():
+        return False
+    update_filter.set_uplinks("G_0", [("R0_0", 800)])
+    if update_filter.sent != 7:
+        return False
+    recorder.reconnected = True  # type: ignore
+    if not update_filter.flush():
+        return False
+    update_filter.set_uplinks("G_0", [("R0_0", 800)])
+    update_filter.set_link_state("R1_0", "R0_0", True)
+    return update_filter.sent == 9 and not recorder.reconnected  # type: ignore
+
+
+if __name__ == "__main__":
+    print(run_update_filter_test())
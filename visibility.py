@@ -0,0 +1,127 @@
+"""
+Elevation, azimuth and range between ground stations and satellites.
+
+Computes a ground stations x satellites matrix of look angles in one
+step from earth fixed (ITRS) satellite positions, such as those from
+sat_positions. Each station has a precomputed ECEF position and local
+east / north / up unit vectors, so the matrices come from a few matrix
+products without propagating any satellite again.
+"""
+
+from dataclasses import dataclass
+import datetime
+
+import numpy
+from skyfield.api import load, wgs84  # type: ignore
+
+import sat_positions
+import sat_records
+import torus_topo
+
+
+@dataclass
+class StationFrames:
+    """Earth fixed positions and local frames of a set of ground stations"""
+
+    ecef: numpy.ndarray  # km, shape (stations, 3)
+    east: numpy.ndarray  # unit vectors, shape (stations, 3)
+    north: numpy.ndarray
+    up: numpy.ndarray
+
+    def select(self, ids) -> "StationFrames":
+        """
+        Return the frames of a subset of the stations.
+        """
+        return StationFrames(self.ecef[ids], self.east[ids], self.north[ids], self.up[ids])
+
+
+def station_frames(lat: numpy.ndarray, lon: numpy.ndarray, height: numpy.ndarray | None = None) -> StationFrames:
+    """
+    Build the frames for stations at WGS84 latitudes and longitudes in
+    degrees and heights in km.
+    """
+    lat = numpy.radians(numpy.asarray(lat, dtype=float))
+    lon = numpy.radians(numpy.asarray(lon, dtype=float))
+    height = numpy.zeros(lat.shape) if height is None else numpy.asarray(height, dtype=float)
+    sin_lat, cos_lat = numpy.sin(lat), numpy.cos(lat)
+    sin_lon, cos_lon = numpy.sin(lon), numpy.cos(lon)
+
+    # Prime vertical radius of curvature
+    radius = sat_positions.WGS84_RADIUS / numpy.sqrt(1.0 - sat_positions.WGS84_E2 * sin_lat * sin_lat)
+    ecef = numpy.stack([
+        (radius + height) * cos_lat * cos_lon,
+        (radius + height) * cos_lat * sin_lon,
+        (radius * (1.0 - sat_positions.WGS84_E2) + height) * sin_lat,
+    ], axis=-1)
+    east = numpy.stack([-sin_lon, cos_lon, numpy.zeros(lat.shape)], axis=-1)
+    north = numpy.stack([-sin_lat * cos_lon, -sin_lat * sin_lon, cos_lat], axis=-1)
+    up = numpy.stack([cos_lat * cos_lon, cos_lat * sin_lon, sin_lat], axis=-1)
+    return StationFrames(ecef, east, north, up)
+
+
+def look_angles(frames: StationFrames, sat_ecef: numpy.ndarray,
+                sat_ids: numpy.ndarray | None = None) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+    """
+    Return elevation and azimuth in degrees and range in km, each of shape
+    (stations, satellites), for satellites at earth fixed positions (satellites, 3).
+    If sat_ids is given, only those satellites are included.
+    """
+    if sat_ids is not None:
+        sat_ecef = sat_ecef[sat_ids]
+    # Components of (satellite - station) in each station frame, using
+    # s.v - g.v to avoid a (stations, satellites, 3) difference array.
+    up = frames.up @ sat_ecef.T - numpy.sum(frames.up * frames.ecef, axis=1)[:, None]
+    east = frames.east @ sat_ecef.T - numpy.sum(frames.east * frames.ecef, axis=1)[:, None]
+    north = frames.north @ sat_ecef.T - numpy.sum(frames.north * frames.ecef, axis=1)[:, None]
+    distance = numpy.sqrt(up * up + east * east + north * north)
+    elevation = numpy.degrees(numpy.arcsin(numpy.clip(up / distance, -1.0, 1.0)))
+    azimuth = numpy.degrees(numpy.arctan2(east, north)) % 360
+    return elevation, azimuth, distance
+
+
+def visible(frames: StationFrames, sat_ecef: numpy.ndarray, min_altitude: float) -> tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Return a (stations, satellites) bool matrix of satellites above min_altitude
+    degrees for each station, and the range matrix in km.
+    """
+    elevation, azimuth, distance = look_angles(frames, sat_ecef)
+    return elevation > min_altitude, distance
+
+
+def run_visibility_test() -> bool:
+    """
+    Compare the look angle matrices with skyfield altaz for each pair.
+    """
+    graph = torus_topo.create_network(10, 10)
+    ts = load.timescale()
+    names, satrecs = sat_records.build_satrecs(graph)
+    satellites = sat_records.build_earth_satellites(graph, ts)
+    time = datetime.datetime.now(tz=datetime.timezone.utc)
+    positions = sat_positions.Propagator(satrecs, ts).positions_at(time)
+
+    stations = [graph.nodes[name] for name in torus_topo.ground_stations(graph)]
+    lat = numpy.array([node[torus_topo.LAT] for node in stations])
+    lon = numpy.array([node[torus_topo.LON] for node in stations])
+    frames = station_frames(lat, lon)
+    elevation, azimuth, distance = look_angles(frames, positions.ecef)
+    if elevation.shape != (len(stations), len(names)):
+        return False
+
+    t = ts.from_datetime(time)
+    for g in range(len(stations)):
+        position = wgs84.latlon(lat[g], lon[g])
+        if numpy.abs(position.itrs_xyz.km - frames.ecef[g]).max() > 1e-6:
+            return False
+        for s in range(0, len(names), 7):
+            alt, az, d = (satellites[s] - position).at(t).altaz()
+            if abs(alt.degrees - elevation[g, s]) > 1e-3 or abs(d.km - distance[g, s]) > 0.01:
+                return False
+            if alt.degrees > -80 and abs((az.degrees - azimuth[g, s] + 180) % 360 - 180) > 1e-2:
+                return False
+
+    above, _ = visible(frames, positions.ecef, 0)
+    return bool((above == (elevation > 0)).all()) and above.any()
+
+
+if __name__ == "__main__":
+    print(run_visibility_test())